@@ -0,0 +1,114 @@
+"""
+Benchmark the queries and time spent authorizing owner and admin requests.
+
+Seeds a small in-memory database, then sends mutating requests as the owner of the
+resource, as an admin and as another user, counting the SQL statements each one runs. The
+authorization step alone is then timed with a cold session: the former sequence (load the
+resource, query the admin status, load the resource again in the view) against
+`auth.load_authorized`, which only loads the resource as tokens carry the role claim issued
+at login.
+
+Usage:
+    python benchmarks/bench_authorization.py [--repeat 2000]
+"""
+import argparse
+import contextlib
+import io
+import os
+
+os.environ.setdefault('JWT_KEY', 'benchmark-secret')
+
+from fixtures import best_of
+from flask_jwt_extended import create_access_token, verify_jwt_in_request
+from sqlalchemy import event
+# app.py prints the URL map when imported
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app
+from auth import load_authorized
+from init import db
+from models.post import Post
+from models.user import User
+from seeding import seed
+from token_versions import token_claims
+
+
+class QueryCounter:
+    """Count the SQL statements executed by an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._executed)
+
+    def _executed(self, *args):
+        self.count += 1
+
+    def take(self):
+        """Return the number of statements executed since the last call."""
+        count, self.count = self.count, 0
+        return count
+
+
+def legacy_lookup(post_id, user_id):
+    """Authorize the way admin_or_owner_only and the view used to, before load_authorized."""
+    post = db.session.get(Post, post_id)
+    if post is None or post.user_id != user_id:
+        db.session.scalar(db.select(User).where(User.id == user_id, User.is_admin))
+    return db.get_or_404(Post, post_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=2000, help='number of authorizations per timed run')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        seed(20, 10, 2, 20, 'benchmark', progress=lambda message: None)
+        counter = QueryCounter(db.engine)
+        # User 1 is the admin, the post belongs to user 2 and user 3 is another user
+        post_id = db.session.scalar(db.select(Post.id).where(Post.user_id == 2).limit(1))
+        # Tokens carry the same claims as those issued at login
+        tokens = {user_id: create_access_token(identity=user_id, additional_claims=token_claims(db.session.get(User, user_id))) for user_id in (1, 2, 3)}
+        headers = {user_id: {'Authorization': f'Bearer {token}'} for user_id, token in tokens.items()}
+
+    # Each request gets its own application context, and so a fresh session
+    client = app.test_client()
+    # Load the table of token versions checked by every request before counting
+    client.get('/users/2', headers=headers[2])
+    cases = [
+        ('PUT post', 'PUT', f'/posts/{post_id}', {'title': 'Updated title'}),
+        ('PUT post tags', 'PUT', f'/posts/{post_id}/tags', None),
+    ]
+    print(f'{"request":<16}{"owner":>8}{"admin":>8}{"other":>8}   SQL statements:status')
+    for label, method, url, body in cases:
+        counts = []
+        for user_id in (2, 1, 3):
+            counter.take()
+            # Each user sets different tags, so every retag writes the same number of changes
+            response = client.open(url, method=method, json=body or {'tags': [f'tag{user_id}']}, headers=headers[user_id])
+            counts.append(f'{counter.take()}:{response.status_code}')
+        print(f'{label:<16}' + ''.join(f'{count:>8}' for count in counts))
+
+    print(f'\n{"authorization":<28}{"queries":>8}{"time":>12}')
+    for label, user_id in (('owner', 2), ('admin', 1)):
+        for name, lookup in (('former', lambda: legacy_lookup(post_id, user_id)),
+                             ('load_authorized', lambda: load_authorized(Post, post_id))):
+            with app.test_request_context(headers=headers[user_id]):
+                verify_jwt_in_request()
+
+                def run():
+                    for _ in range(args.repeat):
+                        lookup()
+                        # A new request starts with an empty session
+                        db.session.expunge_all()
+                db.session.expunge_all()
+                counter.take()
+                lookup()
+                queries = counter.take()
+                db.session.expunge_all()
+                elapsed = best_of(5, run)
+            print(f'{label + ", " + name:<28}{queries:>8}{elapsed / args.repeat * 1e6:>10.1f}us')
+
+
+if __name__ == '__main__':
+    main()
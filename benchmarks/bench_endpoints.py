@@ -0,0 +1,499 @@
+"""
+Load-test every API endpoint against a seeded database and report latency percentiles.
+
+Boots the application against the database in SQLALCHEMY_KEY (a SQLite file in the temp
+directory by default), seeding it with `flask db seed` data when it has no users. Each
+scenario builds its authenticated requests up front, creating any rows it updates or
+deletes, then is timed in two modes:
+
+- micro: one request at a time through the Flask test client, without any network.
+- load: `--clients` concurrent keep-alive HTTP clients against a threaded server.
+
+For each scenario and mode the p50/p95/p99 latency, throughput, SQL queries per request and
+error responses are printed. `--output` writes them as JSON with the commit and settings of
+the run, and `--compare` prints the change from such a file.
+
+Usage:
+    python benchmarks/bench_endpoints.py [--mode micro|load|both] [--requests 200] [--clients 8]
+        [--only posts] [--output results.json] [--compare previous.json]
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# Concurrent clients need a database every thread can open, not a private in-memory one
+os.environ.setdefault('SQLALCHEMY_KEY', 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'minornote_bench.db'))
+os.environ.setdefault('JWT_KEY', 'benchmark-secret')
+
+from fixtures import percentile
+from sqlalchemy import event, func, inspect
+from werkzeug.serving import WSGIRequestHandler, make_server
+# app.py prints the URL map when imported
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app
+from counters import recount
+from init import db
+from models.comment import Comment
+from models.post import Post
+from models.tag import Tag
+from models.user import User
+from search import rebuild_index
+from seeding import WORDS, seed
+
+PASSWORD = 'testpassword'
+
+# Items created by each request of the bulk scenarios
+BULK_ITEMS = 100
+
+# A request to time, with its JSON body and headers
+Call = namedtuple('Call', ('method', 'url', 'body', 'headers'))
+
+# A named request generator; slow scenarios hash passwords and run fewer requests
+Scenario = namedtuple('Scenario', ('name', 'build', 'slow'))
+SCENARIOS = []
+
+
+def scenario(name, slow=False):
+    """Register a function building the calls of a scenario, given an Environment and a count."""
+    def register(build):
+        SCENARIOS.append(Scenario(name, build, slow))
+        return build
+    return register
+
+
+class QueryCounter:
+    """Count the SQL statements executed by the engine, from any thread."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._executed)
+
+    def _executed(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def take(self):
+        """Return the number of statements executed since the last call."""
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+class Environment:
+    """
+    The seeded dataset and the helpers scenarios use to build their calls.
+
+    User 1 is an admin and every user's password is PASSWORD. Ownership checks reject
+    admins acting on other users' rows, so updates and deletes act on user 1's own rows.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.rng = random.Random(0)
+        self.run = datetime.now(timezone.utc).strftime('%H%M%S')
+        self._tokens = {}
+        self._names = itertools.count()
+        # Seeded users are user1 to userN, users created by earlier runs have other names
+        self.users = db.session.scalar(db.select(func.max(User.id)).where(User.username.like('user%')))
+        self.posts = db.session.scalar(db.select(func.max(Post.id)))
+        self.tags = db.session.scalars(db.select(Tag.name).order_by(Tag.post_count.desc()).limit(20)).all()
+        self.tag_ids = db.session.scalars(db.select(Tag.id).order_by(Tag.post_count.desc()).limit(20)).all()
+        self.own_posts = db.session.scalars(db.select(Post.id).where(Post.user_id == 1).limit(1000)).all()
+        self.own_comments = db.session.execute(db.select(Comment.post_id, Comment.id).where(Comment.user_id == 1).limit(1000)).all()
+
+    def headers(self, user_id=1):
+        """Return the Authorization header of a user, logging in once."""
+        if user_id not in self._tokens:
+            response = self.request('POST', '/users/login', {'email': f'user{user_id}@example.com', 'password': PASSWORD})
+            self._tokens[user_id] = response.json['token']
+        return {'Authorization': f'Bearer {self._tokens[user_id]}'}
+
+    def request(self, method, url, body=None, headers=None):
+        """Send an untimed setup request through the test client."""
+        response = self.client.open(url, method=method, json=body, headers=headers)
+        if response.status_code >= 400:
+            sys.exit(f'setup request {method} {url} failed with {response.status_code}: {response.data[:200]}')
+        return response
+
+    def name(self, prefix):
+        """Return a username or tag name not used by this or earlier runs."""
+        return f'{prefix}{self.run}x{next(self._names)}'
+
+    def post_id(self):
+        return self.rng.randint(1, self.posts)
+
+    def user_id(self):
+        return self.rng.randint(1, self.users)
+
+    def words(self, count):
+        return ' '.join(self.rng.choices(WORDS, k=count))
+
+
+# Users
+
+@scenario('GET /users/')
+def list_users(env, count):
+    return [Call('GET', '/users/?limit=20', None, env.headers())] * count
+
+
+@scenario('GET /users/<id>')
+def get_user(env, count):
+    return [Call('GET', f'/users/{env.user_id()}', None, env.headers()) for _ in range(count)]
+
+
+@scenario('POST /users/login', slow=True)
+def login(env, count):
+    return [Call('POST', '/users/login', {'email': f'user{env.user_id()}@example.com', 'password': PASSWORD}, {}) for _ in range(count)]
+
+
+def _user(env, name):
+    return {'username': name, 'email': f'{name}@example.com', 'password': PASSWORD, 'first_name': 'Bench', 'last_name': 'User'}
+
+
+@scenario('POST /users/register', slow=True)
+def register(env, count):
+    return [Call('POST', '/users/register', _user(env, env.name('reg')), {}) for _ in range(count)]
+
+
+@scenario('PUT /users/<id>', slow=True)
+def update_user(env, count):
+    # Updates validate, and hash, the full set of credentials
+    body = {'username': 'user1', 'email': 'user1@example.com', 'password': PASSWORD}
+    return [Call('PUT', '/users/1', {**body, 'first_name': f'First{i}'}, env.headers()) for i in range(count)]
+
+
+@scenario('DELETE /users/<id>', slow=True)
+def delete_user(env, count):
+    calls = []
+    for _ in range(count):
+        user = _user(env, env.name('del'))
+        user_id = env.request('POST', '/users/register', user).json['id']
+        token = env.request('POST', '/users/login', {'email': user['email'], 'password': PASSWORD}).json['token']
+        calls.append(Call('DELETE', f'/users/{user_id}', None, {'Authorization': f'Bearer {token}'}))
+    return calls
+
+
+# Posts
+
+@scenario('GET /posts/')
+def list_posts(env, count):
+    return [Call('GET', '/posts/?limit=20', None, env.headers())] * count
+
+
+@scenario('GET /posts/?tags=')
+def list_tagged_posts(env, count):
+    return [Call('GET', f'/posts/?tags={",".join(env.rng.sample(env.tags[:5], 2))}&limit=20', None, env.headers()) for _ in range(count)]
+
+
+@scenario('GET /posts/<id>')
+def get_post(env, count):
+    return [Call('GET', f'/posts/{env.post_id()}', None, env.headers()) for _ in range(count)]
+
+
+@scenario('GET /posts/user/<id>')
+def list_user_posts(env, count):
+    return [Call('GET', f'/posts/user/{env.user_id()}?limit=20', None, env.headers()) for _ in range(count)]
+
+
+@scenario('GET /posts/search')
+def search_posts(env, count):
+    return [Call('GET', f'/posts/search?q={env.words(2).replace(" ", "+")}&limit=20', None, env.headers()) for _ in range(count)]
+
+
+@scenario('POST /posts/')
+def create_post(env, count):
+    return [Call('POST', '/posts/', {'title': env.words(6), 'content': env.words(60)}, env.headers()) for _ in range(count)]
+
+
+@scenario('POST /posts/bulk')
+def bulk_create_posts(env, count):
+    return [Call('POST', '/posts/bulk', [{'title': env.words(6), 'content': env.words(60)} for _ in range(BULK_ITEMS)], env.headers())
+            for _ in range(count)]
+
+
+@scenario('PUT /posts/<id>')
+def update_post(env, count):
+    return [Call('PUT', f'/posts/{env.rng.choice(env.own_posts)}', {'title': env.words(6)}, env.headers()) for _ in range(count)]
+
+
+@scenario('DELETE /posts/<id>')
+def delete_post(env, count):
+    ids = [env.request('POST', '/posts/', {'title': env.words(6)}, env.headers()).json['id'] for _ in range(count)]
+    return [Call('DELETE', f'/posts/{post_id}', None, env.headers()) for post_id in ids]
+
+
+@scenario('PUT /posts/<id>/tags')
+def set_post_tags(env, count):
+    return [Call('PUT', f'/posts/{env.rng.choice(env.own_posts)}/tags', {'tags': env.rng.sample(env.tags, 3)}, env.headers()) for _ in range(count)]
+
+
+@scenario('PUT /posts/tags')
+def bulk_set_post_tags(env, count):
+    return [
+        Call('PUT', '/posts/tags', {'posts': [{'id': post_id, 'tags': env.rng.sample(env.tags, 3)} for post_id in env.rng.sample(env.own_posts, min(50, len(env.own_posts)))]}, env.headers())
+        for _ in range(count)
+    ]
+
+
+# Comments
+
+@scenario('POST /posts/<id>/comments')
+def create_comment(env, count):
+    return [Call('POST', f'/posts/{env.post_id()}/comments', {'content': env.words(15)}, env.headers()) for _ in range(count)]
+
+
+@scenario('POST /posts/<id>/comments/bulk')
+def bulk_create_comments(env, count):
+    return [Call('POST', f'/posts/{env.post_id()}/comments/bulk', [{'content': env.words(15)} for _ in range(BULK_ITEMS)], env.headers())
+            for _ in range(count)]
+
+
+@scenario('GET /posts/<id>/comments')
+def list_comments(env, count):
+    return [Call('GET', f'/posts/{env.post_id()}/comments?limit=20', None, env.headers()) for _ in range(count)]
+
+
+@scenario('PUT /posts/<id>/comments/<id>')
+def update_comment(env, count):
+    return [Call('PUT', f'/posts/{post_id}/comments/{comment_id}', {'content': env.words(15)}, env.headers())
+            for post_id, comment_id in (env.rng.choice(env.own_comments) for _ in range(count))]
+
+
+@scenario('DELETE /posts/<id>/comments/<id>')
+def delete_comment(env, count):
+    calls = []
+    for _ in range(count):
+        post_id = env.post_id()
+        comment_id = env.request('POST', f'/posts/{post_id}/comments', {'content': env.words(15)}, env.headers()).json['id']
+        calls.append(Call('DELETE', f'/posts/{post_id}/comments/{comment_id}', None, env.headers()))
+    return calls
+
+
+# Tags
+
+@scenario('GET /tags')
+def list_tags(env, count):
+    return [Call('GET', '/tags?limit=20', None, env.headers())] * count
+
+
+@scenario('GET /tags?prefix=')
+def suggest_tags(env, count):
+    return [Call('GET', f'/tags?prefix={env.rng.choice(WORDS)[:2]}', None, env.headers()) for _ in range(count)]
+
+
+@scenario('GET /tags/trending')
+def trending(env, count):
+    return [Call('GET', f'/tags/trending?window={env.rng.choice(["1h", "24h", "7d"])}', None, env.headers()) for _ in range(count)]
+
+
+@scenario('GET /tags/<id>/posts')
+def list_tag_posts(env, count):
+    return [Call('GET', f'/tags/{env.rng.choice(env.tag_ids)}/posts?limit=20', None, env.headers()) for _ in range(count)]
+
+
+@scenario('POST /tags')
+def create_tag(env, count):
+    return [Call('POST', '/tags', {'name': env.name('new')}, env.headers()) for _ in range(count)]
+
+
+def _create_tags(env, count):
+    return [env.request('POST', '/tags', {'name': env.name('tag')}, env.headers()).json['id'] for _ in range(count)]
+
+
+@scenario('PUT /tags/<id>')
+def update_tag(env, count):
+    return [Call('PUT', f'/tags/{tag_id}', {'name': env.name('ren')}, env.headers()) for tag_id in _create_tags(env, count)]
+
+
+@scenario('DELETE /tags/<id>')
+def delete_tag(env, count):
+    return [Call('DELETE', f'/tags/{tag_id}', None, env.headers()) for tag_id in _create_tags(env, count)]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Serve keep-alive connections, so clients time requests rather than TCP handshakes, without logging each request."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args):
+        pass
+
+
+def run_micro(client, calls, counter):
+    """Send the calls one at a time through the test client."""
+    latencies, errors = [], 0
+    counter.take()
+    start = time.perf_counter()
+    for call in calls:
+        sent = time.perf_counter()
+        response = client.open(call.url, method=call.method, json=call.body, headers=call.headers)
+        latencies.append(time.perf_counter() - sent)
+        errors += response.status_code >= 400
+    return latencies, errors, time.perf_counter() - start, counter.take()
+
+
+def run_load(address, calls, clients, counter):
+    """Send the calls from concurrent clients, each over its own keep-alive HTTP connection."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client(share):
+        connection = http.client.HTTPConnection(*address)
+        timings, failed = [], 0
+        barrier.wait()
+        for call in share:
+            headers = {'Content-Type': 'application/json', **call.headers}
+            body = json.dumps(call.body) if call.body is not None else None
+            sent = time.perf_counter()
+            connection.request(call.method, call.url, body, headers)
+            response = connection.getresponse()
+            response.read()
+            timings.append(time.perf_counter() - sent)
+            failed += response.status >= 400
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(calls[i::clients],)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    counter.take()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start, counter.take()
+
+
+def summarize(name, mode, latencies, errors, seconds, queries):
+    """Return the result record of a timed scenario."""
+    return {
+        'scenario': name,
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 4),
+        'throughput': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_per_request': round(queries / len(latencies), 2),
+    }
+
+
+def ensure_seeded(args):
+    """Seed the database when it has no users, or when asked to."""
+    if not args.reseed and inspect(db.engine).has_table('users') and db.session.scalar(db.select(func.count()).select_from(User)):
+        return
+    print('seeding the benchmark database')
+    db.drop_all()
+    db.create_all()
+    seed(args.users, args.posts_per_user, args.comments_per_post, args.tags, PASSWORD, progress=lambda message: None)
+    recount()
+    rebuild_index()
+    db.session.commit()
+
+
+def git_commit():
+    """Return the commit benchmarked, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    """Print the change in median latency and throughput from a previous results file."""
+    with open(path) as file:
+        previous = {(row['scenario'], row['mode']): row for row in json.load(file)['results']}
+    print(f'\nchange from {path}')
+    print(f'{"scenario":<34}{"mode":<7}{"p50":>10}{"req/s":>10}')
+    for row in results:
+        before = previous.get((row['scenario'], row['mode']))
+        if before:
+            p50 = (row['p50_ms'] / before['p50_ms'] - 1) * 100
+            throughput = (row['throughput'] / before['throughput'] - 1) * 100
+            print(f'{row["scenario"]:<34}{row["mode"]:<7}{p50:>+9.1f}%{throughput:>+9.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('micro', 'load', 'both'), default='both', help='single-threaded, concurrent, or both')
+    parser.add_argument('--requests', type=int, default=200, help='number of timed requests per scenario and mode')
+    parser.add_argument('--slow-requests', type=int, default=20, help='number of timed requests of scenarios hashing passwords')
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent clients in load mode')
+    parser.add_argument('--only', help='only run the scenarios whose name contains this text')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--reseed', action='store_true', help='recreate and seed the database even if it has users')
+    parser.add_argument('--users', type=int, default=500, help='number of users to seed')
+    parser.add_argument('--posts-per-user', type=int, default=10, help='average number of posts per user to seed')
+    parser.add_argument('--comments-per-post', type=int, default=5, help='average number of comments per post to seed')
+    parser.add_argument('--tags', type=int, default=200, help='number of tags to seed')
+    args = parser.parse_args()
+
+    modes = ('micro', 'load') if args.mode == 'both' else (args.mode,)
+    scenarios = [s for s in SCENARIOS if not args.only or args.only in s.name]
+    results = []
+    with app.app_context():
+        ensure_seeded(args)
+        counter = QueryCounter(db.engine)
+        client = app.test_client()
+        env = Environment(client)
+        server = None
+        if 'load' in modes:
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        print(f'{db.engine.dialect.name}, {env.users} users, {env.posts} posts')
+        print(f'{"scenario":<34}{"mode":<7}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"q/req":>7}{"errors":>8}')
+        for item in scenarios:
+            for mode in modes:
+                calls = item.build(env, args.slow_requests if item.slow else args.requests)
+                if mode == 'micro':
+                    timed = run_micro(client, calls, counter)
+                else:
+                    timed = run_load(server.server_address, calls, args.clients, counter)
+                row = summarize(item.name, mode, *timed)
+                results.append(row)
+                print(f'{row["scenario"]:<34}{mode:<7}{row["throughput"]:>9.1f}{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}'
+                      f'{row["p99_ms"]:>9.2f}{row["queries_per_request"]:>7.1f}{row["errors"]:>8}')
+        if server:
+            server.shutdown()
+
+        meta = {
+            'commit': git_commit(),
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': db.engine.dialect.name,
+            'python': platform.python_version(),
+            'users': env.users,
+            'posts': env.posts,
+            'settings': vars(args),
+        }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'meta': meta, 'results': results}, file, indent=2)
+        print(f'results written to {args.output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Compare commits per second of comment creation with and without group commit.
+
+Boots the application against the database in SQLALCHEMY_KEY (a SQLite file in the temp
+directory by default, recreated and seeded on each run), then has `--clients` concurrent
+keep-alive HTTP clients post comments on a few hot posts through a threaded server, once
+committing each comment on its own and once with `COMMENT_GROUP_COMMIT` batching them.
+
+For each mode the requests and commits per second, comments per commit and p50/p99 latency
+are printed, and the comments found in the database are checked against the 201 responses.
+
+Usage:
+    python benchmarks/bench_group_commit.py [--requests 2000] [--clients 32] [--posts 4] [--window-ms 2]
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Concurrent clients need a database every thread can open, and commits that reach the disk
+os.environ.setdefault('SQLALCHEMY_KEY', 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'minornote_group_commit.db'))
+os.environ.setdefault('JWT_KEY', 'benchmark-secret')
+# Every comment waiting on the database lock would be logged as a slow request
+os.environ.setdefault('SQL_TIMING_ENABLED', 'false')
+
+from fixtures import percentile
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from werkzeug.serving import WSGIRequestHandler, make_server
+# app.py prints the URL map when imported
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app
+from group_commit import comment_batcher
+from init import db
+from models.comment import Comment
+from models.post import Post
+from models.user import User
+from seeding import seed
+from token_versions import token_claims
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler without access logs."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class CommitCounter:
+    """Count the transactions committed on an engine, from any thread."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'commit', self._committed)
+
+    def _committed(self, conn):
+        with self._lock:
+            self.count += 1
+
+    def take(self):
+        """Return the number of commits since the last call."""
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def run_clients(address, calls, clients):
+    """Send (url, body, headers) calls from concurrent clients, returning latencies, created count and seconds."""
+    latencies, created = [], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def client(share):
+        connection = http.client.HTTPConnection(*address)
+        timings, ok = [], 0
+        barrier.wait()
+        for url, body, headers in share:
+            sent = time.perf_counter()
+            connection.request('POST', url, json.dumps(body), {'Content-Type': 'application/json', **headers})
+            response = connection.getresponse()
+            response.read()
+            timings.append(time.perf_counter() - sent)
+            ok += response.status == 201
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+            created[0] += ok
+
+    threads = [threading.Thread(target=client, args=(calls[i::clients],)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, created[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='number of comments created in each mode')
+    parser.add_argument('--clients', type=int, default=32, help='number of concurrent clients')
+    parser.add_argument('--posts', type=int, default=4, help='number of hot posts receiving the comments')
+    parser.add_argument('--window-ms', type=float, default=2.0, help='group commit window')
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.clients, 2, 2, 10, 'benchmark', progress=lambda message: None)
+        post_ids = db.session.scalars(db.select(Post.id).order_by(Post.id).limit(args.posts)).all()
+        user_ids = db.session.scalars(db.select(User.id).order_by(User.id).limit(args.clients)).all()
+        # Tokens carry the same claims as those issued at login
+        headers = [
+            {'Authorization': 'Bearer ' + create_access_token(identity=user_id, additional_claims=token_claims(db.session.get(User, user_id)))}
+            for user_id in user_ids
+        ]
+        batcher = comment_batcher()
+        batcher.window = args.window_ms / 1000
+        counter = CommitCounter(db.engine)
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        print(f'{db.engine.dialect.name}, {args.clients} clients, {args.posts} posts, window {args.window_ms}ms')
+        print(f'{"mode":<14}{"req/s":>9}{"commits/s":>11}{"per commit":>12}{"p50 ms":>9}{"p99 ms":>9}{"created":>9}{"in db":>8}')
+        for mode, enabled in (('per request', False), ('group commit', True)):
+            batcher.enabled = enabled
+            # Each client posts as its own user, spreading its comments over the hot posts
+            calls = [
+                (f'/posts/{post_ids[i % len(post_ids)]}/comments', {'content': f'{mode} comment {i}'}, headers[i % len(headers)])
+                for i in range(args.requests)
+            ]
+            before = db.session.scalar(db.select(db.func.count(Comment.id)))
+            counter.take()
+            latencies, created, seconds = run_clients(server.server_address, calls, args.clients)
+            commits = counter.take()
+            stored = db.session.scalar(db.select(db.func.count(Comment.id))) - before
+            print(f'{mode:<14}{len(latencies) / seconds:>9.1f}{commits / seconds:>11.1f}{created / max(commits, 1):>12.1f}'
+                  f'{percentile(latencies, 50) * 1000:>9.2f}{percentile(latencies, 99) * 1000:>9.2f}{created:>9}{stored:>8}')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Micro-benchmark the JSON providers on realistic PostSchema payloads.
+
+Dumps pages of posts with the compiled serializers, then times the stdlib provider and
+the orjson provider (when installed) building a full Flask response for each page size.
+A payload of raw model values, including `date` objects, checks native date handling. The
+body of every provider must decode to the same value as the stdlib provider's, so dates
+have to be written as the same HTTP dates.
+
+Usage:
+    python benchmarks/bench_json.py [--repeat 20]
+"""
+import argparse
+import sys
+
+from fixtures import build_posts, best_of
+from flask.json.provider import DefaultJSONProvider
+from init import app
+from json_provider import OrjsonProvider, orjson
+from models.post import PostSchema
+from serializers import fast_dump
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='number of timed runs per case')
+    args = parser.parse_args()
+
+    providers = [('stdlib', DefaultJSONProvider(app))]
+    if orjson is not None:
+        providers.append(('orjson', OrjsonProvider(app)))
+    else:
+        print('orjson is not installed, only the stdlib provider is measured')
+
+    posts = build_posts(10000)
+    payloads = [
+        (f'{size} posts', fast_dump(PostSchema(many=True), posts[:size]))
+        for size in (20, 100, 1000, 10000)
+    ]
+    # Raw column values as returned by a Core query, with date objects left for the encoder
+    payloads.append(('10000 rows, raw dates', [
+        {'id': post.id, 'title': post.title, 'user_id': post.user_id, 'date_created': post.date_created}
+        for post in posts
+    ]))
+
+    header = ''.join(f'{name:>12}' for name, _ in providers)
+    print(f'{"payload":<24}{"bytes":>10}{header}')
+    with app.app_context():
+        for label, payload in payloads:
+            body = providers[0][1].response(payload).get_data()
+            size, expected = len(body), providers[0][1].loads(body)
+            timings = []
+            for name, provider in providers:
+                # The decoded bodies must be equal, formatting may differ
+                if name != 'stdlib' and provider.loads(provider.response(payload).get_data()) != expected:
+                    sys.exit(f'{label}: {name} output differs from stdlib')
+                timings.append(best_of(args.repeat, lambda: provider.response(payload)))
+            columns = ''.join(f'{timing * 1000:>10.2f}ms' for timing in timings)
+            print(f'{label:<24}{size:>10}{columns}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark the compiled serializers against Marshmallow's generic dump.
+
+Builds an in-memory dataset of posts with nested users, comments and tags, checks that
+both paths produce byte-identical JSON for the full schemas and a few `only` variants,
+then reports the best of several timed runs for each.
+
+Usage:
+    python benchmarks/bench_serializers.py [--posts 10000] [--repeat 5]
+"""
+import argparse
+import json
+import sys
+
+from fixtures import build_posts, best_of
+from models.user import UserSchema
+from models.post import PostSchema
+from models.comment import CommentSchema
+from models.tag import TagSchema
+from serializers import fast_dump
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=10000, help='number of posts to serialize')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs per case')
+    args = parser.parse_args()
+
+    posts = build_posts(args.posts)
+    comments = [comment for post in posts for comment in post.comments]
+    users = list({post.user.id: post.user for post in posts}.values())
+    tags = list({tag.id: tag for post in posts for tag in post.tags}.values())
+
+    cases = [
+        ('PostSchema', PostSchema(many=True), posts),
+        ('PostSchema only', PostSchema(many=True, only=['id', 'title', 'date_created', 'user.username']), posts),
+        ('CommentSchema', CommentSchema(many=True), comments),
+        ('UserSchema', UserSchema(many=True), users),
+        ('UserSchema exclude', UserSchema(many=True, exclude=['password']), users),
+        ('TagSchema', TagSchema(many=True), tags),
+    ]
+
+    print(f'{"case":<22}{"rows":>8}{"marshmallow":>14}{"compiled":>12}{"speedup":>10}')
+    for name, schema, rows in cases:
+        expected = json.dumps(schema.dump(rows), sort_keys=True)
+        actual = json.dumps(fast_dump(schema, rows), sort_keys=True)
+        if expected != actual:
+            sys.exit(f'{name}: compiled output differs from Marshmallow')
+        generic = best_of(args.repeat, lambda: schema.dump(rows))
+        compiled = best_of(args.repeat, lambda: fast_dump(schema, rows))
+        print(f'{name:<22}{len(rows):>8}{generic * 1000:>12.1f}ms{compiled * 1000:>10.1f}ms{generic / compiled:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark multi-tag queries answered by the bitmap index against SQL over post_tags.
+
+Fills an in-memory post_tags table with a skewed tag distribution, then times selecting the
+first page of post IDs tagged with all, or any, of a few tags: once with GROUP BY / DISTINCT
+queries over post_tags, and once with the in-memory bitmaps, checking both return the same
+IDs. The time to load the index from post_tags is reported separately.
+
+Usage:
+    python benchmarks/bench_tag_index.py [--posts 1000000] [--repeat 5]
+"""
+import argparse
+import random
+import sys
+import time
+
+from fixtures import best_of
+from sqlalchemy import func
+from init import app, db
+from models.tag import post_tags
+from tag_index import TagIndex
+
+PAGE = 20
+
+
+def fill(posts, tags):
+    """Insert posts tagged with one to five tags each, popular tags being far more common."""
+    random.seed(0)
+    weights = [1 / (rank + 1) for rank in range(tags)]
+    rows = []
+    for post_id in range(1, posts + 1):
+        for tag_id in set(random.choices(range(1, tags + 1), weights, k=random.randint(1, 5))):
+            rows.append({'post_id': post_id, 'tag_id': tag_id})
+    # post_tags only, the foreign keys are not enforced by SQLite by default
+    post_tags.create(db.engine)
+    for start in range(0, len(rows), 100000):
+        db.session.execute(post_tags.insert(), rows[start:start + 100000])
+    db.session.commit()
+    return len(rows)
+
+
+def sql_page(tag_ids, mode):
+    """Select the first page of matching post IDs with SQL, newest first."""
+    stmt = db.select(post_tags.c.post_id).where(post_tags.c.tag_id.in_(tag_ids)).group_by(post_tags.c.post_id)
+    if mode == 'all':
+        stmt = stmt.having(func.count() == len(tag_ids))
+    return db.session.scalars(stmt.order_by(post_tags.c.post_id.desc()).limit(PAGE)).all()
+
+
+def bitmap_page(index, tag_ids, mode):
+    """Select the first page of matching post IDs from the bitmap index, newest first."""
+    ids = index.query(tag_ids, mode).descending()
+    return [post_id for post_id, _ in zip(ids, range(PAGE))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--posts', type=int, default=1000000, help='number of posts to tag')
+    parser.add_argument('--tags', type=int, default=500, help='number of distinct tags')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs per case')
+    args = parser.parse_args()
+
+    with app.app_context():
+        start = time.perf_counter()
+        rows = fill(args.posts, args.tags)
+        print(f'{rows} post_tags rows inserted in {time.perf_counter() - start:.1f}s')
+
+        index = TagIndex()
+        start = time.perf_counter()
+        index.load()
+        stats = index.stats()
+        print(f'index loaded in {time.perf_counter() - start:.2f}s, {stats["tags"]} tags, {stats["bytes"] / 1024 / 1024:.1f} MiB')
+
+        cases = [
+            ('all of 2 popular', [1, 2], 'all'),
+            ('all of 3, mixed', [1, 10, 100], 'all'),
+            ('all of 2 rare', [300, 400], 'all'),
+            ('any of 3 popular', [1, 2, 3], 'any'),
+            ('any of 3 rare', [300, 400, 500], 'any'),
+        ]
+        print(f'{"query":<20}{"sql":>12}{"bitmap":>12}')
+        for label, tag_ids, mode in cases:
+            if sql_page(tag_ids, mode) != bitmap_page(index, tag_ids, mode):
+                sys.exit(f'{label}: bitmap result differs from SQL')
+            sql = best_of(args.repeat, lambda: sql_page(tag_ids, mode))
+            bitmap = best_of(args.repeat, lambda: bitmap_page(index, tag_ids, mode))
+            print(f'{label:<20}{sql * 1000:>10.2f}ms{bitmap * 1000:>10.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
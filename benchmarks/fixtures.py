@@ -0,0 +1,60 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Importing this module makes the application modules in `src/` importable and gives the
+app a throwaway in-memory database unless SQLALCHEMY_KEY is already set.
+"""
+import math
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('SQLALCHEMY_KEY', 'sqlite://')
+# Benchmarks send far more requests than a client is allowed
+os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+from models.user import User
+from models.post import Post
+from models.comment import Comment
+from models.tag import Tag
+
+
+def build_posts(count):
+    """Build `count` transient posts, each with an author, three comments and two tags."""
+    users = [
+        User(id=i, username=f'user{i}', email=f'user{i}@example.com', password='x' * 60,
+             first_name=f'First{i}', last_name=f'Last{i}', is_admin=i == 0)
+        for i in range(100)
+    ]
+    tags = [Tag(id=i, name=f'tag{i}') for i in range(50)]
+    today = date.today()
+    posts = []
+    for i in range(count):
+        post = Post(id=i, title=f'Post title {i}', content='Lorem ipsum dolor sit amet. ' * 10,
+                    user_id=users[i % 100].id, user=users[i % 100], date_created=today - timedelta(days=i % 365))
+        post.comments = [
+            Comment(id=i * 3 + j, content=f'Comment {j} on post {i}', user_id=users[(i + j) % 100].id,
+                    user=users[(i + j) % 100], post_id=i, date_created=today)
+            for j in range(3)
+        ]
+        post.tags = [tags[i % 50], tags[(i * 7) % 50]]
+        posts.append(post)
+    return posts
+
+
+def best_of(repeat, function):
+    """Return the fastest wall-clock time of `repeat` calls to `function`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of a non-empty list of values."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
@@ -7,6 +7,17 @@ from blueprints.posts_bp import posts_bp
 from blueprints.users_bp import users_bp
 from blueprints.comments_bp import comments_bp
 from blueprints.tags_bp import tags_bp
+from blueprints.cache_bp import cache_bp
+from blueprints.search_bp import search_bp
+from blueprints.metrics_bp import metrics_bp
+from blueprints.profiles_bp import profiles_bp
+from tag_index import TagIndex, TagPrefixIndex
+from trending import TrendingTags
+from profiler import Profiler
+from passwords import PasswordHashingUnavailable
+from rate_limit import RateLimiter
+from token_versions import TokenVersions
+from group_commit import CommentBatcher, GroupCommitTimeout
 
 # Register Blueprints
 app.register_blueprint(db_commands)
@@ -14,6 +25,29 @@ app.register_blueprint(posts_bp)
 app.register_blueprint(users_bp)
 app.register_blueprint(comments_bp)
 app.register_blueprint(tags_bp)
+app.register_blueprint(cache_bp)
+app.register_blueprint(search_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(profiles_bp)
+
+# Initialise the in-memory indexes of the posts of each tag and of tag names
+TagIndex(app)
+TagPrefixIndex(app)
+
+# Initialise the sliding window counters of trending tags
+TrendingTags(app)
+
+# Initialise the table of token versions and roles checked on every authenticated request
+TokenVersions(app)
+
+# Initialise the group commit of comments created concurrently
+CommentBatcher(app)
+
+# Initialise the rate limits and concurrency caps shared by every worker
+RateLimiter(app)
+
+# Initialise the on-demand profiler of admin requests
+Profiler(app)
 
 # Root endpoint
 @app.route("/")
@@ -71,6 +105,40 @@ def missing_key(err):
     response.status_code = 400
     return response
 
+# Error handler for password hashing jobs rejected or timed out
+@app.errorhandler(PasswordHashingUnavailable)
+def handle_password_hashing_unavailable(error):
+    """
+    Handles PasswordHashingUnavailable exceptions, raised when the password hashing pool is saturated.
+
+    Args:
+        error: The PasswordHashingUnavailable object.
+
+    Returns:
+        JSON response with status 503, asking the client to retry shortly.
+    """
+    response = jsonify({"error": "Too many password requests, try again shortly"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+# Error handler for comments not committed in time by the group commit writer
+@app.errorhandler(GroupCommitTimeout)
+def handle_group_commit_timeout(error):
+    """
+    Handles GroupCommitTimeout exceptions, raised when a comment is dropped after waiting too long for its group commit.
+
+    Args:
+        error: The GroupCommitTimeout object.
+
+    Returns:
+        JSON response with status 503, asking the client to retry shortly.
+    """
+    response = jsonify({"error": "The comment could not be saved in time, try again shortly"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 # Error handler for integrity errors
 @app.errorhandler(IntegrityError)
 def handle_integrity_error(error):
@@ -1,8 +1,114 @@
 from functools import wraps
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask import abort, jsonify, make_response
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from flask import g, jsonify, make_response
+from sqlalchemy.orm import aliased
 from init import db
 from models.user import User
+from token_versions import ROLE_ADMIN, ROLE_CLAIM
+
+# Helper function to read the admin status carried by the access token
+def claimed_admin(user_id):
+    """
+    Return whether the access token of the current request says its user is an admin.
+
+    The role claim is checked against the user's current role when the token is verified,
+    see token_versions.py, so it can be trusted without querying the users table.
+
+    Args:
+        user_id: The ID of the user, usually the JWT identity.
+
+    Returns:
+        The admin status of the user, or None if the token is not theirs or has no role claim.
+    """
+    claims = get_jwt()
+    if ROLE_CLAIM not in claims or get_jwt_identity() != user_id:
+        return None
+    return claims[ROLE_CLAIM] == ROLE_ADMIN
+
+# Helper function to check whether a user is an admin
+def is_admin(user_id):
+    """
+    Check whether a user has admin privileges.
+
+    The role claim of the access token is used when it has one. Otherwise the answer is
+    queried and cached on the request context, so the decorators and hooks of one request
+    query it at most once.
+
+    Args:
+        user_id: The ID of the user, usually the JWT identity.
+
+    Returns:
+        True if the user exists and is an admin.
+    """
+    admin = claimed_admin(user_id)
+    if admin is not None:
+        return admin
+    cached = g.get('admin_status')
+    if cached is not None and cached[0] == user_id:
+        return cached[1]
+    stmt = db.select(User.id).where(User.id == user_id, User.is_admin)
+    admin = db.session.scalar(stmt) is not None
+    g.admin_status = (user_id, admin)
+    return admin
+
+# Statements of load_authorized by resource model, built once with bound parameters
+_authorized_statements = {}
+
+# Helper function to load a resource and the caller's admin status together
+def load_authorized(resource_model, resource_id):
+    """
+    Load a resource and whether the current user is an admin, in a single query.
+
+    Tokens with a role claim only need the resource to be loaded.
+
+    Args:
+        resource_model: The SQLAlchemy model of the resource.
+        resource_id: The primary key of the resource.
+
+    Returns:
+        A (resource, is_admin) tuple, resource being None if it does not exist.
+    """
+    user_id = get_jwt_identity()
+    admin = claimed_admin(user_id)
+    if admin is not None:
+        return db.session.get(resource_model, resource_id), admin
+    stmt = _authorized_statements.get(resource_model)
+    if stmt is None:
+        # Aliased so the subquery is not correlated with the resource when it is itself a user
+        caller = aliased(User)
+        admin = db.select(caller.is_admin).where(caller.id == db.bindparam('user_id')).scalar_subquery()
+        stmt = db.select(resource_model, admin).where(resource_model.id == db.bindparam('resource_id'))
+        _authorized_statements[resource_model] = stmt
+    row = db.session.execute(stmt, {'user_id': user_id, 'resource_id': resource_id}).first()
+    if row is None:
+        return None, False
+    g.admin_status = (user_id, bool(row[1]))
+    return row[0], bool(row[1])
+
+# Helper function to check whether the current user owns a resource
+def is_owner(resource, resource_type):
+    """
+    Check whether the current user is the owner of a resource.
+
+    Args:
+        resource: The resource to check ownership for.
+        resource_type: 'user' when the resource is a user, who owns themselves.
+
+    Returns:
+        True if the current user owns the resource.
+    """
+    owner_id = resource.id if resource_type == 'user' else resource.user_id
+    return owner_id == get_jwt_identity()
+
+# Helper function to get the resource authorised by owner_only or admin_or_owner_only
+def authorized_resource():
+    """
+    Return the resource loaded and authorised for the current request.
+
+    Views decorated with owner_only or admin_or_owner_only use it instead of loading the
+    resource again.
+    """
+    return g.authorized_resource
 
 # Route decorator - ensure JWT user is admin
 def admin_only(fn):
@@ -21,99 +127,72 @@ def admin_only(fn):
         Returns:
             The wrapped function or a 403 Forbidden response if the user is not an admin.
         """
-        user_id = get_jwt_identity()
-        stmt = db.select(User).where(User.id == user_id, User.is_admin)
-        user = db.session.scalar(stmt)
-        if user:
+        if is_admin(get_jwt_identity()):
             return fn(*args, **kwargs)
         else:
             return make_response(jsonify(error='You must be an admin to access this resource'), 403)
-        
-    return inner
 
-# Route decorator - ensure JWT user is owner of the resource
-def owner_only(fn):
-    @wraps(fn)
-    @jwt_required()
-    def inner(*args, **kwargs):
-        """
-        Decorator to ensure the user is the owner of the resource.
-
-        This decorator checks if the current user is the owner of the resource. If the user is not the owner,
-        a 403 Forbidden response is returned.
-
-        Args:
-            fn: The function to be wrapped by the decorator.
-
-        Returns:
-            The wrapped function or a 403 Forbidden response if the user is not the owner.
-        """
-        user_id = get_jwt_identity()
-        stmt = db.select(User).where(User.id == user_id)
-        user = db.session.scalar(stmt)
-        if user:
-            return fn(*args, **kwargs)
-        else:
-            return make_response(jsonify(error='You must be the owner of the resource'), 403)
-        
     return inner
 
-# Helper function to authorise the owner of a resource
-def authorize_owner(resource, resource_type):
+# Route decorator - ensure JWT user is owner of the resource
+def owner_only(resource_model, resource_id_param, resource_type):
     """
-    Helper function to check if the current user is the owner of the resource.
+    Decorator to ensure the user is the owner of the resource.
 
-    This function aborts with a 403 Forbidden response if the current user is not the owner.
+    The resource is loaded with a single query and handed to the view through
+    `authorized_resource`. A missing resource returns 404, one owned by another user 403.
 
     Args:
-        resource: The resource to check ownership for.
+        resource_model: The SQLAlchemy model of the resource.
+        resource_id_param: The name of the route parameter containing the resource ID.
+        resource_type: 'user' when the resource is a user, who owns themselves.
+
+    Returns:
+        The wrapped function or an error response if the user is not the owner.
     """
-    user_id = get_jwt_identity()
-    if resource_type == 'user':
-        if user_id != resource.id:
-            abort(make_response(jsonify(error='You must be the owner of the resource to access this'), 403))
-    else:
-        if user_id != resource.user_id:
-            abort(make_response(jsonify(error='You must be the owner of the resource to access this'), 403))
+    def decorator(fn):
+        @wraps(fn)
+        @jwt_required()
+        def inner(*args, **kwargs):
+            resource = db.session.get(resource_model, kwargs.get(resource_id_param))
+            if resource is None:
+                return make_response(jsonify(error='Not Found'), 404)
+            if not is_owner(resource, resource_type):
+                return make_response(jsonify(error='You must be the owner of the resource to access this'), 403)
+            g.authorized_resource = resource
+            return fn(*args, **kwargs)
+
+        return inner
+    return decorator
 
 # Route decorator - ensure JWT user is admin or owner of the resource
 def admin_or_owner_only(resource_model, resource_id_param, resource_type):
     """
     Decorator to ensure the user is an admin or the owner of the resource.
 
-    This decorator checks if the current user is either an admin or the owner of the resource. If the user is neither,
-    a 403 Forbidden response is returned.
+    The resource and the caller's admin status are resolved with a single query, cached on
+    the request context and handed to the view through `authorized_resource`. A missing
+    resource returns 404, one the user neither owns nor administers 403.
 
     Args:
         resource_model: The SQLAlchemy model of the resource.
         resource_id_param: The name of the route parameter containing the resource ID.
+        resource_type: 'user' when the resource is a user, who owns themselves.
 
     Returns:
-        The wrapped function or a 403 Forbidden response if the user is neither the admin nor the owner.
+        The wrapped function or an error response if the user is neither the admin nor the owner.
     """
     def decorator(fn):
         @wraps(fn)
         @jwt_required()
         def inner(*args, **kwargs):
-            user_id = get_jwt_identity()
-            resource_id = kwargs.get(resource_id_param)
-
-            # Fetch the resource
-            resource = db.session.get(resource_model, resource_id)
-
-            if resource:
-                if resource_type == 'user' and resource.id == user_id:
-                    return fn(*args, **kwargs)
-                elif resource_type != 'user' and resource.user_id == user_id:
-                    return fn(*args, **kwargs)
-
-            # Check if the user is an admin
-            stmt = db.select(User).where(User.id == user_id, User.is_admin)
-            user = db.session.scalar(stmt)
-            if user:
-                return fn(*args, **kwargs)
-            else:
+            resource, admin = load_authorized(resource_model, kwargs.get(resource_id_param))
+            if resource is None:
+                return make_response(jsonify(error='Not Found'), 404)
+            if not (admin or is_owner(resource, resource_type)):
                 return make_response(jsonify(error='You must be the owner of the resource or an admin to access this resource'), 403)
-        
+            g.authorized_resource = resource
+            return fn(*args, **kwargs)
+
         return inner
     return decorator
@@ -0,0 +1,21 @@
+from flask import Blueprint, current_app, jsonify
+from auth import admin_only
+
+# Initialise the Blueprint for cache routes
+cache_bp = Blueprint('cache', __name__, url_prefix='/cache')
+
+# Get response cache statistics (R)
+@cache_bp.route('/stats', methods=['GET'])
+@admin_only
+def cache_stats():
+    """
+    Retrieves the hit, miss and eviction counters of the response cache.
+    Requires JWT authentication and that the user is an admin.
+
+    The local tier counters and the shared tier hit counters are those of the worker
+    process serving the request. The shared tier entry count covers all workers.
+
+    Returns:
+        JSON response containing the cache statistics.
+    """
+    return jsonify(current_app.extensions['response_cache'].stats()), 200
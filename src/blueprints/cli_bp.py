@@ -1,9 +1,17 @@
 from datetime import date
+import click
 from flask import Blueprint
 from models.user import User
 from models.post import Post
 from models.comment import Comment
 from models.tag import Tag
+from counters import recount
+from search import rebuild_index
+from seeding import seed, DEFAULT_CHUNK_SIZE
+from tag_index import tag_index, tag_prefix_index
+from trending import trending_tags
+from token_versions import token_versions
+from cache import reset_cache
 from init import db, bcrypt
 
 # Initialise the Blueprint for CLI commands
@@ -129,4 +137,89 @@ def db_create():
     # Commit the relationships to the database
     db.session.commit()
 
+    # Count the sample posts, comments and tags, and index them for search
+    recount()
+    rebuild_index()
+    db.session.commit()
+    # Running workers rebuild the tag indexes and token versions on next use, and drop cached responses
+    tag_index().reset()
+    tag_prefix_index().reset()
+    trending_tags().reset()
+    token_versions().reset()
+    reset_cache()
+
     print('Users, Posts, Comments, Tags, and relationships added')
+
+# Command to rebuild the denormalized counters from the rows they count
+@db_commands.cli.command('recount')
+def db_recount():
+    # One UPDATE per counter column, so this stays fast on large tables
+    counters = recount()
+    db.session.commit()
+    print(f'Recounted {counters} counters')
+
+# Command to rebuild the full-text search indexes of posts and comments
+@db_commands.cli.command('reindex')
+def db_reindex():
+    # Creates any missing index, then refills or rebuilds each one in bulk
+    indexes = rebuild_index()
+    db.session.commit()
+    print(f'Rebuilt {indexes} search indexes')
+
+# Command to revoke every access token issued to a user
+@db_commands.cli.command('revoke-tokens')
+@click.argument('email')
+def db_revoke_tokens(email):
+    user = db.session.scalar(db.select(User).where(User.email == email))
+    if user is None:
+        raise click.ClickException(f'No user with email {email}')
+    # Tokens carry the version they were issued with, the user must log in again
+    user.token_version += 1
+    db.session.commit()
+    token_versions().changed(user)
+    print(f'Revoked the tokens of {email}')
+
+# Command to grant or remove admin rights
+@db_commands.cli.command('set-admin')
+@click.argument('email')
+@click.option('--remove', is_flag=True, help='Remove admin rights instead of granting them.')
+def db_set_admin(email, remove):
+    user = db.session.scalar(db.select(User).where(User.email == email))
+    if user is None:
+        raise click.ClickException(f'No user with email {email}')
+    # Tokens carrying the former role are rejected, the user must log in again
+    user.is_admin = not remove
+    db.session.commit()
+    token_versions().changed(user)
+    print(f'{email} is {"no longer" if remove else "now"} an admin')
+
+# Command to create the tables and fill them with a large synthetic dataset
+@db_commands.cli.command('seed')
+@click.option('--users', default=1000, show_default=True, help='Number of users.')
+@click.option('--posts-per-user', default=10, show_default=True, help='Average number of posts per user.')
+@click.option('--comments-per-post', default=5, show_default=True, help='Average number of comments per post.')
+@click.option('--tags', default=500, show_default=True, help='Number of distinct tags.')
+@click.option('--password', default='testpassword', show_default=True, help='Password of every user.')
+@click.option('--seed', 'random_seed', default=0, show_default=True, help='Seed of the random generator.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Number of rows loaded at a time.')
+def db_seed(users, posts_per_user, comments_per_post, tags, password, random_seed, chunk_size):
+    # Drop all existing tables and recreate them, the generated rows use fixed IDs
+    db.drop_all()
+    db.create_all()
+    print('Created tables')
+
+    counts = seed(users, posts_per_user, comments_per_post, tags, password, random_seed, chunk_size)
+
+    # Count the generated rows and index them for search, in bulk
+    recount()
+    rebuild_index()
+    db.session.commit()
+    # Running workers rebuild the tag indexes and token versions on next use, and drop cached responses
+    tag_index().reset()
+    tag_prefix_index().reset()
+    trending_tags().reset()
+    token_versions().reset()
+    reset_cache()
+
+    print(', '.join(f'{count} {table}' for table, count in counts.items()) + ' added')
+    print(f'Log in as user1@example.com (admin) to user{users}@example.com with password {password!r}')
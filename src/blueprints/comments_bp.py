@@ -4,7 +4,19 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from marshmallow import ValidationError
 from models.comment import Comment, CommentSchema
 from models.user import User
-from auth import admin_or_owner_only, owner_only, authorize_owner
+from auth import admin_or_owner_only, owner_only, authorized_resource
+from pagination import paginate
+from loaders import eager_load
+from fieldsets import sparse_schema
+from serializers import fast_dump
+from cache import invalidate
+from etags import conditional, touch, touch_posts
+from counters import comment_added
+from search import add_to_index, add_rows_to_index, remove_from_index
+from models.post import Post
+from streaming import stream, stream_format
+from bulk import load_items, insert_rows, bulk_response
+from group_commit import comment_batcher
 from init import db
 
 # Initialise the Blueprint for comment routes
@@ -34,6 +46,17 @@ def create_comment(post_id):
         # Return validation errors as JSON with status 400
         return jsonify(err.messages), 400
 
+    batcher = comment_batcher()
+    if batcher.enabled:
+        # Committed together with the comments of concurrent requests, then loaded to be serialized
+        comment_id = batcher.submit({
+            'content': comment_info.get('content'),
+            'user_id': get_jwt_identity(),
+            'post_id': post_id,
+            'date_created': date.today(),
+        })
+        return jsonify(CommentSchema().dump(db.session.get(Comment, comment_id))), 201
+
     # Create a new Comment instance
     comment = Comment(
         content=comment_info.get('content'),
@@ -43,51 +66,122 @@ def create_comment(post_id):
     )
     # Add the new comment to the session and commit to the database
     db.session.add(comment)
+    touch_posts(Post.id == post_id)
+    comment_added(post_id, comment.user_id)
+    add_to_index(comment)
     db.session.commit()
+    # The post now renders with the new comment
+    invalidate(f'posts:{post_id}')
     # Serialize the new comment and return as JSON with status 201
     return jsonify(CommentSchema().dump(comment)), 201
 
+# Create many comments (C)
+@comments_bp.route('/<int:post_id>/comments/bulk', methods=['POST'])
+@jwt_required()
+def bulk_create_comments(post_id):
+    """
+    Creates many comments on a post in a single transaction.
+    Requires JWT authentication.
+
+    Each item is validated like the body of POST /posts/<post_id>/comments. The valid ones are
+    inserted with batched INSERT ... RETURNING statements, and the invalid ones are reported
+    by index.
+
+    Args:
+        post_id (int): ID of the post to comment on.
+
+    Body (JSON):
+        A list of objects with the content of each comment, at most MAX_BULK_ITEMS.
+
+    Returns:
+        JSON response with the index and ID of each comment created, and the errors of the invalid items by index.
+        The status is 201 if every comment was created, 207 if some were and 400 if none was.
+    """
+    if db.session.scalar(db.select(Post.id).where(Post.id == post_id)) is None:
+        return jsonify({'error': 'Not Found'}), 404
+    valid, errors = load_items(CommentSchema(many=True, only=['content'], unknown='exclude'), request.json)
+    user_id = get_jwt_identity()
+    today = date.today()
+    rows = [
+        {'content': comment_info.get('content'), 'user_id': user_id, 'post_id': post_id, 'date_created': today}
+        for _, comment_info in valid
+    ]
+    ids = []
+    if rows:
+        ids = insert_rows(Comment, rows, ('content',))
+        for row, comment_id in zip(rows, ids):
+            row['id'] = comment_id
+        touch_posts(Post.id == post_id)
+        comment_added(post_id, user_id, len(rows))
+        add_rows_to_index(Comment, rows)
+        db.session.commit()
+        # The post now renders with the new comments
+        invalidate(f'posts:{post_id}')
+    return bulk_response([index for index, _ in valid], ids, errors)
+
 # Get all comments on a post (R)
 @comments_bp.route('/<int:post_id>/comments', methods=['GET'])
 @jwt_required()
+@conditional(Post, 'post_id')
 def get_comments(post_id):
     """
-    Retrieves all comments on a specific post.
-    Requires JWT authentication.
+    Retrieves a page of comments on a specific post, newest first.
+    Requires JWT authentication. Responds with a strong ETag derived from the post's version
+    and answers a matching If-None-Match with 304 Not Modified.
 
     Args:
         post_id (int): ID of the post to get comments for.
 
+    Query parameters:
+        limit, after, before: Keyset pagination parameters, see pagination.KeysetPage.
+        fields, expand: Sparse fieldset parameters, see fieldsets.sparse_schema.
+
     Returns:
-        JSON response containing all comments on the post.
+        JSON response containing a page of comments on the post, with cursors in the response headers.
     """
     # Create a SQLAlchemy query to filter comments by post_id
-    comments = Comment.query.filter_by(post_id=post_id).all()
+    # Only the requested columns are selected and the nested user is eager loaded when requested
+    key = (Comment.date_created, Comment.id)
+    schema = sparse_schema(CommentSchema, many=True)
+    stmt = db.select(Comment).where(Comment.post_id == post_id).options(*eager_load(schema, Comment, include=key))
+    comments, cursors = paginate(stmt, key)
     # Serialize the list of comments and return as JSON
-    return jsonify(CommentSchema(many=True).dump(comments)), 200
+    return jsonify(fast_dump(schema, comments)), 200, cursors
 
 # Route to get all comments by a specific user (R)
 @comments_bp.route('/user/<int:user_id>', methods=['GET'])
 @admin_or_owner_only(User, 'user_id', 'user')
 def comments_by_user(user_id):
     """
-    Retrieves all comments by a specific user.
+    Retrieves a page of comments by a specific user, newest first.
     Requires JWT authentication.
 
     Args:
         user_id (int): ID of the user to get comments for.
 
+    Query parameters:
+        limit, after, before: Keyset pagination parameters, see pagination.KeysetPage.
+        fields, expand: Sparse fieldset parameters, see fieldsets.sparse_schema.
+        stream: 'json' or 'ndjson' to stream every comment after the cursor instead of returning a page, admins only.
+
     Returns:
-        JSON response containing all comments made by the user.
+        JSON response containing a page of comments made by the user, with cursors in the response headers.
     """
     # Create a SQLAlchemy query to filter comments by user_id
-    comments = Comment.query.filter_by(user_id=user_id).all()
+    # Only the requested columns are selected and the nested user is eager loaded when requested
+    key = (Comment.date_created, Comment.id)
+    schema = sparse_schema(CommentSchema, many=True)
+    stmt = db.select(Comment).where(Comment.user_id == user_id).options(*eager_load(schema, Comment, include=key))
+    fmt = stream_format()
+    if fmt:
+        return stream(stmt, schema, key, fmt)
+    comments, cursors = paginate(stmt, key)
     # Serialize the list of comments and return as JSON
-    return jsonify(CommentSchema(many=True).dump(comments)), 200
+    return jsonify(fast_dump(schema, comments)), 200, cursors
 
 # Update/edit comment (U)
 @comments_bp.route('/<int:post_id>/comments/<int:comment_id>', methods=['PUT', 'PATCH'])
-@owner_only
+@owner_only(Comment, 'comment_id', 'comment')
 def update_comment(post_id, comment_id):
     """
     Updates an existing comment.
@@ -103,9 +197,8 @@ def update_comment(post_id, comment_id):
     Returns:
         JSON response with a success message.
     """
-    # Retrieve the comment to be updated by ID
-    comment = db.get_or_404(Comment, comment_id)
-    authorize_owner(comment, 'comment')
+    # The comment loaded and authorised by owner_only
+    comment = authorized_resource()
     try:
         # Validate and deserialize the request JSON data
         comment_info = CommentSchema(only=['content']).load(request.json, unknown='exclude')
@@ -115,8 +208,13 @@ def update_comment(post_id, comment_id):
 
     # Update comment attributes if provided
     comment.content = comment_info.get('content', comment.content)
+    touch(comment)
+    touch_posts(Post.id == comment.post_id)
+    add_to_index(comment)
     # Commit the changes to the database
     db.session.commit()
+    # The post renders the comment, so its cached responses are stale too
+    invalidate(f'comments:{comment_id}', f'posts:{comment.post_id}')
     # Return a success message as JSON
     return jsonify({'message': 'Comment updated successfully'}), 200
 
@@ -135,11 +233,16 @@ def delete_comment(post_id, comment_id):
     Returns:
         JSON response with a success message.
     """
-    # Retrieve the comment to be deleted by ID
-    comment = db.get_or_404(Comment, comment_id)
-    authorize_owner(comment, 'comment')
+    # The comment loaded and authorised by admin_or_owner_only
+    comment = authorized_resource()
+    # The comment's own post, which the URL does not have to match
+    parent_id = comment.post_id
+    remove_from_index(Comment, Comment.id == comment_id)
     # Delete the comment from the database
     db.session.delete(comment)
+    touch_posts(Post.id == parent_id)
+    comment_added(parent_id, comment.user_id, -1)
     db.session.commit()
+    invalidate(f'comments:{comment_id}', f'posts:{parent_id}')
     # Return a success message as JSON
     return jsonify({'message': 'Comment deleted successfully'}), 200
@@ -0,0 +1,22 @@
+import hmac
+from flask import Blueprint, current_app, jsonify, request
+
+# Initialise the Blueprint for the metrics route
+metrics_bp = Blueprint('metrics', __name__)
+
+# Get Prometheus metrics (R)
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Exposes the request, database pool and bcrypt metrics in the Prometheus text format.
+
+    The counters and histograms are summed over every worker process of the server. When
+    METRICS_TOKEN is set, the request must carry it as a bearer token.
+
+    Returns:
+        Plain text response with the metrics.
+    """
+    metrics = current_app.extensions['metrics']
+    if metrics.token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {metrics.token}'):
+        return jsonify(error='A valid metrics token is required'), 401
+    return metrics.exposition(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
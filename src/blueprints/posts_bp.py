@@ -1,10 +1,26 @@
+from collections import Counter
 from datetime import date
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, abort, make_response
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from marshmallow import ValidationError
 from models.post import Post, PostSchema
 from models.user import User
-from auth import admin_or_owner_only, authorize_owner
+from models.tag import PostTagsSchema, RetagSchema, post_tags
+from auth import admin_or_owner_only, authorized_resource, is_admin
+from pagination import paginate
+from loaders import eager_load
+from fieldsets import sparse_schema
+from serializers import fast_dump
+from cache import cached, depends_on, invalidate
+from etags import conditional, touch
+from counters import post_added, post_deleting
+from models.comment import Comment
+from search import add_to_index, add_rows_to_index, remove_from_index
+from tag_index import tag_index, tag_prefix_index, tag_filter, paginate_tagged
+from tagging import tag_names, retag, retagged, MAX_RETAG_POSTS
+from trending import trending_tags
+from streaming import stream, stream_format
+from bulk import load_items, insert_rows, bulk_response
 from init import db
 
 # Initialise the Blueprint for post routes
@@ -17,45 +33,80 @@ def all_posts():
     """
     Get all posts.
 
-    This function retrieves all posts from the database and returns them as JSON.
+    This function retrieves a page of posts from the database, newest first, and returns them as JSON.
 
     Parameters:
-    None
+    limit (int, query): Maximum number of posts to return.
+    after (str, query): Cursor of the post to start after, taken from the X-Next-Cursor header.
+    before (str, query): Cursor of the post to end before, taken from the X-Prev-Cursor header.
+    fields (str, query): Comma separated fields to return, e.g. id,title,user.username.
+    expand (str, query): Comma separated nested objects to return, e.g. user,tags.
+    stream (str, query): 'json' or 'ndjson' to stream every post after the cursor instead of returning a page, admins only.
+    tags (str, query): Comma separated tag names, to return only the posts with these tags, newest first by ID.
+    mode (str, query): 'all' (default) for posts with every tag, 'any' for posts with at least one of them.
 
     Returns:
-    A JSON response containing all posts.
+    A JSON response containing a page of posts, with cursors for the neighbouring pages in the response headers.
     """
+    # Unsupported formats and non-admins are answered with 400 and 403 by the error handlers
+    fmt = stream_format()
     try:
-        # Create a SQLAlchemy query to select all posts
-        # selects all records from the posts table
-        stmt = db.select(Post)
-        posts = db.session.scalars(stmt).all()
+        # Create a SQLAlchemy query to select a page of posts
+        # keyset pagination on (date_created, id) keeps the cost of each page constant
+        # only the requested columns are selected, and the requested nested objects
+        # are eager loaded to avoid a lazy load per post
+        key = (Post.date_created, Post.id)
+        schema = sparse_schema(PostSchema, many=True)
+        stmt = db.select(Post).options(*eager_load(schema, Post, include=key))
+        tags = tag_filter()
+        if tags:
+            if fmt:
+                raise ValidationError({'stream': ['Cannot be combined with tags.']})
+            # Tag filters are answered from the in-memory bitmap index, only the page of posts is loaded
+            names, mode = tags
+            posts, cursors = paginate_tagged(names, mode, eager_load(schema, Post))
+            return jsonify(fast_dump(schema, posts)), 200, cursors
+        if fmt:
+            return stream(stmt, schema, key, fmt)
+        posts, cursors = paginate(stmt, key)
         # Serialize the list of posts and return as JSON
-        return jsonify(PostSchema(many=True).dump(posts)), 200
+        return jsonify(fast_dump(schema, posts)), 200, cursors
+    except ValidationError as err:
+        return jsonify(err.messages), 400
     except Exception as e:
         return jsonify({"error": "Internal Server Error", "message": str(e)}), 500
 
 # Get one post (R)
 @posts_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
+@conditional(Post, 'id')
+@cached
 def one_post(id):
     """
     Get one post by ID.
 
     This function retrieves a single post by its ID from the database and returns it as JSON.
+    The rendered response is cached until the post, its author, comments or tags change.
+    Responds with a strong ETag and answers a matching If-None-Match with 304 Not Modified.
 
     Parameters:
     id (int): The ID of the post to retrieve.
+    fields, expand (query): Sparse fieldset parameters, as for all_posts.
 
     Returns:
     A JSON response containing the requested post.
     """
     try:
-        # Retrieve a single post by ID
+        # Retrieve a single post by ID, eager loading its nested relationships
         # If the record is not found, it raises a 404 error
-        post = db.get_or_404(Post, id)
+        schema = sparse_schema(PostSchema)
+        stmt = db.select(Post).where(Post.id == id).options(*eager_load(schema, Post))
+        post = db.first_or_404(stmt)
+        depends_on(post)
         # Serialize the post and return as JSON
-        return jsonify(PostSchema().dump(post)), 200
+        return jsonify(fast_dump(schema, post)), 200
+    except ValidationError as err:
+        return jsonify(err.messages), 400
     except Exception as e:
         return jsonify({"error": "Internal Server Error", "message": str(e)}), 500
 
@@ -66,18 +117,25 @@ def posts_by_user(user_id):
     """
     Get all posts by a specific user.
 
-    This function retrieves all posts by a specific user from the database and returns them as JSON.
+    This function retrieves a page of posts by a specific user from the database, newest first, and returns them as JSON.
 
     Parameters:
     user_id (int): The ID of the user whose posts to retrieve.
+    limit, after, before (query): Keyset pagination parameters, as for all_posts.
+    fields, expand (query): Sparse fieldset parameters, as for all_posts.
 
     Returns:
-    A JSON response containing all posts by the specified user.
+    A JSON response containing a page of posts by the specified user, with cursors in the response headers.
     """
     try:
-        user = db.get_or_404(User, user_id)
-        posts = user.posts
-        return jsonify(PostSchema(many=True).dump(posts)), 200
+        db.get_or_404(User, user_id)
+        key = (Post.date_created, Post.id)
+        schema = sparse_schema(PostSchema, many=True)
+        stmt = db.select(Post).where(Post.user_id == user_id).options(*eager_load(schema, Post, include=key))
+        posts, cursors = paginate(stmt, key)
+        return jsonify(fast_dump(schema, posts)), 200, cursors
+    except ValidationError as err:
+        return jsonify(err.messages), 400
     except Exception as e:
         return jsonify({"error": "Internal Server Error", "message": str(e)}), 500
 
@@ -109,11 +167,47 @@ def create_post():
             date_created=date.today()
         )
         db.session.add(post)
+        post_added(post.user_id)
+        add_to_index(post)
         db.session.commit()
         return jsonify(PostSchema().dump(post)), 201
     except Exception as e:
         return jsonify({"error": "Internal Server Error", "message": str(e)}), 500
 
+# Create many posts (C)
+@posts_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+def bulk_create_posts():
+    """
+    Create many posts in a single transaction.
+
+    Each item is validated like the body of POST /posts/. The valid ones are inserted with
+    batched INSERT ... RETURNING statements, and the invalid ones are reported by index.
+
+    Parameters:
+    (list, body): Objects with the `title` and `content` of each post, at most MAX_BULK_ITEMS.
+
+    Returns:
+    A JSON response with the index and ID of each post created, and the errors of the invalid items by index.
+    The status is 201 if every post was created, 207 if some were and 400 if none was.
+    """
+    valid, errors = load_items(PostSchema(many=True, only=['title', 'content'], unknown='exclude'), request.json)
+    user_id = get_jwt_identity()
+    today = date.today()
+    rows = [
+        {'title': post_info['title'], 'content': post_info.get('content', ''), 'user_id': user_id, 'date_created': today}
+        for _, post_info in valid
+    ]
+    ids = []
+    if rows:
+        ids = insert_rows(Post, rows, ('title', 'content'))
+        for row, post_id in zip(rows, ids):
+            row['id'] = post_id
+        post_added(user_id, len(rows))
+        add_rows_to_index(Post, rows)
+        db.session.commit()
+    return bulk_response([index for index, _ in valid], ids, errors)
+
 # Update a post (U)
 @posts_bp.route('/<int:id>', methods=['PUT', 'PATCH'])
 @admin_or_owner_only(Post, 'id', 'post')
@@ -130,8 +224,7 @@ def update_post(id):
     A JSON response containing the updated post.
     """
     try:
-        post = db.get_or_404(Post, id)
-        authorize_owner(post, 'post')
+        post = authorized_resource()
         post_info = PostSchema(only=['title', 'content']).load(request.json, unknown='exclude')
     except ValidationError as err:
         return jsonify(err.messages), 400
@@ -141,7 +234,10 @@ def update_post(id):
     try:
         post.title = post_info.get('title', post.title)
         post.content = post_info.get('content', post.content)
+        touch(post)
+        add_to_index(post)
         db.session.commit()
+        invalidate(f'posts:{id}')
         return jsonify(PostSchema().dump(post)), 200
     except Exception as e:
         return jsonify({"error": "Internal Server Error", "message": str(e)}), 500
@@ -162,10 +258,93 @@ def delete_post(id):
     An empty response with status 204.
     """
     try:
-        post = db.get_or_404(Post, id)
-        authorize_owner(post, 'post')
+        post = authorized_resource()
+        post_deleting(post.id, post.user_id)
+        # The post's taggings, to uncount from the trending tags
+        taggings = db.session.execute(db.select(post_tags.c.tag_id, post_tags.c.tagged_at).where(post_tags.c.post_id == id)).all()
+        tag_ids = [tag_id for tag_id, _ in taggings]
+        # Remove the post and its comments from the search index
+        remove_from_index(Post, Post.id == id)
+        remove_from_index(Comment, Comment.post_id == id)
         db.session.delete(post)
         db.session.commit()
+        tag_index().remove_posts([id])
+        tag_prefix_index().adjust_usage({tag_id: -1 for tag_id in tag_ids})
+        trending_tags().unrecord(taggings)
+        # The tag list shows the post counts of the post's tags
+        invalidate(f'posts:{id}', 'tags')
         return {}, 204
     except Exception as e:
         return jsonify({"error": "Internal Server Error", "message": str(e)}), 500
+
+# Set the tags of a post (U)
+@posts_bp.route('/<int:id>/tags', methods=['PUT'])
+@admin_or_owner_only(Post, 'id', 'post')
+def set_post_tags(id):
+    """
+    Set the tags of a post.
+
+    Tags that do not exist are created, and only the tags added or removed are written.
+
+    Parameters:
+    id (int): The ID of the post to tag.
+    tags (list, body): The complete list of tag names of the post.
+
+    Returns:
+    A JSON response containing the tags of the post.
+    """
+    tag_info = PostTagsSchema().load(request.json, unknown='exclude')
+    names = tag_names(tag_info['tags'])
+    result = retag({id: names})
+    db.session.commit()
+    retagged(result)
+    return jsonify([{'id': result.tags[name], 'name': name} for name in names]), 200
+
+# Set the tags of many posts (U)
+@posts_bp.route('/tags', methods=['PUT'])
+@jwt_required()
+def bulk_set_post_tags():
+    """
+    Set the tags of many posts in one transaction.
+
+    The database is queried the same number of times whatever the number of posts.
+    Admins can retag any post, other users only their own.
+
+    Parameters:
+    posts (list, body): Objects with the `id` of a post and the complete list of its `tags`.
+
+    Returns:
+    A JSON response with the number of posts retagged, tags created, and tags added and removed.
+    """
+    body = request.json
+    if not isinstance(body, dict):
+        raise ValidationError({'_schema': ['Must be an object with a list of posts.']})
+    posts_info = RetagSchema(many=True).load(body.get('posts', []), unknown='exclude')
+    if not posts_info or len(posts_info) > MAX_RETAG_POSTS:
+        raise ValidationError({'posts': [f'Must contain between 1 and {MAX_RETAG_POSTS} posts.']})
+    changes = {post_info['id']: tag_names(post_info['tags']) for post_info in posts_info}
+    if len(changes) < len(posts_info):
+        # Each post gets one complete list of tags, a repeated ID would silently keep only the last
+        counts = Counter(post_info['id'] for post_info in posts_info)
+        duplicates = sorted(post_id for post_id, count in counts.items() if count > 1)
+        raise ValidationError({'posts': [f'Duplicate post IDs: {", ".join(map(str, duplicates))}']})
+
+    # Check every post exists and belongs to the user, unless the user is an admin
+    owners = dict(db.session.execute(db.select(Post.id, Post.user_id).where(Post.id.in_(list(changes)))).all())
+    missing = sorted(set(changes) - set(owners))
+    if missing:
+        raise ValidationError({'posts': [f'Unknown post IDs: {", ".join(map(str, missing))}']})
+    user_id = get_jwt_identity()
+    if any(owner != user_id for owner in owners.values()):
+        if not is_admin(user_id):
+            abort(make_response(jsonify(error='You must be the owner of every post or an admin to retag them'), 403))
+
+    result = retag(changes)
+    db.session.commit()
+    retagged(result)
+    return jsonify({
+        'posts': len(changes),
+        'created': len(result.created),
+        'added': len(result.added),
+        'removed': len(result.removed),
+    }), 200
@@ -0,0 +1,49 @@
+from flask import Blueprint, current_app, jsonify, request
+from marshmallow import ValidationError
+from auth import admin_only
+from profiler import collapsed, speedscope
+
+# Initialise the Blueprint for profile routes
+profiles_bp = Blueprint('profiles', __name__, url_prefix='/profiles')
+
+# Output formats of a stored profile
+PROFILE_FORMATS = ('collapsed', 'speedscope')
+
+# Get the stored request profiles (R)
+@profiles_bp.route('/', methods=['GET'])
+@admin_only
+def all_profiles():
+    """
+    Retrieves the summary of the stored request profiles, most recent first.
+    Requires JWT authentication and that the user is an admin.
+
+    Returns:
+        JSON response containing the ID, request, status, duration and sample count of each profile.
+    """
+    return jsonify(current_app.extensions['profiler'].store.list()), 200
+
+# Get one stored request profile (R)
+@profiles_bp.route('/<profile_id>', methods=['GET'])
+@admin_only
+def one_profile(profile_id):
+    """
+    Retrieves a stored request profile.
+    Requires JWT authentication and that the user is an admin.
+
+    Args:
+        profile_id (str): The ID returned in the X-Profile-Id header of the profiled response.
+        format (str, query): `collapsed` (default) for collapsed stacks, as read by flamegraph.pl
+            and speedscope, or `speedscope` for a speedscope JSON file.
+
+    Returns:
+        The profile in the requested format, or a 404 error if it does not exist.
+    """
+    fmt = request.args.get('format', 'collapsed')
+    if fmt not in PROFILE_FORMATS:
+        raise ValidationError({'format': [f'Must be one of: {", ".join(PROFILE_FORMATS)}.']})
+    profile = current_app.extensions['profiler'].store.get(profile_id)
+    if profile is None:
+        return jsonify(error='Profile not found'), 404
+    if fmt == 'speedscope':
+        return jsonify(speedscope(profile)), 200
+    return collapsed(profile['stacks']), 200, {'Content-Type': 'text/plain; charset=utf-8'}
@@ -0,0 +1,53 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from models.post import Post, PostSchema
+from models.comment import Comment, CommentSchema
+from loaders import eager_load
+from fieldsets import sparse_schema
+from serializers import fast_dump
+from search import search
+
+# Initialise the Blueprint for search routes
+search_bp = Blueprint('search', __name__)
+
+# Search posts (R)
+@search_bp.route('/posts/search', methods=['GET'])
+@jwt_required()
+def search_posts():
+    """
+    Searches the title and content of posts, most relevant first.
+    Requires JWT authentication.
+
+    Query parameters:
+        q (str): The words to search for. Every word must match.
+        limit, after, before: Keyset pagination parameters, see pagination.KeysetPage.
+        fields, expand: Sparse fieldset parameters, see fieldsets.sparse_schema.
+
+    Returns:
+        JSON response containing a page of matching posts, with cursors in the response headers.
+    """
+    schema = sparse_schema(PostSchema, many=True)
+    posts, cursors = search(Post, request.args.get('q'), eager_load(schema, Post))
+    # Serialize the list of posts and return as JSON
+    return jsonify(fast_dump(schema, posts)), 200, cursors
+
+# Search comments (R)
+@search_bp.route('/comments/search', methods=['GET'])
+@jwt_required()
+def search_comments():
+    """
+    Searches the content of comments, most relevant first.
+    Requires JWT authentication.
+
+    Query parameters:
+        q (str): The words to search for. Every word must match.
+        limit, after, before: Keyset pagination parameters, see pagination.KeysetPage.
+        fields, expand: Sparse fieldset parameters, see fieldsets.sparse_schema.
+
+    Returns:
+        JSON response containing a page of matching comments, with cursors in the response headers.
+    """
+    schema = sparse_schema(CommentSchema, many=True)
+    comments, cursors = search(Comment, request.args.get('q'), eager_load(schema, Comment))
+    # Serialize the list of comments and return as JSON
+    return jsonify(fast_dump(schema, comments)), 200, cursors
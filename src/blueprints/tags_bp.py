@@ -1,9 +1,17 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from marshmallow import ValidationError
-from models.post import PostSchema
-from models.tag import Tag, TagSchema
+from models.post import Post, PostSchema
+from models.tag import Tag, TagSchema, post_tags
 from auth import admin_only
+from pagination import paginate
+from loaders import eager_load
+from fieldsets import sparse_schema
+from serializers import fast_dump
+from cache import cached, depends_on, invalidate
+from etags import touch, touch_posts_with_tag
+from tag_index import tag_index, tag_prefix_index, prefix_filter
+from trending import trending_tags, trending_args
 from init import db
 
 # Initialise the Blueprint for tag routes
@@ -12,24 +20,57 @@ tags_bp = Blueprint('tags', __name__)
 # Retrieve posts by tag (R)
 @tags_bp.route('/tags/<int:tag_id>/posts', methods=['GET'])
 @jwt_required()
+@cached
 def get_posts_by_tag(tag_id):
     """
-    Retrieves all posts associated with a specific tag.
-    Requires JWT authentication.
+    Retrieves a page of posts associated with a specific tag, newest first.
+    Requires JWT authentication. The rendered response is cached until the tag or one of the posts changes.
 
     Args:
         tag_id (int): ID of the tag to retrieve posts for.
 
+    Query parameters:
+        limit, after, before: Keyset pagination parameters, see pagination.KeysetPage.
+        fields, expand: Sparse fieldset parameters, see fieldsets.sparse_schema.
+
     Returns:
-        JSON response containing all posts associated with the tag.
+        JSON response containing a page of posts associated with the tag, with cursors in the response headers.
     """
-    # Retrieve the tag by ID
-    tag = Tag.query.get_or_404(tag_id)
-    # This attribute uses the relationship defined in the Tag model to get all posts associated with the tag
-    # It leverages the many-to-many relationship between Post and Tag models
-    posts = tag.posts  # Use the relationship to get all posts associated with the tag
+    # Ensure the tag exists
+    Tag.query.get_or_404(tag_id)
+    # Select the posts through the post_tags association table
+    # It leverages the many-to-many relationship between Post and Tag models without loading every post of the tag
+    key = (Post.date_created, Post.id)
+    schema = sparse_schema(PostSchema, many=True)
+    stmt = db.select(Post).join(post_tags, post_tags.c.post_id == Post.id).where(post_tags.c.tag_id == tag_id)
+    # Eager load the nested relationships the schema dumps, instead of a lazy load per post
+    stmt = stmt.options(*eager_load(schema, Post, include=key))
+    posts, cursors = paginate(stmt, key)
+    depends_on(f'tags:{tag_id}', f'tags:{tag_id}:posts', posts)
     # Serialize the list of posts and return as JSON
-    return jsonify(PostSchema(many=True).dump(posts)), 200
+    return jsonify(fast_dump(schema, posts)), 200, cursors
+
+# Retrieve trending tags (R)
+@tags_bp.route('/tags/trending', methods=['GET'])
+@jwt_required()
+def get_trending_tags():
+    """
+    Retrieves the tags with the most posts tagged within a recent window.
+    Requires JWT authentication. Counts are served from in-memory sliding window counters.
+
+    Query parameters:
+        window (str): '1h' (minute buckets), '24h' or '7d' (hour buckets), 24h by default.
+        limit (int): Maximum number of tags returned, 10 by default.
+
+    Returns:
+        JSON response containing the trending tags, with the number of posts tagged in the window.
+    """
+    window, limit = trending_args()
+    top = trending_tags().top(window, limit)
+    # Only the names of the returned tags are read from the database
+    names = dict(db.session.execute(db.select(Tag.id, Tag.name).where(Tag.id.in_([tag_id for tag_id, _ in top]))).all())
+    trending = [{'id': tag_id, 'name': names[tag_id], 'count': count} for tag_id, count in top if tag_id in names]
+    return jsonify(trending), 200
 
 # Create new tag (C)
 @tags_bp.route('/tags', methods=['POST'])
@@ -59,24 +100,41 @@ def create_tag():
     # Add the new tag to the session and commit to the database
     db.session.add(tag)
     db.session.commit()
+    tag_prefix_index().add(tag)
+    invalidate('tags')
     # Serialize the new tag and return as JSON with status 201
     return jsonify(TagSchema().dump(tag)), 201
 
 # Get all tags (R)
 @tags_bp.route('/tags', methods=['GET'])
 @jwt_required()
+@cached
 def get_tags():
     """
-    Retrieves all tags.
-    Requires JWT authentication.
+    Retrieves all tags, or suggests the most used tags starting with a prefix.
+    Requires JWT authentication. The rendered response is cached until a tag is created, updated or deleted.
+
+    Query parameters:
+        prefix (str): Return only tags whose name starts with this, ignoring case, most used first.
+        limit (int): Maximum number of tags returned with a prefix, 10 by default.
+        fields: Sparse fieldset parameter, see fieldsets.sparse_schema.
 
     Returns:
-        JSON response containing all tags.
+        JSON response containing the tags.
     """
-    # Retrieve all tags from the database
-    tags = Tag.query.all()
+    schema = sparse_schema(TagSchema, many=True)
+    suggest = prefix_filter()
+    if suggest:
+        # Suggestions are served from the in-memory prefix index without querying the database
+        prefix, limit = suggest
+        tags = tag_prefix_index().suggest(prefix, limit)
+        depends_on('tags')
+        return jsonify(fast_dump(schema, tags)), 200
+    # Retrieve all tags from the database, selecting only the requested columns
+    tags = db.session.scalars(db.select(Tag).options(*eager_load(schema, Tag))).all()
+    depends_on('tags', tags)
     # Serialize the list of tags and return as JSON
-    return jsonify(TagSchema(many=True).dump(tags)), 200
+    return jsonify(fast_dump(schema, tags)), 200
 
 # Update/edit tag (U)
 @tags_bp.route('/tags/<int:tag_id>', methods=['PUT', 'PATCH'])
@@ -106,8 +164,15 @@ def update_tag(tag_id):
 
     # Update tag attributes if provided
     tag.name = tag_info.get('name', tag.name)
+    touch(tag)
+    # The posts showing the tag change too
+    touch_posts_with_tag(tag_id)
     # Commit the changes to the database
     db.session.commit()
+    tag_prefix_index().rename(tag_id, tag.name)
+    # Every cached post showing the tag depends on it and is invalidated with it
+    # and the tag may now match different prefixes
+    invalidate('tags', f'tags:{tag_id}')
     # Return a success message as JSON
     return jsonify({'message': 'Tag updated successfully'}), 200
 
@@ -127,8 +192,14 @@ def delete_tag(tag_id):
     """
     # Retrieve the tag to be deleted by ID
     tag = db.get_or_404(Tag, tag_id)
+    # The posts showing the tag change too
+    touch_posts_with_tag(tag_id)
     # Delete the tag from the database
     db.session.delete(tag)
     db.session.commit()
+    tag_index().remove_tag(tag_id)
+    tag_prefix_index().remove(tag_id)
+    trending_tags().forget(tag_id)
+    invalidate('tags', f'tags:{tag_id}')
     # Return a success message as JSON
     return jsonify({'message': 'Tag deleted successfully'}), 200
@@ -2,10 +2,28 @@ from datetime import timedelta
 from flask import request, Blueprint, jsonify
 from flask_jwt_extended import create_access_token, jwt_required
 from marshmallow import ValidationError
+from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 from models.user import User, UserSchema
-from auth import admin_only, admin_or_owner_only, owner_only, authorize_owner
-from init import db, bcrypt
+from models.post import Post
+from models.comment import Comment
+from models.tag import post_tags
+from auth import admin_only, admin_or_owner_only, owner_only, authorized_resource
+from pagination import paginate
+from loaders import eager_load
+from fieldsets import sparse_schema
+from serializers import fast_dump
+from streaming import stream, stream_format
+from cache import invalidate
+from etags import touch_posts_of_user
+from counters import user_deleting
+from search import remove_from_index
+from tag_index import tag_index, tag_prefix_index
+from trending import trending_tags
+from metrics import bcrypt_timer
+from passwords import password_hasher, PasswordHashingUnavailable
+from token_versions import token_claims, token_versions
+from init import db
 
 # Initialise the Blueprint for user routes
 users_bp = Blueprint('users', __name__, url_prefix='/users')
@@ -18,22 +36,31 @@ def all_users():
     """
     Retrieve all users in the system.
 
-    This function returns a JSON response containing a list of all users in the system.
+    This function returns a JSON response containing a page of users in the system, newest first.
     It requires admin privileges to access.
 
     Parameters:
-    None
+    limit (int, query): Maximum number of users to return.
+    after (str, query): Cursor of the user to start after, taken from the X-Next-Cursor header.
+    before (str, query): Cursor of the user to end before, taken from the X-Prev-Cursor header.
+    fields (str, query): Comma separated fields to return, e.g. id,username.
+    stream (str, query): 'json' or 'ndjson' to stream every user after the cursor instead of returning a page.
 
     Returns:
-    A JSON response containing a list of all users in the system, serialized using the UserSchema.
+    A JSON response containing a page of users, serialized using the UserSchema, with cursors in the response headers.
     """
-    # Create a SQLAlchemy query to select all users
-    # Selects all records from the users table
+    # Create a SQLAlchemy query to select a page of users
+    # Users have no creation date, so the primary key alone is the pagination key
     # uses the SQLAlchemy ORM to generate the SQL SELECT statement
-    stmt = db.select(User)
-    users = db.session.scalars(stmt).all()
+    # Only the requested columns are selected
+    schema = sparse_schema(UserSchema, many=True)
+    stmt = db.select(User).options(*eager_load(schema, User))
+    fmt = stream_format()
+    if fmt:
+        return stream(stmt, schema, (User.id,), fmt)
+    users, cursors = paginate(stmt, (User.id,))
     # Serialize the list of users and return as JSON
-    return jsonify(UserSchema(many=True).dump(users))
+    return jsonify(fast_dump(schema, users)), 200, cursors
 
 # Get one user (R)
 # /users/<int:id>: This endpoint retrieves a specific user by their ID. It requires authentication, enforced by the @jwt_required() decorator.
@@ -48,6 +75,7 @@ def one_user(id):
 
     Parameters:
     id (int): The ID of the user to retrieve.
+    fields (str, query): Comma separated fields to return, e.g. id,username.
 
     Returns:
     A JSON response containing a single user with the specified ID, serialized using the UserSchema.
@@ -55,9 +83,11 @@ def one_user(id):
     # Retrieve a single user by ID
     # retrieves a single record from the users table by its primary key.
     # If the record is not found, it raises a 404 error.
-    user = db.get_or_404(User, id)
+    # Only the requested columns are selected
+    schema = sparse_schema(UserSchema)
+    user = db.first_or_404(db.select(User).where(User.id == id).options(*eager_load(schema, User)))
     # Serialize the user and return as JSON
-    return jsonify(UserSchema().dump(user))
+    return jsonify(fast_dump(schema, user))
 
 # Login (C)
 # /users/login: This endpoint allows a user to log in by providing their email and password. It returns a JWT token if the credentials are valid.
@@ -89,9 +119,20 @@ def login():
     stmt = db.select(User).where(User.email == params['email'])
     user = db.session.scalar(stmt)
     # Check if user exists and password matches
-    if user and bcrypt.check_password_hash(user.password, params['password']):
-        # Create a JWT token and return as JSON
-        token = create_access_token(identity=user.id, expires_delta=timedelta(hours=2))
+    with bcrypt_timer('check'):
+        valid = user is not None and password_hasher().check(user.password, params['password'])
+    if valid:
+        # Rehash a password stored with a former work factor, now that it is known
+        if password_hasher().needs_rehash(user.password):
+            try:
+                with bcrypt_timer('hash'):
+                    user.password = password_hasher().hash(params['password'])
+                db.session.commit()
+            except PasswordHashingUnavailable:
+                # The login still succeeds, the password is rehashed at a later one
+                pass
+        # Create a JWT token carrying the user's role and token version, and return as JSON
+        token = create_access_token(identity=user.id, expires_delta=timedelta(hours=2), additional_claims=token_claims(user))
         return jsonify({'token': token})
     else:
         # Return an error if email or password is incorrect
@@ -124,11 +165,13 @@ def create_user():
     if db.session.query(User).filter_by(username=user_info['username']).first():
         return jsonify({'error': 'Username already exists'}), 409
     
+    with bcrypt_timer('hash'):
+        password = password_hasher().hash(user_info['password'])
     # Create a new User instance
     user = User(
         username=user_info['username'],
         email=user_info['email'],
-        password=bcrypt.generate_password_hash(user_info['password']).decode('utf8'),
+        password=password,
         first_name=user_info.get('first_name'),
         last_name=user_info.get('last_name'),
         is_admin=user_info.get('is_admin', False)
@@ -148,7 +191,7 @@ def create_user():
 # Update a user (U)
 # /users/<int:id> (PUT/PATCH): This endpoint allows a user to update their information. It requires that the user be the owner of the account, enforced by the @owner_only decorator.
 @users_bp.route('/<int:id>', methods=['PUT', 'PATCH'])
-@owner_only
+@owner_only(User, 'id', 'user')
 def update_user(id):
     """
     Update a user's attributes.
@@ -162,10 +205,8 @@ def update_user(id):
     Returns:
     A JSON response containing the updated user, serialized using the UserSchema.
     """
-    # Retrieve the user to be updated by ID
-    user = db.get_or_404(User, id)
-    # Ensure the current user is the owner of the resource
-    authorize_owner(user, 'user')
+    # The user loaded and authorised by owner_only
+    user = authorized_resource()
     try:
         # Validate and deserialize the request JSON data
         user_info = UserSchema(only=['username', 'email', 'password', 'first_name', 'last_name']).load(request.json, unknown='exclude')
@@ -182,9 +223,12 @@ def update_user(id):
     user.username = user_info.get('username', user.username)
     user.email = user_info.get('email', user.email)
     if 'password' in user_info:
-        user.password = bcrypt.generate_password_hash(user_info['password']).decode('utf8')
+        with bcrypt_timer('hash'):
+            user.password = password_hasher().hash(user_info['password'])
     user.first_name = user_info.get('first_name', user.first_name)
     user.last_name = user_info.get('last_name', user.last_name)
+    # Posts show their author and the authors of their comments
+    touch_posts_of_user(id)
     
     try:
         # Commit the changes to the database
@@ -192,6 +236,8 @@ def update_user(id):
     except IntegrityError:
         db.session.rollback()
         return jsonify({'error': 'An error occurred while updating the user'}), 409
+    # Cached posts and comments show the user's details
+    invalidate(f'users:{id}')
     
     # Serialize the updated user and return as JSON
     return jsonify(UserSchema().dump(user))
@@ -213,12 +259,29 @@ def delete_user(id):
     Returns:
     An empty response with status 204.
     """
-    # Retrieve the user to be deleted by ID
-    user = db.get_or_404(User, id)
-    # Ensure the current user is the owner of the resource
-    authorize_owner(user, 'user')
+    # The user loaded and authorised by admin_or_owner_only
+    user = authorized_resource()
+    # Collect the cached responses of the posts and comments removed by the cascade
+    post_ids = [post.id for post in user.posts]
+    # The taggings of their posts, to uncount from the trending tags
+    taggings = db.session.execute(db.select(post_tags.c.tag_id, post_tags.c.tagged_at).where(post_tags.c.post_id.in_(post_ids))).all()
+    dependencies = [f'users:{id}', 'tags'] + [f'posts:{post_id}' for post_id in post_ids] + [f'comments:{comment.id}' for comment in user.comments]
+    # Posts lose the user's comments
+    touch_posts_of_user(id)
+    # Other posts, users and tags lose the counts of the removed posts and comments
+    user_deleting(id)
+    # Remove the user's posts and comments, and the comments on their posts, from the search index
+    remove_from_index(Comment, or_(Comment.user_id == id, Comment.post_id.in_(db.select(Post.id).where(Post.user_id == id))))
+    remove_from_index(Post, Post.user_id == id)
     # Delete the user from the database
     db.session.delete(user)
     db.session.commit()
+    # Revoke the user's tokens
+    token_versions().deleted(id)
+    tag_index().remove_posts(post_ids)
+    trending_tags().unrecord(taggings)
+    # The usage of many tags may have changed, rebuild the suggestions
+    tag_prefix_index().reset()
+    invalidate(*dependencies)
     # Return an empty response with status 204
     return {}, 204
@@ -0,0 +1,76 @@
+from flask import jsonify
+from marshmallow import ValidationError
+from init import db
+
+# Maximum number of items created by a single bulk request
+MAX_BULK_ITEMS = 10000
+
+
+def load_items(schema, items):
+    """
+    Validate the items of a bulk request, keeping the valid ones.
+
+    Args:
+        schema: A schema instance with many=True.
+        items: The request JSON, expected to be a list.
+
+    Returns:
+        A (valid, errors) tuple: the deserialized valid items as (index, data) pairs, and the
+        error messages of the invalid items by index.
+
+    Raises:
+        ValidationError: If the body is not a list of 1 to MAX_BULK_ITEMS items.
+    """
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BULK_ITEMS:
+        raise ValidationError({'_schema': [f'Must be a list of 1 to {MAX_BULK_ITEMS} items.']})
+    try:
+        return list(enumerate(schema.load(items))), {}
+    except ValidationError as err:
+        # Loading many items reports errors by index, and partly loads the invalid ones
+        errors = err.messages
+        return [(index, data) for index, data in enumerate(err.valid_data) if index not in errors], errors
+
+
+def insert_rows(model, rows, keys):
+    """
+    Insert rows with batched INSERT ... RETURNING statements, in the current transaction.
+
+    The database may return the new rows in any order, so they are matched back to `rows`
+    by the values of `keys`. Rows with equal values are interchangeable.
+
+    Args:
+        model: The model of the rows.
+        rows: A dict of column values per row.
+        keys: The names of the columns identifying a row among the others.
+
+    Returns:
+        The IDs of the new rows, in the order of `rows`.
+    """
+    positions = {}
+    for position, row in enumerate(rows):
+        positions.setdefault(tuple(row[key] for key in keys), []).append(position)
+    ids = [None] * len(rows)
+    table = model.__table__
+    stmt = table.insert().returning(table.c.id, *[table.c[key] for key in keys])
+    for ident, *values in db.session.execute(stmt, rows):
+        ids[positions[tuple(values)].pop()] = ident
+    return ids
+
+
+def bulk_response(indexes, ids, errors):
+    """
+    Return the response of a bulk request.
+
+    The status is 201 when every item was created, 207 when some were, and 400 when none was.
+
+    Args:
+        indexes: The index in the request of each created item.
+        ids: The ID of each created item.
+        errors: The error messages of the invalid items by index.
+    """
+    response = jsonify({
+        'created': [{'index': index, 'id': ident} for index, ident in zip(indexes, ids)],
+        'errors': {str(index): messages for index, messages in errors.items()},
+    })
+    response.status_code = 400 if not ids else 207 if errors else 201
+    return response
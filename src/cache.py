@@ -0,0 +1,427 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, make_response, request
+from sqlalchemy import inspect
+
+# Version name bumped on every invalidation, used to detect writes that race with a render
+EPOCH = '*'
+
+# Version name recorded by every entry and bumped when the database is recreated, invalidating them all
+GENERATION = '#'
+
+# SQLite limits the number of bound parameters, so version lookups are chunked
+_VERSION_CHUNK = 500
+
+
+class LRUCache:
+    """
+    In-process least recently used cache with a cap on the total size of its values.
+
+    Attributes:
+        max_bytes (int): The maximum total size of the cached values.
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+        evictions (int): Number of entries removed to make room for new ones.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored under a key and mark it as recently used, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size):
+        """Store a value of the given size, evicting the least recently used entries to make room."""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            while self._entries and self.size + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self.size += size
+
+    def delete(self, key):
+        """Remove a key if it is present."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def stats(self):
+        """Return the counters and current size of the cache."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class SharedCache:
+    """
+    Cache tier shared by every worker process on the host, stored in a local SQLite file.
+
+    Besides the rendered entries, the file holds the version counters of the dependencies
+    entries are validated against, so an invalidation in one worker is seen by all of them.
+
+    Attributes:
+        path (str): The SQLite database file.
+        max_entries (int): The maximum number of entries kept, oldest are evicted first.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = self.misses = self.evictions = 0
+        self._local = threading.local()
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, value BLOB NOT NULL, stored REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_entries_stored ON entries (stored);
+            CREATE TABLE IF NOT EXISTS versions (
+                name TEXT PRIMARY KEY, version INTEGER NOT NULL
+            );
+        """)
+
+    def _connection(self):
+        """Return the SQLite connection for the current thread, opening one after a fork."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, key):
+        """Return the value stored under a key, or None."""
+        row = self._connection().execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value):
+        """Store a value, evicting the oldest entries when the tier is full."""
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO entries (key, value, stored) VALUES (?, ?, ?)', (key, value, time.time()))
+        (count,) = connection.execute('SELECT COUNT(*) FROM entries').fetchone()
+        if count > self.max_entries:
+            cursor = connection.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY stored LIMIT ?)',
+                (count - self.max_entries,),
+            )
+            self.evictions += cursor.rowcount
+
+    def delete(self, key):
+        """Remove a key if it is present."""
+        self._connection().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self):
+        """Remove every entry, keeping the version counters."""
+        self._connection().execute('DELETE FROM entries')
+
+    def versions(self, names):
+        """Return the current version of each name, 0 for names never invalidated."""
+        names = list(names)
+        found = {}
+        connection = self._connection()
+        for start in range(0, len(names), _VERSION_CHUNK):
+            chunk = names[start:start + _VERSION_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            found.update(connection.execute(f'SELECT name, version FROM versions WHERE name IN ({placeholders})', chunk))
+        return {name: found.get(name, 0) for name in names}
+
+    def bump(self, names):
+        """Increment the version of each name in a single transaction."""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT INTO versions (name, version) VALUES (?, 1) '
+                'ON CONFLICT(name) DO UPDATE SET version = version + 1',
+                [(name,) for name in names],
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def stats(self):
+        """Return the counters of this process and the size of the shared tier."""
+        (count,) = self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': count,
+            'max_entries': self.max_entries,
+        }
+
+
+class LocalVersions:
+    """Process-local version counters, used when the shared tier is disabled."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def versions(self, names):
+        """Return the current version of each name, 0 for names never invalidated."""
+        return {name: self._versions.get(name, 0) for name in names}
+
+    def bump(self, names):
+        """Increment the version of each name."""
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+
+def dependency_names(*objects):
+    """
+    Return the dependency names of model instances and of everything loaded beneath them.
+
+    Each instance contributes '<table>:<id>'. Relationships that are already loaded are
+    followed without triggering any lazy load, so a post contributes its author, its comments
+    and their authors, and its tags, exactly as far as they appear in the rendered response.
+
+    Args:
+        *objects: Model instances or lists of them.
+
+    Returns:
+        A set of dependency names.
+    """
+    names = set()
+    seen = set()
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        if obj is None:
+            continue
+        if isinstance(obj, (list, tuple, set)):
+            pending.extend(obj)
+            continue
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        state = inspect(obj)
+        if state.identity is None:
+            continue
+        names.add(f'{state.mapper.local_table.name}:{"-".join(map(str, state.identity))}')
+        for relationship in state.mapper.relationships:
+            if relationship.key not in state.unloaded:
+                pending.append(state.attrs[relationship.key].loaded_value)
+    return names
+
+
+def depends_on(*objects_or_names):
+    """
+    Record what the response being rendered depends on.
+
+    Args:
+        *objects_or_names: Model instances, lists of them, or dependency name strings
+            such as 'tags' for a whole collection.
+    """
+    dependencies = g.get('cache_dependencies')
+    if dependencies is None:
+        # Not rendering a cached view, nothing to record
+        return
+    for item in objects_or_names:
+        if isinstance(item, str):
+            dependencies.add(item)
+        else:
+            dependencies.update(dependency_names(item))
+
+
+class ResponseCache:
+    """
+    Two-tier cache of rendered JSON responses with dependency-based invalidation.
+
+    Responses are cached per request path and query string. Each entry records the
+    version of every row or collection it was rendered from. On a hit the recorded versions
+    are compared with the current ones, and write paths call `invalidate` to bump the versions
+    of what they changed. Renaming a tag therefore invalidates every cached post that shows it,
+    and a new comment invalidates its post, while unrelated entries stay cached.
+
+    The first tier is an in-process LRU capped in bytes. The second is a SQLite file shared
+    by all workers on the host, which also holds the version counters so invalidations are
+    seen by every process.
+
+    Configuration:
+        CACHE_ENABLED (bool): Whether responses are cached at all.
+        CACHE_MAX_BYTES (int): Size cap of the in-process tier.
+        CACHE_SHARED_PATH (str): Path of the shared SQLite file, empty to disable the shared tier.
+        CACHE_SHARED_MAX_ENTRIES (int): Entry cap of the shared tier.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the cache tiers from the application config."""
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self.local = LRUCache(app.config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        path = app.config.get('CACHE_SHARED_PATH')
+        if path:
+            self.shared = SharedCache(path, app.config.get('CACHE_SHARED_MAX_ENTRIES', 10000))
+            self.versions = self.shared
+        else:
+            self.shared = None
+            self.versions = LocalVersions()
+        self.invalidations = 0
+        app.extensions['response_cache'] = self
+
+    def _valid(self, entry):
+        """Return whether every dependency of an entry is still at its recorded version."""
+        recorded = entry['versions']
+        return self.versions.versions(recorded) == recorded
+
+    def get(self, key):
+        """Return a valid cached entry for a key, checking the local tier then the shared tier."""
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                entry = json.loads(value)
+                self.local.set(key, entry, len(value))
+        if entry is None:
+            return None
+        if not self._valid(entry):
+            self.invalidations += 1
+            self.local.delete(key)
+            if self.shared is not None:
+                self.shared.delete(key)
+            return None
+        return entry
+
+    def set(self, key, body, headers, dependencies, epoch):
+        """
+        Store a rendered response unless a write happened while it was rendered.
+
+        Args:
+            key (str): The cache key.
+            body (str): The response body.
+            headers (list): The response headers to replay.
+            dependencies (set): The dependency names the response was rendered from.
+            epoch (int): The global version read before rendering started.
+        """
+        versions = self.versions.versions(set(dependencies) | {EPOCH, GENERATION})
+        if versions.pop(EPOCH) != epoch:
+            return
+        entry = {'body': body, 'headers': headers, 'versions': versions}
+        value = json.dumps(entry)
+        self.local.set(key, entry, len(value))
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def epoch(self):
+        """Return the global version, which changes on every invalidation."""
+        return self.versions.versions([EPOCH])[EPOCH]
+
+    def invalidate(self, *names):
+        """
+        Invalidate every cached response that depends on any of the given names.
+
+        Args:
+            *names: Dependency names such as 'posts:1', 'tags:3' or 'tags'.
+        """
+        if self.enabled and names:
+            self.versions.bump(set(names) | {EPOCH})
+
+    def reset(self):
+        """
+        Invalidate every cached response, in every worker. Call after recreating the database.
+
+        Dependency versions survive a recreated database while the rows they counted are gone,
+        so entries are invalidated by the generation they all record rather than by name.
+        """
+        self.versions.bump({GENERATION, EPOCH})
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        """Return hit, miss and eviction counters for both tiers."""
+        return {
+            'enabled': self.enabled,
+            'local': self.local.stats(),
+            'shared': self.shared.stats() if self.shared is not None else None,
+            'stale': self.invalidations,
+        }
+
+
+def default_shared_path():
+    """Return the default location of the shared cache file."""
+    return os.path.join(tempfile.gettempdir(), 'minornote-cache.sqlite3')
+
+
+def invalidate(*names):
+    """Invalidate cached responses depending on any of the given names, see ResponseCache.invalidate."""
+    current_app.extensions['response_cache'].invalidate(*names)
+
+
+def reset_cache():
+    """Invalidate every cached response, see ResponseCache.reset."""
+    current_app.extensions['response_cache'].reset()
+
+
+def cached(fn):
+    """
+    Route decorator - serve a rendered response from the response cache.
+
+    The view must call `depends_on` with the rows it renders. Only 200 responses are
+    cached. Apply it below the authentication decorators so access is still checked on hits.
+    When an ETag has been computed for the request (see etags.conditional) it is part of the
+    key, so a new version of the resource never hits an older rendering.
+    """
+    @wraps(fn)
+    def inner(*args, **kwargs):
+        cache = current_app.extensions['response_cache']
+        if not cache.enabled:
+            return fn(*args, **kwargs)
+
+        key = request.full_path + g.get('etag', '')
+        entry = cache.get(key)
+        if entry is not None:
+            response = current_app.response_class(entry['body'], status=200, headers=entry['headers'])
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        epoch = cache.epoch()
+        g.cache_dependencies = set()
+        response = make_response(fn(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            headers = [(name, value) for name, value in response.headers if name != 'Content-Length']
+            cache.set(key, response.get_data(as_text=True), headers, g.cache_dependencies, epoch)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return inner
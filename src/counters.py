@@ -0,0 +1,138 @@
+from collections import Counter
+from sqlalchemy import case, func
+from models.user import User
+from models.post import Post
+from models.comment import Comment
+from models.tag import Tag, post_tags
+from init import db
+
+# The denormalized counters, as (counter column, foreign key column of the counted rows)
+COUNTERS = (
+    (Post.comment_count, Comment.post_id),
+    (User.post_count, Post.user_id),
+    (User.comment_count, Comment.user_id),
+    (Tag.post_count, post_tags.c.tag_id),
+)
+
+
+def _execute(stmt):
+    """Execute a bulk UPDATE without synchronizing the objects loaded in the session."""
+    db.session.execute(stmt, execution_options={'synchronize_session': False})
+
+
+def adjust(model, ident, **deltas):
+    """
+    Add to the counters of a single row with one UPDATE.
+
+    The counters are incremented in SQL (count = count + delta), so concurrent writers do not
+    overwrite each other's changes.
+
+    Args:
+        model: The model owning the counters.
+        ident: The primary key of the row, or a list of primary keys.
+        **deltas: The amount to add to each counter, e.g. comment_count=1.
+    """
+    values = {name: getattr(model, name) + delta for name, delta in deltas.items()}
+    criteria = model.id.in_(ident) if isinstance(ident, (list, tuple, set)) else model.id == ident
+    _execute(db.update(model).where(criteria).values(values))
+
+
+def _subtract(counter, foreign_key, *criteria):
+    """
+    Subtract the number of counted rows matching the criteria from a counter, for every row they reference.
+
+    Args:
+        counter: The counter column, e.g. Post.comment_count.
+        foreign_key: The column of the counted rows referencing the counter's row, e.g. Comment.post_id.
+        *criteria: WHERE criteria selecting the counted rows about to be deleted.
+    """
+    model = counter.class_
+    count = db.select(func.count()).select_from(foreign_key.table).where(foreign_key == model.id, *criteria)
+    stmt = db.update(model).where(model.id.in_(db.select(foreign_key).where(*criteria)))
+    _execute(stmt.values({counter.key: counter - count.scalar_subquery()}))
+
+
+def comment_added(post_id, user_id, delta=1):
+    """Count a comment created (or with a negative delta, deleted) on a post by a user."""
+    adjust(Post, post_id, comment_count=delta)
+    adjust(User, user_id, comment_count=delta)
+
+
+def post_added(user_id, delta=1):
+    """Count a post created (or with a negative delta, deleted) by a user."""
+    adjust(User, user_id, post_count=delta)
+
+
+def _adjust_many(counter, deltas):
+    """
+    Add a different amount to the counter of many rows with one UPDATE.
+
+    Args:
+        counter: The counter column, e.g. Tag.post_count.
+        deltas (dict): The amount to add by primary key.
+    """
+    deltas = {ident: delta for ident, delta in deltas.items() if delta}
+    if deltas:
+        model = counter.class_
+        stmt = db.update(model).where(model.id.in_(list(deltas)))
+        _execute(stmt.values({counter.key: counter + case(deltas, value=model.id, else_=0)}))
+
+
+def adjust_tags(deltas):
+    """
+    Add to the post counts of many tags with one UPDATE.
+
+    Args:
+        deltas (dict): The number of posts tagged, or untagged when negative, by tag ID.
+    """
+    _adjust_many(Tag.post_count, deltas)
+
+
+def comments_added(rows):
+    """
+    Count many comments created at once, with one UPDATE of their posts and one of their authors.
+
+    Args:
+        rows: Dicts holding the `post_id` and `user_id` of each new comment.
+    """
+    _adjust_many(Post.comment_count, Counter(row['post_id'] for row in rows))
+    _adjust_many(User.comment_count, Counter(row['user_id'] for row in rows))
+
+
+def post_deleting(post_id, user_id):
+    """
+    Uncount a post and the rows removed with it. Call before deleting the post.
+
+    The author loses a post, each commenter loses their comments on it, and each of its tags
+    loses a post.
+    """
+    post_added(user_id, -1)
+    _subtract(User.comment_count, Comment.user_id, Comment.post_id == post_id)
+    _subtract(Tag.post_count, post_tags.c.tag_id, post_tags.c.post_id == post_id)
+
+
+def user_deleting(user_id):
+    """
+    Uncount the posts and comments removed with a user. Call before deleting the user.
+
+    Posts of other users lose the user's comments, other users lose their comments on the
+    user's posts, and tags lose the user's posts. The user's own row is deleted anyway.
+    """
+    posts = db.select(Post.id).where(Post.user_id == user_id)
+    _subtract(Post.comment_count, Comment.post_id, Comment.user_id == user_id, Comment.post_id.not_in(posts))
+    _subtract(User.comment_count, Comment.user_id, Comment.post_id.in_(posts), Comment.user_id != user_id)
+    _subtract(Tag.post_count, post_tags.c.tag_id, post_tags.c.post_id.in_(posts))
+
+
+def recount():
+    """
+    Rebuild every counter from the rows it counts, with one UPDATE per counter.
+
+    Returns:
+        The number of counter columns rebuilt.
+    """
+    for counter, foreign_key in COUNTERS:
+        model = counter.class_
+        count = db.select(func.count()).select_from(foreign_key.table).where(foreign_key == model.id)
+        _execute(db.update(model).values({counter.key: count.scalar_subquery()}))
+    return len(COUNTERS)
@@ -0,0 +1,94 @@
+import hashlib
+from functools import wraps
+from flask import current_app, g, make_response, request
+from sqlalchemy import or_
+from models.post import Post
+from models.comment import Comment
+from models.tag import post_tags
+from init import db
+
+
+def touch(obj):
+    """
+    Increment the version counter of a model instance when the session is flushed.
+
+    The counter is incremented in SQL (version = version + 1), so concurrent updates are not lost.
+
+    Args:
+        obj: A Post, Comment or Tag instance.
+    """
+    obj.version = type(obj).version + 1
+
+
+def touch_posts(*criteria):
+    """
+    Increment the version counter of every post matching the criteria with a single UPDATE.
+
+    Used when something rendered inside a post changes, e.g. one of its comments or the
+    name of one of its tags, so the post's ETag changes without loading the posts.
+
+    Args:
+        *criteria: SQLAlchemy WHERE criteria on the posts table.
+    """
+    stmt = db.update(Post).where(*criteria).values(version=Post.version + 1)
+    db.session.execute(stmt, execution_options={'synchronize_session': False})
+
+
+def touch_posts_with_tag(tag_id):
+    """Increment the version counter of every post carrying a tag."""
+    touch_posts(Post.id.in_(db.select(post_tags.c.post_id).where(post_tags.c.tag_id == tag_id)))
+
+
+def touch_posts_of_user(user_id):
+    """Increment the version counter of every post written or commented on by a user."""
+    touch_posts(or_(
+        Post.user_id == user_id,
+        Post.id.in_(db.select(Comment.post_id).where(Comment.user_id == user_id)),
+    ))
+
+
+def make_etag(model, ident, version):
+    """
+    Build a strong ETag for the representation of a resource at a given version.
+
+    The request path and query string are included because `fields`, `expand` and the
+    pagination parameters change the body, and so is the JSON provider, which changes its bytes.
+    """
+    source = f'{model.__tablename__}:{ident}:{version}:{request.full_path}:{type(current_app.json).__name__}'
+    return hashlib.sha1(source.encode('utf8')).hexdigest()
+
+
+def conditional(model, ident_param):
+    """
+    Route decorator - answer conditional GETs from the version counter of a resource.
+
+    The version is read with a single primary key lookup. If the client's If-None-Match
+    header holds the current ETag a 304 Not Modified is returned without running the view,
+    otherwise the view's response is returned with the ETag set. The ETag is also stored on
+    `g.etag`, which the response cache uses as part of its key.
+
+    Args:
+        model: The model whose version counter the response is derived from.
+        ident_param (str): The name of the route parameter containing the resource ID.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            ident = kwargs.get(ident_param)
+            version = db.session.scalar(db.select(model.version).where(model.id == ident))
+            if version is None:
+                # Let the view produce its usual not found response
+                return fn(*args, **kwargs)
+
+            etag = g.etag = make_etag(model, ident, version)
+            if etag in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            return response
+
+        return inner
+    return decorator
@@ -0,0 +1,70 @@
+from flask import request
+from marshmallow import ValidationError
+from loaders import nested_schema
+
+
+def _split(value):
+    """Split a comma separated query parameter into a list of names."""
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def _check_path(schema, path, param):
+    """
+    Ensure a (possibly dotted) field path exists in a schema's dump fields.
+
+    Args:
+        schema: The schema instance to resolve the path against.
+        path (str): The field path, e.g. 'user.username'.
+        param (str): The query parameter name, used in validation messages.
+
+    Raises:
+        ValidationError: If any part of the path is not a dumped field.
+    """
+    names = path.split('.')
+    for depth, name in enumerate(names):
+        field = schema.dump_fields.get(name)
+        if field is None:
+            raise ValidationError({param: [f'Unknown field: {path}']})
+        if depth < len(names) - 1:
+            schema = nested_schema(field)
+            if schema is None:
+                raise ValidationError({param: [f'Not an expandable field: {path}']})
+
+
+def sparse_schema(schema_class, **kwargs):
+    """
+    Instantiate a schema narrowed by the `fields` and `expand` query parameters.
+
+    Without either parameter the schema is returned unchanged. Otherwise the response only
+    contains the plain fields listed in `fields` (all plain fields if it is omitted) and the
+    nested objects listed in `expand`. Dotted names such as `user.username` select fields of a
+    nested object and imply its expansion. Because the loader plan is derived from the same
+    schema, unrequested columns and relationships are not loaded from the database either.
+
+    Args:
+        schema_class: The Marshmallow schema class to instantiate.
+        **kwargs: Extra keyword arguments for the schema, e.g. many=True.
+
+    Returns:
+        A schema instance.
+
+    Raises:
+        ValidationError: If a requested field does not exist or cannot be expanded.
+    """
+    requested = _split(request.args.get('fields', ''))
+    expanded = _split(request.args.get('expand', ''))
+    if not requested and not expanded:
+        return schema_class(**kwargs)
+
+    full = schema_class()
+    nested_names = [name for name, field in full.dump_fields.items() if nested_schema(field) is not None]
+    if not requested:
+        requested = [name for name in full.dump_fields if name not in nested_names]
+    for path in requested:
+        _check_path(full, path, 'fields')
+    for path in expanded:
+        _check_path(full, path, 'expand')
+        if path.partition('.')[0] not in nested_names:
+            raise ValidationError({'expand': [f'Not an expandable field: {path}']})
+
+    return schema_class(only=requested + expanded, **kwargs)
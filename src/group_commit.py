@@ -0,0 +1,168 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from flask import current_app
+from models.comment import Comment
+from models.post import Post
+from bulk import insert_rows
+from cache import invalidate
+from counters import comments_added
+from etags import touch_posts
+from search import add_rows_to_index
+from init import db
+
+# Columns telling the comments of a batch apart, to match the inserted IDs back to their requests
+ROW_KEYS = ('content', 'user_id', 'post_id')
+
+
+class GroupCommitTimeout(Exception):
+    """
+    Raised when the writer did not take a comment in time. The comment is dropped, so a client
+    retrying does not create it twice.
+    """
+
+    def __init__(self):
+        super().__init__('The comment was not saved in time')
+
+
+class CommentBatcher:
+    """
+    Group commit of new comments: the comments created by concurrent requests within a short
+    window are inserted with one multi-row INSERT and committed together.
+
+    Each request hands its row to a writer thread and waits for the ID of its comment. The
+    writer takes the first waiting row, collects those arriving within
+    `COMMENT_GROUP_COMMIT_WINDOW_MS`, or already waiting once it elapses, then inserts them,
+    updates the post versions, counters and search index, and commits once. Under a burst of
+    comments the database syncs once per batch instead of once per comment, at the cost of up
+    to one window of latency per request.
+
+    A failed batch is retried one comment per transaction, so an invalid comment only fails
+    its own request, with the error it would have raised without batching. A comment still
+    queued after `COMMENT_GROUP_COMMIT_TIMEOUT` seconds is dropped and its request gets
+    `GroupCommitTimeout`, answered with 503. One the writer already took is waited for, so a
+    comment is either committed and answered with 201, or never committed.
+
+    The writer is started on first use in each process, so forked web workers get their own.
+
+    Configuration:
+        COMMENT_GROUP_COMMIT (bool): Whether new comments are committed in batches.
+        COMMENT_GROUP_COMMIT_WINDOW_MS (float): Milliseconds the writer waits for more comments after the first of a batch.
+        COMMENT_GROUP_COMMIT_MAX_BATCH (int): Most comments committed together.
+        COMMENT_GROUP_COMMIT_TIMEOUT (float): Seconds a comment may wait in the queue before it is dropped.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read the configuration and register the batcher on the application."""
+        self.enabled = app.config.get('COMMENT_GROUP_COMMIT', False)
+        self.window = app.config.get('COMMENT_GROUP_COMMIT_WINDOW_MS', 2.0) / 1000
+        self.max_batch = app.config.get('COMMENT_GROUP_COMMIT_MAX_BATCH', 256)
+        self.timeout = app.config.get('COMMENT_GROUP_COMMIT_TIMEOUT', 5.0)
+        self.app = app
+        self.metrics = app.extensions.get('metrics')
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        app.extensions['comment_batcher'] = self
+
+    def _writer(self):
+        """Return the queue of the current process's writer, starting one after a fork."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # The writer thread of the parent process was not forked with it
+                self._queue, self._thread, self._pid = queue.SimpleQueue(), None, os.getpid()
+            if self._thread is None or not self._thread.is_alive():
+                # A writer that died is replaced, the comments it left queued are committed by the new one
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name='comment-group-commit', daemon=True)
+                self._thread.start()
+            return self._queue
+
+    def submit(self, row):
+        """
+        Insert a comment with the next group commit, and wait until it is committed.
+
+        Args:
+            row (dict): The column values of the comment.
+
+        Returns:
+            The ID of the new comment.
+
+        Raises:
+            GroupCommitTimeout: If the writer did not take the comment within the timeout, which drops it.
+            The database error the comment caused, if it could not be inserted.
+        """
+        future = Future()
+        self._writer().put((row, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise GroupCommitTimeout()
+            # The writer took the comment already, its outcome is about to be known
+            return future.result()
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+                except queue.Empty:
+                    break
+            # Comments whose request timed out are dropped, the others can no longer be cancelled
+            batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        """Commit a batch of (row, future) pairs, resolving each future with its comment's ID or error."""
+        rows = [row for row, future in batch]
+        try:
+            ids = self._insert(rows)
+        except Exception as err:
+            if len(batch) == 1:
+                batch[0][1].set_exception(err)
+                return
+            # One invalid comment fails the whole transaction, the others are committed without it
+            for item in batch:
+                self._commit([item])
+            return
+        for (row, future), ident in zip(batch, ids):
+            future.set_result(ident)
+        # The comments are committed, a failure from here on must not insert them again
+        try:
+            self._committed(rows)
+        except Exception:
+            self.app.logger.exception('group commit of %d comments: updating caches failed', len(rows))
+
+    def _insert(self, rows):
+        """Insert comments and commit them in one transaction, returning their IDs."""
+        with self.app.app_context():
+            ids = insert_rows(Comment, rows, ROW_KEYS)
+            touch_posts(Post.id.in_({row['post_id'] for row in rows}))
+            comments_added(rows)
+            add_rows_to_index(Comment, [{**row, 'id': ident} for row, ident in zip(rows, ids)])
+            db.session.commit()
+        return ids
+
+    def _committed(self, rows):
+        """Invalidate the cached posts of committed comments and record the batch size."""
+        with self.app.app_context():
+            # The posts now render with the new comments
+            invalidate(*{f'posts:{row["post_id"]}' for row in rows})
+        if self.metrics is not None:
+            self.metrics.observe('minornote_comment_group_commit_rows', len(rows))
+
+
+def comment_batcher():
+    """Return the comment batcher of the current application."""
+    return current_app.extensions['comment_batcher']
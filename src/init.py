@@ -1,10 +1,16 @@
-from os import environ
+from os import environ, cpu_count
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
+from json_provider import make_json_provider
+from cache import ResponseCache, default_shared_path
+from sql_timing import SqlTiming
+from metrics import Metrics, default_metrics_path
+from passwords import PasswordHasher
+from rate_limit import default_rate_limit_path
 
 # Define the base class for SQLAlchemy models
 class Base(DeclarativeBase):
@@ -16,16 +22,65 @@ app = Flask(__name__)
 # Configure the application with environment variables
 app.config['JWT_SECRET_KEY'] = environ.get('JWT_KEY') # Secret key for JWT
 app.config['SQLALCHEMY_DATABASE_URI'] = environ.get('SQLALCHEMY_KEY') # Database URI for SQLAlchemy
+app.config['EAGER_LOAD_STRICT'] = environ.get('EAGER_LOAD_STRICT', 'false').lower() == 'true' # Raise on lazy loads during serialization
+app.config['JSON_PROVIDER'] = environ.get('JSON_PROVIDER', 'auto') # JSON encoder: orjson, stdlib, or auto
+app.config['CACHE_ENABLED'] = environ.get('CACHE_ENABLED', 'true').lower() == 'true' # Cache rendered post and tag reads
+app.config['CACHE_MAX_BYTES'] = int(environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)) # Size cap of the in-process cache tier
+app.config['CACHE_SHARED_PATH'] = environ.get('CACHE_SHARED_PATH', default_shared_path()) # SQLite file shared by all workers, empty to disable
+app.config['CACHE_SHARED_MAX_ENTRIES'] = int(environ.get('CACHE_SHARED_MAX_ENTRIES', 10000)) # Entry cap of the shared cache tier
+app.config['SQL_TIMING_ENABLED'] = environ.get('SQL_TIMING_ENABLED', 'true').lower() == 'true' # Record the SQL statements of sampled requests
+app.config['SQL_TIMING_SAMPLE_RATE'] = float(environ.get('SQL_TIMING_SAMPLE_RATE', 1.0)) # Fraction of requests instrumented
+app.config['SQL_TIMING_LOG_MS'] = float(environ.get('SQL_TIMING_LOG_MS', 100)) # Database time from which a request is logged
+app.config['SQL_TIMING_REPEAT_THRESHOLD'] = int(environ.get('SQL_TIMING_REPEAT_THRESHOLD', 5)) # Executions of one statement from which a request is logged
+app.config['METRICS_ENABLED'] = environ.get('METRICS_ENABLED', 'true').lower() == 'true' # Record Prometheus metrics
+app.config['METRICS_PATH'] = environ.get('METRICS_PATH', default_metrics_path()) # SQLite file collecting the metrics of all workers
+app.config['METRICS_FLUSH_INTERVAL'] = float(environ.get('METRICS_FLUSH_INTERVAL', 5)) # Seconds between the metric snapshots of a worker
+app.config['METRICS_TOKEN'] = environ.get('METRICS_TOKEN', '') # Bearer token required to read /metrics, empty for none
+app.config['PROFILE_ENABLED'] = environ.get('PROFILE_ENABLED', 'true').lower() == 'true' # Let admins profile requests on demand
+app.config['PROFILE_PATH'] = environ.get('PROFILE_PATH', '') # SQLite file of the stored profiles, empty for the default
+app.config['PROFILE_MAX_STORED'] = int(environ.get('PROFILE_MAX_STORED', 50)) # Number of request profiles kept
+app.config['PROFILE_INTERVAL_MS'] = float(environ.get('PROFILE_INTERVAL_MS', 5)) # Sampling interval of the profiler
+app.config['BCRYPT_LOG_ROUNDS'] = int(environ.get('BCRYPT_LOG_ROUNDS', 12)) # Work factor of new password hashes, older ones are rehashed at login
+app.config['PASSWORD_WORKERS'] = int(environ.get('PASSWORD_WORKERS', cpu_count() or 1)) # Processes hashing passwords, 0 to hash on the request thread
+app.config['PASSWORD_QUEUE_SIZE'] = int(environ.get('PASSWORD_QUEUE_SIZE', 4 * app.config['PASSWORD_WORKERS'])) # Password jobs waiting before requests get 503
+app.config['PASSWORD_TIMEOUT'] = float(environ.get('PASSWORD_TIMEOUT', 5)) # Seconds a request waits for its password job before getting 503
+app.config['RATE_LIMIT_ENABLED'] = environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true' # Limit the request rate of each client
+app.config['RATE_LIMIT_PATH'] = environ.get('RATE_LIMIT_PATH', default_rate_limit_path()) # SQLite file of the rate limits shared by all workers
+app.config['RATE_LIMIT_RATE'] = float(environ.get('RATE_LIMIT_RATE', 10)) # Requests per second allowed to each client
+app.config['RATE_LIMIT_BURST'] = float(environ.get('RATE_LIMIT_BURST', 50)) # Requests a client can make at once after idling
+app.config['RATE_LIMIT_BUCKETS'] = environ.get('RATE_LIMIT_BUCKETS', 'users.login=0.2/5,users.create_user=0.1/3') # Endpoints limited separately, as endpoint=rate/burst
+app.config['RATE_LIMIT_CONCURRENCY'] = environ.get('RATE_LIMIT_CONCURRENCY', 'users.login=16,users.create_user=8,posts.all_posts=32') # Requests handled at once by all workers, as endpoint=cap
+app.config['RATE_LIMIT_TRUSTED_PROXIES'] = int(environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0)) # Reverse proxies whose X-Forwarded-For gives the client address
+app.config['TOKEN_VERSION_MAX_STALENESS'] = float(environ.get('TOKEN_VERSION_MAX_STALENESS', 30)) # Seconds a worker may accept revoked tokens and former roles
+app.config['COMMENT_GROUP_COMMIT'] = environ.get('COMMENT_GROUP_COMMIT', 'false').lower() == 'true' # Commit the comments of concurrent requests together
+app.config['COMMENT_GROUP_COMMIT_WINDOW_MS'] = float(environ.get('COMMENT_GROUP_COMMIT_WINDOW_MS', 2)) # Milliseconds a group commit waits for more comments
+app.config['COMMENT_GROUP_COMMIT_MAX_BATCH'] = int(environ.get('COMMENT_GROUP_COMMIT_MAX_BATCH', 256)) # Most comments committed together
+app.config['COMMENT_GROUP_COMMIT_TIMEOUT'] = float(environ.get('COMMENT_GROUP_COMMIT_TIMEOUT', 5)) # Seconds a request waits for its group commit before getting 503
+
+# Use the configured JSON provider for jsonify and request parsing
+app.json = make_json_provider(app, app.config['JSON_PROVIDER'])
 
 # Initialise the SQLAlchemy instance
 db = SQLAlchemy(model_class=Base)
 db.init_app(app)
 
+# Initialise the per-request SQL instrumentation on the database engines
+sql_timing = SqlTiming(app, db)
+
+# Initialise the Prometheus metrics of requests, the database pool and bcrypt
+metrics = Metrics(app, db)
+
 # Initialise the Marshmallow instance for serialisation and deserialization
 ma = Marshmallow(app)
 
 # Initialise Bcrypt instance for password hashing and salting
 bcrypt = Bcrypt(app)
 
+# Initialise the pool of processes hashing and checking passwords for requests
+passwords = PasswordHasher(app)
+
 # Initialise JWT manager for managing JWT tokens and user authentication
 jwt = JWTManager(app)
+
+# Initialise the two-tier cache of rendered responses
+cache = ResponseCache(app)
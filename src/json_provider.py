@@ -0,0 +1,99 @@
+from flask.json.provider import DefaultJSONProvider, _default
+
+# orjson is an optional dependency, the stdlib provider is used when it is not installed
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# Names accepted by the JSON_PROVIDER setting
+JSON_PROVIDERS = ('auto', 'orjson', 'stdlib')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson.
+
+    orjson writes UTF-8 bytes directly, so responses skip the intermediate str. Raw `date`
+    and `datetime` values are passed to Flask's `default` callback rather than encoded
+    natively, so they are written as HTTP dates like the stdlib provider does, not as ISO
+    8601. Anything orjson cannot encode falls back to the stdlib provider, so behaviour only
+    differs in formatting: output is always compact unless indented, and non-ASCII characters
+    are not escaped.
+    """
+
+    def _options(self, sort_keys=None, indent=None):
+        """Return the orjson option flags for the given formatting settings."""
+        # Dates go through `default` to keep the stdlib provider's HTTP date format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys if sort_keys is None else sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _encode(self, obj, sort_keys=None, indent=None):
+        """Encode an object to UTF-8 JSON bytes, or return None if orjson cannot encode it."""
+        try:
+            return orjson.dumps(obj, default=_default, option=self._options(sort_keys, indent))
+        except orjson.JSONEncodeError:
+            return None
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialize data as JSON to a string.
+
+        The `sort_keys` and `indent` arguments are honoured and `separators` is ignored, since
+        orjson output is always compact. Any other argument uses the stdlib encoder.
+        """
+        indent = kwargs.pop('indent', None)
+        sort_keys = kwargs.pop('sort_keys', None)
+        kwargs.pop('separators', None)
+        if not kwargs:
+            data = self._encode(obj, sort_keys, indent)
+            if data is not None:
+                return data.decode('utf8')
+        if indent:
+            kwargs['indent'] = indent
+        if sort_keys is not None:
+            kwargs['sort_keys'] = sort_keys
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        """Deserialize data as JSON from a string or bytes."""
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serialize the given arguments as JSON and return a response, without an intermediate str."""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        data = self._encode(obj, indent=indent)
+        if data is None:
+            return super().response(obj)
+        return self._app.response_class(data + b'\n', mimetype=self.mimetype)
+
+
+def make_json_provider(app, name='auto'):
+    """
+    Create the JSON provider for an application.
+
+    Args:
+        app: The Flask application.
+        name (str): 'orjson', 'stdlib', or 'auto' to use orjson when it is installed.
+
+    Returns:
+        A Flask JSON provider instance.
+
+    Raises:
+        ValueError: If the name is unknown.
+        RuntimeError: If orjson is requested but not installed.
+    """
+    if name not in JSON_PROVIDERS:
+        raise ValueError(f'Unknown JSON provider {name!r}, expected one of: {", ".join(JSON_PROVIDERS)}')
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_PROVIDER is set to orjson but orjson is not installed')
+    if name != 'stdlib' and orjson is not None:
+        return OrjsonProvider(app)
+    return DefaultJSONProvider(app)
@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+from flask import current_app
+from marshmallow import fields
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, load_only, raiseload, selectinload
+
+# Loader plans keyed by schema class, field selection, model, extra columns and strictness,
+# least recently used first. Clients choose the field selection, so the number kept is capped.
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+MAX_PLANS = 512
+
+
+def nested_schema(field):
+    """Return the nested schema instance dumped by a field, or None for plain fields."""
+    if isinstance(field, fields.List):
+        field = field.inner
+    if isinstance(field, fields.Nested):
+        return field.schema
+    return None
+
+
+def _plan(schema, mapper, strict, required=()):
+    """
+    Build the loader options for one level of a schema and recurse into nested schemas.
+
+    Args:
+        schema: The Marshmallow schema instance being dumped at this level.
+        mapper: The SQLAlchemy mapper of the model the schema dumps.
+        strict (bool): Whether relationships not requested by the schema should raise when loaded.
+        required: Extra columns that must be loaded at this level, e.g. pagination keys or join keys.
+
+    Returns:
+        A list of loader options relative to the mapper.
+    """
+    options = []
+    # Columns to load: the primary key, any required columns and every column the schema dumps
+    columns = set(mapper.primary_key) | {column for column in required if column.table is mapper.local_table}
+    for name, field in schema.dump_fields.items():
+        key = field.attribute or name
+        if key in mapper.column_attrs:
+            columns.update(mapper.column_attrs[key].columns)
+            continue
+        nested = nested_schema(field)
+        relationship = mapper.relationships.get(key)
+        if nested is None or relationship is None:
+            continue
+        # Collections are loaded with a second SELECT ... IN so the parent rows are not multiplied,
+        # many-to-one relationships are joined into the parent query
+        loader = selectinload if relationship.uselist else joinedload
+        option = loader(getattr(mapper.class_, relationship.key))
+        # Keep the join keys on both sides of the relationship loaded
+        columns.update(relationship.local_columns)
+        children = _plan(nested, relationship.mapper, strict, relationship.remote_side)
+        if children:
+            option = option.options(*children)
+        options.append(option)
+
+    # Only narrow the SELECT list when the schema dumps a subset of the columns
+    if not set(mapper.columns) <= columns:
+        attributes = [mapper.get_property_by_column(column).class_attribute for column in mapper.columns if column in columns]
+        options.append(load_only(*attributes))
+    if strict:
+        # Any relationship the schema did not ask for raises instead of issuing a lazy load
+        options.append(raiseload('*'))
+    return options
+
+
+def strict_mode():
+    """Return whether lazy loads left during serialization should raise, from the EAGER_LOAD_STRICT setting."""
+    return bool(current_app.config.get('EAGER_LOAD_STRICT'))
+
+
+def eager_load(schema, model, strict=None, include=()):
+    """
+    Build the loading options needed to dump a model with a schema.
+
+    The schema's dump fields are inspected for nested schemas that map to relationships on
+    the model. Each one becomes a selectinload (collections) or joinedload (many-to-one)
+    option, recursively, so serializing a list of rows runs a fixed number of queries
+    instead of one lazy load per row per relationship. Columns the schema does not dump
+    are left out of the SELECT with load_only, and relationships it does not dump are not loaded.
+
+    Args:
+        schema: The Marshmallow schema instance that will dump the rows, including any only/exclude.
+        model: The SQLAlchemy model selected by the query.
+        strict (bool): Raise on lazy loads the plan does not cover. Defaults to the EAGER_LOAD_STRICT setting.
+        include: Extra columns of the model to load even if the schema does not dump them, e.g. pagination keys.
+
+    Returns:
+        A tuple of loader options to pass to `Select.options`.
+    """
+    if strict is None:
+        strict = strict_mode()
+    only = frozenset(schema.only) if schema.only is not None else None
+    key = (type(schema), only, frozenset(schema.exclude), model, tuple(attribute.key for attribute in include), strict)
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            return plan
+    columns = [attribute.expression for attribute in include]
+    plan = tuple(_plan(schema, inspect(model), strict, columns))
+    with _plans_lock:
+        _plans[key] = plan
+        if len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
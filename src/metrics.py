@@ -0,0 +1,362 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import current_app, g, request
+
+# Bucket upper bounds of each histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+CHECKOUT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+BCRYPT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+# Flush intervals after which a worker's gauges are no longer reported, and its row is folded
+# into the retired totals once the worker has exited
+STALE_FLUSHES = 3
+# The row holding the counters and histograms of exited workers
+RETIRED = 'retired'
+
+# Every metric exposed, as name: (type, help text, histogram buckets)
+METRICS = {
+    'minornote_http_requests_total': (
+        'counter', 'HTTP requests handled, by endpoint, method and status code.', None),
+    'minornote_http_request_duration_seconds': (
+        'histogram', 'Time taken to handle HTTP requests, by endpoint and method.', LATENCY_BUCKETS),
+    'minornote_http_response_size_bytes': (
+        'histogram', 'Size of HTTP response bodies, by endpoint and method. Streamed responses are not counted.', SIZE_BUCKETS),
+    'minornote_db_pool_checkout_seconds': (
+        'histogram', 'Time waited for a connection from the database pool.', CHECKOUT_BUCKETS),
+    'minornote_bcrypt_seconds': (
+        'histogram', 'Time spent hashing and checking passwords with bcrypt, by endpoint and operation.', BCRYPT_BUCKETS),
+    'minornote_password_queue_depth': (
+        'gauge', 'Password hashing jobs queued or running, summed over the recent snapshots of the workers.', None),
+    'minornote_password_rejections_total': (
+        'counter', 'Password hashing jobs rejected with 503, by reason: busy, timeout or broken.', None),
+    'minornote_comment_group_commit_rows': (
+        'histogram', 'Comments inserted by each group commit.', BATCH_BUCKETS),
+}
+
+
+class Registry:
+    """
+    Counters, gauges and histograms of one process.
+
+    Each sample is keyed by its metric name and sorted label pairs. A histogram sample holds
+    the count of each bucket (not cumulative, the last one being +Inf), then the sum and count
+    of the observed values.
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._samples[key] = value
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram."""
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                sample = self._samples[key] = [0] * (len(buckets) + 3)
+            sample[bisect_left(buckets, value)] += 1
+            sample[-2] += value
+            sample[-1] += 1
+
+    def snapshot(self):
+        """Return the samples as a JSON string."""
+        with self._lock:
+            return json.dumps([[name, labels, value] for (name, labels), value in self._samples.items()])
+
+
+class MetricsStore:
+    """
+    Snapshots of every worker process's registry, in a SQLite file shared on the host.
+
+    Each process replaces its own row, and readers sum the rows, so counters stay monotonic
+    across workers and survive the exit of the workers that recorded them. The rows of exited
+    workers are folded into a single retired row without their gauges, so the file does not
+    grow with every worker ever started.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS metrics (
+                process TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated REAL NOT NULL
+            )
+        """)
+
+    def _connection(self):
+        """Return the SQLite connection for the current thread, opening one after a fork."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def save(self, process, snapshot):
+        """Replace the snapshot of a process."""
+        self._connection().execute(
+            'INSERT OR REPLACE INTO metrics (process, snapshot, updated) VALUES (?, ?, ?)',
+            (process, snapshot, time.time()),
+        )
+
+    def snapshots(self):
+        """Return the snapshot of every process, decoded, with the time it was saved."""
+        return [(json.loads(snapshot), updated) for snapshot, updated in self._connection().execute('SELECT snapshot, updated FROM metrics')]
+
+    def fold(self, before):
+        """
+        Fold the rows of exited processes saved before a time into the retired row.
+
+        The counters and histograms of the folded rows are added to the retired row, their
+        gauges are dropped.
+
+        Args:
+            before (float): POSIX time before which a row may be folded, if its process is gone.
+        """
+        connection = self._connection()
+        # Writers wait, so two readers cannot fold the same rows twice
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT process, snapshot FROM metrics WHERE updated < ? AND process != ?', (before, RETIRED)).fetchall()
+            dead = [(process, json.loads(snapshot)) for process, snapshot in rows if not _alive(process)]
+            if dead:
+                retired = connection.execute('SELECT snapshot FROM metrics WHERE process = ?', (RETIRED,)).fetchone()
+                snapshots = [snapshot for _, snapshot in dead] + ([json.loads(retired[0])] if retired else [])
+                merged = _merge((snapshot, None) for snapshot in snapshots)
+                connection.execute(
+                    'INSERT OR REPLACE INTO metrics (process, snapshot, updated) VALUES (?, ?, ?)',
+                    (RETIRED, json.dumps([[name, labels, value] for (name, labels), value in merged.items()]), time.time()),
+                )
+                connection.executemany('DELETE FROM metrics WHERE process = ?', [(process,) for process, _ in dead])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+
+def _alive(process):
+    """Return whether the process of a row may still be running on this host."""
+    pid = int(process.split('-', 1)[0])
+    if os.name != 'posix':
+        # Signals cannot probe a process without terminating it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(snapshots, since=None):
+    """
+    Sum the samples of several snapshots, by metric name and labels.
+
+    Args:
+        snapshots: (snapshot, POSIX time saved) pairs.
+        since (float): Time from which the gauges of a snapshot are summed, None to drop every gauge.
+    """
+    merged = {}
+    for snapshot, updated in snapshots:
+        # A gauge is the current value of a worker, the last one saved long ago is not
+        stale = since is None or updated < since
+        for name, labels, value in snapshot:
+            if name not in METRICS or (stale and METRICS[name][0] == 'gauge'):
+                continue
+            key = (name, tuple(map(tuple, labels)))
+            if isinstance(value, list):
+                total = merged.setdefault(key, [0] * len(value))
+                for i, count in enumerate(value):
+                    total[i] += count
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+def render(snapshots, since):
+    """
+    Return the summed samples of several snapshots in the Prometheus text format.
+
+    Args:
+        snapshots: (snapshot, POSIX time saved) pairs.
+        since (float): Time from which the gauges of a snapshot are summed.
+    """
+    merged = _merge(snapshots, since)
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (sample_name, labels), value in sorted(merged.items()):
+            if sample_name != name:
+                continue
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels((*labels, ("le", bound)))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {value[-2]}')
+            lines.append(f'{name}_count{_labels(labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """
+    Prometheus metrics of the HTTP requests, database pool and password hashing.
+
+    Every worker process records into its own in-memory registry and saves a snapshot of it
+    to a SQLite file shared on the host at most every `METRICS_FLUSH_INTERVAL` seconds, so
+    recording a request never waits on other processes. `/metrics` sums the snapshots of
+    every worker, past and present, so scrapes see the totals of the whole server whichever
+    worker answers. Gauges are only summed over the snapshots saved within
+    `STALE_FLUSHES` flush intervals, and the rows of workers that exited since are folded
+    into the retired totals.
+
+    Configuration:
+        METRICS_ENABLED (bool): Whether metrics are recorded.
+        METRICS_PATH (str): The shared SQLite file of the snapshots.
+        METRICS_FLUSH_INTERVAL (float): Seconds between the snapshots of a process.
+        METRICS_TOKEN (str): Bearer token required to read /metrics, empty for none.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        """Hook the request lifecycle and the database pools of the application."""
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5.0)
+        self.token = app.config.get('METRICS_TOKEN', '')
+        self.store = MetricsStore(app.config.get('METRICS_PATH') or default_metrics_path())
+        self._pid = None
+        self._registry()
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        with app.app_context():
+            for engine in db.engines.values():
+                self._time_checkouts(engine.pool)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _registry(self):
+        """Return the registry of the current process, starting an empty one after a fork."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.registry = Registry()
+            # Unique per process lifetime, so a recycled PID does not overwrite a dead worker's totals
+            self.process = f'{self._pid}-{uuid.uuid4().hex[:8]}'
+            self.flushed = time.monotonic()
+        return self.registry
+
+    def _time_checkouts(self, pool):
+        """Record the time taken by each connection checkout from a pool."""
+        connect = pool.connect
+
+        def timed_connect():
+            start = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                self._registry().observe('minornote_db_pool_checkout_seconds', time.perf_counter() - start)
+        pool.connect = timed_connect
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+
+    def _finish(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        registry = self._registry()
+        endpoint = request.endpoint or 'unmatched'
+        registry.inc('minornote_http_requests_total', endpoint=endpoint, method=request.method, status=str(response.status_code))
+        registry.observe('minornote_http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        if not response.is_streamed:
+            registry.observe('minornote_http_response_size_bytes', response.calculate_content_length() or 0, endpoint=endpoint, method=request.method)
+        if time.monotonic() - self.flushed >= self.flush_interval:
+            self.flush()
+        return response
+
+    def flush(self):
+        """Save the snapshot of the current process to the shared file."""
+        self.store.save(self.process, self._registry().snapshot())
+        self.flushed = time.monotonic()
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter of the current process."""
+        if self.enabled:
+            self._registry().inc(name, amount, **labels)
+
+    def set(self, name, value, **labels):
+        """Set a gauge of the current process."""
+        if self.enabled:
+            self._registry().set(name, value, **labels)
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram of the current process."""
+        if self.enabled:
+            self._registry().observe(name, value, **labels)
+
+    def exposition(self):
+        """Return the metrics of every worker process in the Prometheus text format."""
+        self.flush()
+        since = time.time() - STALE_FLUSHES * self.flush_interval
+        self.store.fold(since)
+        return render(self.store.snapshots(), since)
+
+
+def default_metrics_path():
+    """Return the default location of the shared metrics file."""
+    return os.path.join(tempfile.gettempdir(), 'minornote-metrics.sqlite3')
+
+
+@contextmanager
+def bcrypt_timer(operation):
+    """
+    Time a bcrypt call made by the current endpoint.
+
+    Args:
+        operation (str): 'hash' or 'check'.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_app.extensions['metrics'].observe(
+            'minornote_bcrypt_seconds', time.perf_counter() - start, endpoint=request.endpoint, operation=operation)
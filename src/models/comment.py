@@ -1,6 +1,6 @@
 from datetime import date
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Text, ForeignKey
+from sqlalchemy import Text, ForeignKey, Index
 from marshmallow import fields, validate
 from init import db, ma
 
@@ -16,12 +16,18 @@ class Comment(db.Model):
         user_id (Mapped[int]): The foreign key referencing the user who created the comment.
         post_id (Mapped[int]): The foreign key referencing the post to which the comment is attached.
         date_created (Mapped[date]): The date when the comment was created.
+        version (Mapped[int]): Change counter, incremented whenever the comment is updated.
 
     Relationships:
         user (Mapped['User']): The user who created the comment.
         post (Mapped['Post']): The post to which the comment is attached.
     """
     __tablename__ = "comments"
+    # Composite indexes matching the (date_created, id) keyset used to paginate comment lists
+    __table_args__ = (
+        Index('ix_comments_post_id_date_created_id', 'post_id', 'date_created', 'id'),
+        Index('ix_comments_user_id_date_created_id', 'user_id', 'date_created', 'id'),
+    )
 
     # Define columns with data types and constraints
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -32,6 +38,8 @@ class Comment(db.Model):
     # cascade="all, delete-orphan" argument ensures that all associated comments are deleted if the post is deleted
     post_id: Mapped[int] = mapped_column(ForeignKey('posts.id', ondelete="CASCADE"))
     date_created: Mapped[date]
+    # Incremented on every update of the comment
+    version: Mapped[int] = mapped_column(default=1, server_default='1')
 
     # Define relationships to other tables
     user: Mapped['User'] = relationship('User', back_populates='comments')
@@ -53,7 +61,7 @@ class CommentSchema(ma.Schema):
         user_id (fields.Int): The foreign key referencing the user who created the comment.
         post_id (fields.Int): The foreign key referencing the post to which the comment is attached.
         date_created (fields.DateTime): The date when the comment was created.
-        user (fields.Nested('UserSchema', exclude=['password']): The user who created the comment.
+        user (fields.Nested('UserSchema', exclude=['password', 'post_count', 'comment_count']): The user who created the comment, without their counters.
 
     Methods:
         __init__(self, **kwargs): Initializes a new instance of the CommentSchema class.
@@ -66,7 +74,7 @@ class CommentSchema(ma.Schema):
     user_id = fields.Int(required=True)
     post_id = fields.Int(required=True)
     date_created = fields.DateTime(dump_only=True)
-    user = fields.Nested('UserSchema', exclude=['password'])
+    user = fields.Nested('UserSchema', exclude=['password', 'post_count', 'comment_count'])
     
     class Meta:
         fields = ("id", "content", "user_id", "post_id", "user", "date_created")
@@ -1,7 +1,7 @@
 from datetime import date
 from typing import Optional, List
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Text, ForeignKey
+from sqlalchemy import String, Text, ForeignKey, Index
 from marshmallow import fields, validate
 from init import db, ma
 
@@ -16,6 +16,8 @@ class Post(db.Model):
         content (Mapped[Optional[str]]): Content of the post.
         user_id (Mapped[int]): Foreign key referencing the user who created the post.
         date_created (Mapped[date]): Date when the post was created.
+        version (Mapped[int]): Change counter, incremented whenever the post or anything rendered with it changes.
+        comment_count (Mapped[int]): Number of comments on the post, maintained on every insert and delete.
 
     Relationships:
         user (Mapped['User']): The user who created the post.
@@ -23,6 +25,11 @@ class Post(db.Model):
         tags (Mapped[List['Tag']]): A list of tags associated with the post.
     """
     __tablename__ = 'posts'
+    # Composite indexes matching the (date_created, id) keyset used to paginate post lists
+    __table_args__ = (
+        Index('ix_posts_date_created_id', 'date_created', 'id'),
+        Index('ix_posts_user_id_date_created_id', 'user_id', 'date_created', 'id'),
+    )
 
     # # Define columns with data types and constraints
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -31,6 +38,10 @@ class Post(db.Model):
     # A user can create multiple posts, thanks to the user_id foreign key
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"))
     date_created: Mapped[date]
+    # Incremented on every change to the post, its comments, or the users and tags shown with it
+    version: Mapped[int] = mapped_column(default=1, server_default='1')
+    # Denormalized count of the post's comments, see counters.py
+    comment_count: Mapped[int] = mapped_column(default=0, server_default='0')
 
     # Define relationships to other tables
     user: Mapped['User'] = relationship('User', back_populates='posts')
@@ -59,9 +70,10 @@ class PostSchema(ma.Schema):
         content (fields.Str): A string representing the content of the post. It must be at least 1 character long.
         user_id (fields.Int): An integer representing the unique identifier of the user who created the post. It is required.
         date_created (fields.DateTime): A datetime object representing the date when the post was created. It is not included in the serialized output.
-        user (fields.Nested): A nested schema representing the user who created the post. It excludes the 'password' field.
+        comment_count (fields.Int): An integer representing the number of comments on the post.
+        user (fields.Nested): A nested schema representing the user who created the post. It excludes the 'password' field and the user's counters.
         comments (fields.Nested): A nested schema representing a list of comments for the post.
-        tags (fields.Nested): A nested schema representing a list of tags associated with the post.
+        tags (fields.Nested): A nested schema representing a list of tags associated with the post. It excludes the tags' counters.
 
     Class Meta:
         fields: A tuple specifying the fields to be included in the serialized output.
@@ -71,9 +83,11 @@ class PostSchema(ma.Schema):
     content = fields.Str(validate=validate.Length(min=1))
     user_id = fields.Int(required=True)
     date_created = fields.DateTime(dump_only=True)
-    user = fields.Nested('UserSchema', exclude=['password'])
+    comment_count = fields.Int(dump_only=True)
+    # Counters of other rows are left out, so a post does not change every time its author comments elsewhere
+    user = fields.Nested('UserSchema', exclude=['password', 'post_count', 'comment_count'])
     comments = fields.Nested('CommentSchema', many=True)
-    tags = fields.Nested('TagSchema', many=True)
+    tags = fields.Nested('TagSchema', many=True, exclude=['post_count'])
 
     class Meta:
-        fields = ('id', 'title', 'content', 'user_id', 'user', 'comments', 'tags', 'date_created')
+        fields = ('id', 'title', 'content', 'user_id', 'user', 'comments', 'tags', 'date_created', 'comment_count')
@@ -1,6 +1,7 @@
+from datetime import datetime, timezone
 from typing import List
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Table, ForeignKey, Integer, Column
+from sqlalchemy import String, Table, ForeignKey, Integer, Column, Index, DateTime, func
 from marshmallow import fields, validate
 from init import db, ma
 
@@ -12,6 +13,8 @@ class Tag(db.Model):
     Attributes:
         id (Mapped[int]): Primary key column representing the unique identifier for each tag.
         name (Mapped[str]): Column representing the name of the tag, with a maximum length of 50 characters and uniqueness constraint.
+        version (Mapped[int]): Change counter, incremented whenever the tag is updated.
+        post_count (Mapped[int]): Number of posts with the tag, maintained whenever posts are tagged, untagged or deleted.
         posts (Mapped[List['Post']]): Relationship attribute representing the many-to-many relationship between tags and posts.
 
     Methods:
@@ -22,6 +25,10 @@ class Tag(db.Model):
     # Define columns with data types and constraints
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), unique=True)
+    # Incremented on every update of the tag
+    version: Mapped[int] = mapped_column(default=1, server_default='1')
+    # Denormalized count of the tag's posts, see counters.py
+    post_count: Mapped[int] = mapped_column(default=0, server_default='0')
 
     # Define relationships to other tables
     # A post can have multiple tags, and a tag can be associated with multiple posts
@@ -39,15 +46,38 @@ class TagSchema(ma.Schema):
     Attributes:
         id (fields.Int): A field representing the unique identifier for each tag. This field is only included in the serialized output (dump_only=True).
         name (fields.Str): A field representing the name of the tag. This field is required and has a length constraint of 1 to 50 characters.
+        post_count (fields.Int): A field representing the number of posts with the tag. This field is only included in the serialized output (dump_only=True).
 
     Class Meta:
-        fields (tuple): A tuple specifying the fields to be included in the serialized output. In this case, it includes 'id' and 'name'.
+        fields (tuple): A tuple specifying the fields to be included in the serialized output. In this case, it includes 'id', 'name' and 'post_count'.
     """
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True, validate=validate.Length(min=1, max=50))
+    post_count = fields.Int(dump_only=True)
 
     class Meta:
-        fields = ('id', 'name')
+        fields = ('id', 'name', 'post_count')
+
+# Schema of the tag names set on a post with PUT /posts/<id>/tags
+class PostTagsSchema(ma.Schema):
+    """
+    Define the Marshmallow schema for setting the tags of a post.
+
+    Attributes:
+        tags (fields.List): The complete list of tag names of the post. Tags that do not exist are created.
+    """
+    tags = fields.List(fields.Str(validate=validate.Length(min=1, max=50)), required=True)
+
+# Schema of each post in a bulk PUT /posts/tags request
+class RetagSchema(PostTagsSchema):
+    """
+    Define the Marshmallow schema for setting the tags of one post in a bulk request.
+
+    Attributes:
+        id (fields.Int): The ID of the post.
+        tags (fields.List): The complete list of tag names of the post.
+    """
+    id = fields.Int(required=True)
 
 # Association table for many-to-many relationship between posts and tags
 #
@@ -58,11 +88,18 @@ class TagSchema(ma.Schema):
 #   - 'db.metadata' (SQLAlchemy MetaData object): The metadata object where the association table will be added.
 #   - 'post_id' (Column): A SQLAlchemy Column object representing the foreign key to the 'posts' table.
 #   - 'tag_id' (Column): A SQLAlchemy Column object representing the foreign key to the 'tags' table.
+#   - 'tagged_at' (Column): A SQLAlchemy Column object representing when the post was tagged, in UTC.
 #
 # This association table is used to establish the many-to-many relationship between posts and tags, allowing a post to have multiple tags and a tag to be associated with multiple posts.
 post_tags = Table(
     'post_tags',
     db.metadata,
     Column('post_id', Integer, ForeignKey('posts.id', ondelete="CASCADE"), primary_key=True),
-    Column('tag_id', Integer, ForeignKey('tags.id', ondelete="CASCADE"), primary_key=True)
+    Column('tag_id', Integer, ForeignKey('tags.id', ondelete="CASCADE"), primary_key=True),
+    # Recorded to the second, unlike posts.date_created, so trending tags can use hourly windows
+    Column('tagged_at', DateTime(), default=lambda: datetime.now(timezone.utc).replace(tzinfo=None), server_default=func.now(), nullable=False),
+    # The primary key leads with post_id, so lookups of the posts of a tag need their own index
+    Index('ix_post_tags_tag_id_post_id', 'tag_id', 'post_id'),
+    # Rebuilding the trending counters reads the most recent taggings
+    Index('ix_post_tags_tagged_at', 'tagged_at')
 )
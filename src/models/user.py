@@ -17,6 +17,9 @@ class User(db.Model):
         first_name (Mapped[str]): The first name of the user.
         last_name (Mapped[str]): The last name of the user.
         is_admin (Mapped[bool]): A boolean indicating whether the user is an admin.
+        post_count (Mapped[int]): Number of posts created by the user, maintained on every insert and delete.
+        comment_count (Mapped[int]): Number of comments made by the user, maintained on every insert and delete.
+        token_version (Mapped[int]): Version of the user's access tokens, bumped to revoke the tokens issued before.
 
     Relationships:
         posts (Mapped[List['Post']]): A list of all posts created by the user.
@@ -32,6 +35,11 @@ class User(db.Model):
     first_name: Mapped[str] = mapped_column(String(50))
     last_name: Mapped[str] = mapped_column(String(50))
     is_admin: Mapped[bool] = mapped_column(Boolean(), server_default='false')
+    # Denormalized counts of the user's posts and comments, see counters.py
+    post_count: Mapped[int] = mapped_column(default=0, server_default='0')
+    comment_count: Mapped[int] = mapped_column(default=0, server_default='0')
+    # Carried by access tokens and checked on every request, see token_versions.py
+    token_version: Mapped[int] = mapped_column(default=0, server_default='0')
 
     # Define relationships with other tables
     # A user can create multiple posts
@@ -61,6 +69,8 @@ class UserSchema(ma.Schema):
         first_name (fields.Str): The first name of the user. It is optional and its length must not exceed 50 characters.
         last_name (fields.Str): The last name of the user. It is optional and its length must not exceed 50 characters.
         is_admin (fields.Bool, dump_only=True): A boolean indicating whether the user is an admin. This field is only included when dumping the schema.
+        post_count (fields.Int, dump_only=True): The number of posts created by the user.
+        comment_count (fields.Int, dump_only=True): The number of comments made by the user.
 
     Class Meta:
         fields: A list of fields that should be included when dumping the schema.
@@ -72,6 +82,8 @@ class UserSchema(ma.Schema):
     first_name = fields.Str(validate=validate.Length(max=50))
     last_name = fields.Str(validate=validate.Length(max=50))
     is_admin = fields.Bool(dump_only=True)
+    post_count = fields.Int(dump_only=True)
+    comment_count = fields.Int(dump_only=True)
 
     class Meta:
-        fields = ('id', 'username', 'email', 'password', 'first_name', 'last_name', 'is_admin')
+        fields = ('id', 'username', 'email', 'password', 'first_name', 'last_name', 'is_admin', 'post_count', 'comment_count')
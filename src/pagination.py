@@ -0,0 +1,211 @@
+import base64
+import json
+from datetime import date, datetime
+from flask import request
+from marshmallow import ValidationError
+from sqlalchemy import tuple_
+from init import db
+
+# Default and maximum number of items returned in a single page
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Response headers carrying the opaque cursors for the neighbouring pages
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+PREV_CURSOR_HEADER = 'X-Prev-Cursor'
+
+
+def encode_cursor(values):
+    """
+    Encode the key values of a row into an opaque cursor string.
+
+    Args:
+        values: The values of the key columns for the row, in key order.
+
+    Returns:
+        A URL-safe base64 string that can be passed back as `after` or `before`.
+    """
+    raw = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(raw, separators=(',', ':')).encode('utf8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key_columns, param):
+    """
+    Decode an opaque cursor string back into typed key values.
+
+    Args:
+        cursor (str): The cursor received from the client.
+        key_columns: The columns the cursor was built from.
+        param (str): The query parameter name, used in validation messages.
+
+    Returns:
+        A list of values matching the types of the key columns.
+
+    Raises:
+        ValidationError: If the cursor is malformed or does not match the key columns.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(raw, list) or len(raw) != len(key_columns):
+            raise ValueError(cursor)
+        values = []
+        for column, value in zip(key_columns, raw):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is date:
+                value = date.fromisoformat(value)
+            elif python_type is int and not isinstance(value, int):
+                raise ValueError(value)
+            values.append(value)
+        return values
+    except (ValueError, TypeError):
+        raise ValidationError({param: ['Invalid cursor']})
+
+
+class KeysetPage:
+    """
+    Keyset (cursor) pagination over a fixed set of key columns.
+
+    Rows are returned newest first, ordered by the key columns descending. Instead of an
+    OFFSET, each page is selected with a row comparison against the key of the last row the
+    client saw, so the cost of a page stays the same however deep the client scrolls.
+
+    Attributes:
+        key_columns (tuple): The columns that uniquely order the rows, e.g. (Post.date_created, Post.id).
+        limit (int): The maximum number of rows in the page.
+        after (list): Key values of the row the page starts after, or None.
+        before (list): Key values of the row the page ends before, or None.
+        has_more (bool): Whether more rows exist beyond the page in the direction of travel.
+    """
+
+    def __init__(self, key_columns, limit=DEFAULT_LIMIT, after=None, before=None):
+        self.key_columns = tuple(key_columns)
+        self.limit = limit
+        self.after = after
+        self.before = before
+        self.has_more = False
+
+    @classmethod
+    def from_request(cls, key_columns, default_limit=DEFAULT_LIMIT, max_limit=MAX_LIMIT):
+        """
+        Build a page from the `limit`, `after` and `before` query parameters.
+
+        Args:
+            key_columns: The columns that uniquely order the rows.
+            default_limit (int): The limit used when none is given, or None for no limit.
+            max_limit (int): The largest limit accepted, or None for no upper bound.
+
+        Returns:
+            A KeysetPage instance.
+
+        Raises:
+            ValidationError: If the parameters are invalid.
+        """
+        args = request.args
+        limit = default_limit
+        if args.get('limit'):
+            try:
+                limit = int(args['limit'])
+            except ValueError:
+                raise ValidationError({'limit': ['Not a valid integer.']})
+            if limit < 1 or (max_limit is not None and limit > max_limit):
+                raise ValidationError({'limit': [f'Must be between 1 and {max_limit}.' if max_limit else 'Must be at least 1.']})
+        if args.get('after') and args.get('before'):
+            raise ValidationError({'before': ['Cannot be combined with after.']})
+
+        after = decode_cursor(args['after'], key_columns, 'after') if args.get('after') else None
+        before = decode_cursor(args['before'], key_columns, 'before') if args.get('before') else None
+        return cls(key_columns, limit=limit, after=after, before=before)
+
+    def apply(self, stmt):
+        """
+        Add the keyset filter, ordering and limit to a select statement.
+
+        One extra row is requested so that `trim` can tell whether another page exists.
+        A page without a limit selects every remaining row.
+
+        Args:
+            stmt: A SQLAlchemy select statement over the paginated model.
+
+        Returns:
+            The paginated select statement.
+        """
+        key = tuple_(*self.key_columns)
+        if self.before is not None:
+            # Walk backwards towards newer rows, results are reversed in trim()
+            stmt = stmt.where(key > tuple_(*self.before)).order_by(*[column.asc() for column in self.key_columns])
+        else:
+            if self.after is not None:
+                stmt = stmt.where(key < tuple_(*self.after))
+            stmt = stmt.order_by(*[column.desc() for column in self.key_columns])
+        if self.limit is None:
+            return stmt
+        return stmt.limit(self.limit + 1)
+
+    def trim(self, rows):
+        """
+        Drop the look-ahead row and restore newest-first order.
+
+        Args:
+            rows (list): The rows returned by the statement built with `apply`.
+
+        Returns:
+            The rows of the page, newest first.
+        """
+        rows = list(rows)
+        if self.limit is not None:
+            self.has_more = len(rows) > self.limit
+            rows = rows[:self.limit]
+        if self.before is not None:
+            rows.reverse()
+        return rows
+
+    def key_of(self, row):
+        """Return the key values of a row."""
+        return [getattr(row, column.key) for column in self.key_columns]
+
+    def headers(self, rows):
+        """
+        Build the cursor response headers for a trimmed page.
+
+        Args:
+            rows (list): The rows of the page, as returned by `trim`.
+
+        Returns:
+            A dict of response headers with the next and previous cursors, where they exist.
+        """
+        headers = {}
+        if not rows:
+            return headers
+        if self.before is None:
+            # Paging forwards: older rows remain if the look-ahead row was found
+            has_older, has_newer = self.has_more, self.after is not None
+        else:
+            # Paging backwards: the row the client came from is always older
+            has_older, has_newer = True, self.has_more
+        if has_older:
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(self.key_of(rows[-1]))
+        if has_newer:
+            headers[PREV_CURSOR_HEADER] = encode_cursor(self.key_of(rows[0]))
+        return headers
+
+
+def paginate(stmt, key_columns):
+    """
+    Run a select statement as a keyset-paginated query driven by the request arguments.
+
+    Args:
+        stmt: A SQLAlchemy select statement over a single model.
+        key_columns: The columns that uniquely order the rows, most significant first.
+
+    Returns:
+        A tuple of (rows, headers), where headers holds the cursors for the neighbouring pages.
+
+    Raises:
+        ValidationError: If the pagination parameters are invalid.
+    """
+    page = KeysetPage.from_request(key_columns)
+    rows = page.trim(db.session.scalars(page.apply(stmt)).all())
+    return rows, page.headers(rows)
@@ -0,0 +1,172 @@
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from flask import current_app
+
+
+# Workers are spawned, never forked from the web process: by the time a pool starts it runs
+# threads (profiler, metrics, group commit) whose locks a forked child could inherit held. A fork
+# server is not an option either, as its handle cannot be used from a forked web worker. Spawned
+# workers only need this module, but import the main module as __mp_main__ too, so scripts
+# starting the application guard their entry point with `if __name__ == '__main__'`.
+START_METHOD = 'spawn'
+
+
+class PasswordHashingUnavailable(Exception):
+    """
+    Raised when a password cannot be hashed or checked in time.
+
+    Attributes:
+        reason (str): 'busy' when the queue is full, 'timeout' when the job took too long, 'broken' when a worker died.
+    """
+
+    def __init__(self, reason):
+        super().__init__(f'Password hashing is unavailable ({reason})')
+        self.reason = reason
+
+
+def _prepare(password, long_passwords):
+    """Encode a password the way Flask-Bcrypt does."""
+    password = password.encode('utf-8')
+    if long_passwords:
+        password = hashlib.sha256(password).hexdigest().encode('utf-8')
+    return password
+
+
+def _hash(password, rounds, prefix, long_passwords):
+    """Hash a password, in a worker process."""
+    salt = bcrypt.gensalt(rounds=rounds, prefix=prefix.encode('utf-8'))
+    return bcrypt.hashpw(_prepare(password, long_passwords), salt).decode('utf-8')
+
+
+def _check(pw_hash, password, long_passwords):
+    """Check a password against its hash, in a worker process."""
+    pw_hash = pw_hash.encode('utf-8')
+    return hmac.compare_digest(bcrypt.hashpw(_prepare(password, long_passwords), pw_hash), pw_hash)
+
+
+def hash_rounds(pw_hash):
+    """Return the work factor a bcrypt hash was made with, e.g. 12 for `$2b$12$...`."""
+    return int(pw_hash.split('$')[2])
+
+
+class PasswordHasher:
+    """
+    Pool of worker processes hashing and checking passwords with bcrypt.
+
+    A bcrypt call costs hundreds of milliseconds of CPU. Running them in a pool sized to the
+    cores keeps a burst of logins from occupying every request thread of a worker, while a
+    bounded queue rejects the excess with `PasswordHashingUnavailable`, answered with 503,
+    instead of letting it pile up. Hashes are compatible with Flask-Bcrypt, and made with its
+    configuration.
+
+    The pool is started on first use in each process, so forked web workers get their own.
+
+    Configuration:
+        BCRYPT_LOG_ROUNDS (int): The work factor of new hashes.
+        PASSWORD_WORKERS (int): Number of worker processes, 0 to hash on the request thread.
+        PASSWORD_QUEUE_SIZE (int): Number of jobs waiting for a worker before new ones are rejected.
+        PASSWORD_TIMEOUT (float): Seconds a request waits for its job before giving up.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read the configuration and register the pool on the application."""
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.prefix = app.config.get('BCRYPT_HASH_PREFIX', '2b')
+        self.long_passwords = app.config.get('BCRYPT_HANDLE_LONG_PASSWORDS', False)
+        self.workers = app.config.get('PASSWORD_WORKERS', os.cpu_count() or 1)
+        self.queue_size = app.config.get('PASSWORD_QUEUE_SIZE', 4 * self.workers)
+        self.timeout = app.config.get('PASSWORD_TIMEOUT', 5.0)
+        self.metrics = app.extensions.get('metrics')
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        app.extensions['password_hasher'] = self
+
+    def _pool(self):
+        """Return the pool of the current process, starting one after a fork. Call holding the lock."""
+        if self._pid != os.getpid():
+            # The jobs of the parent process are not ours to count
+            self._executor, self._pid, self._pending = None, os.getpid(), 0
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(START_METHOD))
+        return self._executor
+
+    def _depth(self):
+        """Record the number of jobs queued or running. Call holding the lock."""
+        if self.metrics is not None:
+            self.metrics.set('minornote_password_queue_depth', self._pending)
+
+    def _unavailable(self, reason):
+        if self.metrics is not None:
+            self.metrics.inc('minornote_password_rejections_total', reason=reason)
+        return PasswordHashingUnavailable(reason)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._depth()
+
+    def _run(self, fn, *args):
+        """Run a job in the pool and wait for its result."""
+        if not self.workers:
+            return fn(*args)
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                raise self._unavailable('busy')
+            try:
+                future = self._pool().submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died, the next job starts a new pool
+                self._executor = None
+                raise self._unavailable('broken')
+            self._pending += 1
+            self._depth()
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Dropped if still queued, a running job finishes and is counted until then
+            future.cancel()
+            raise self._unavailable('timeout')
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            raise self._unavailable('broken')
+
+    def hash(self, password):
+        """
+        Hash a password with the configured work factor.
+
+        Raises:
+            PasswordHashingUnavailable: If the pool is saturated or the job times out.
+        """
+        return self._run(_hash, password, self.rounds, self.prefix, self.long_passwords)
+
+    def check(self, pw_hash, password):
+        """
+        Check a password against its hash, in constant time.
+
+        Raises:
+            PasswordHashingUnavailable: If the pool is saturated or the job times out.
+        """
+        return self._run(_check, pw_hash, password, self.long_passwords)
+
+    def needs_rehash(self, pw_hash):
+        """Return whether a hash was made with another work factor than the configured one."""
+        return hash_rounds(pw_hash) != self.rounds
+
+
+def password_hasher():
+    """Return the password hasher of the current application."""
+    return current_app.extensions['password_hasher']
@@ -0,0 +1,227 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from auth import is_admin
+
+# Header and query parameter requesting a profile of the request
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+
+
+class Sampler:
+    """
+    Sampling profiler of a single thread.
+
+    A background thread records the call stack of the profiled thread every `interval`
+    seconds, so the profiled code runs unmodified and the overhead is bounded by the
+    sampling rate rather than the number of function calls.
+
+    Attributes:
+        stacks (Counter): The number of samples of each stack, as tuples of frame names from the outermost call.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and return the duration profiled, in seconds."""
+        self._stopped.set()
+        self._thread.join()
+        return time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+
+def collapsed(stacks):
+    """Return stack counts in the collapsed format read by flamegraph.pl and speedscope."""
+    return ''.join(f'{";".join(frame.replace(";", ":") for frame in stack)} {count}\n' for stack, count in stacks)
+
+
+def speedscope(profile):
+    """Return a stored profile as a speedscope sampled profile."""
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, count in profile['stacks']:
+        sample = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame})
+            sample.append(index[frame])
+        samples.append(sample)
+        weights.append(count * profile['interval_ms'])
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': f'{profile["method"]} {profile["path"]}',
+        'exporter': 'minornote',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': f'{profile["method"]} {profile["path"]}',
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+class ProfileStore:
+    """
+    The most recent request profiles, in a SQLite file shared by every worker on the host.
+
+    Attributes:
+        path (str): The SQLite database file.
+        max_profiles (int): The number of profiles kept, oldest are deleted first.
+    """
+
+    def __init__(self, path, max_profiles):
+        self.path = path
+        self.max_profiles = max_profiles
+        self._local = threading.local()
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS profiles (
+                id TEXT PRIMARY KEY, created REAL NOT NULL, summary TEXT NOT NULL, profile TEXT NOT NULL
+            )
+        """)
+
+    def _connection(self):
+        """Return the SQLite connection for the current thread, opening one after a fork."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def add(self, profile):
+        """Store a profile, deleting the oldest ones past the cap."""
+        summary = {key: value for key, value in profile.items() if key != 'stacks'}
+        connection = self._connection()
+        connection.execute(
+            'INSERT INTO profiles (id, created, summary, profile) VALUES (?, ?, ?, ?)',
+            (profile['id'], profile['created'], json.dumps(summary), json.dumps(profile)),
+        )
+        connection.execute(
+            'DELETE FROM profiles WHERE id NOT IN (SELECT id FROM profiles ORDER BY created DESC LIMIT ?)',
+            (self.max_profiles,),
+        )
+
+    def list(self):
+        """Return the summary of every stored profile, most recent first."""
+        rows = self._connection().execute('SELECT summary FROM profiles ORDER BY created DESC')
+        return [json.loads(summary) for (summary,) in rows]
+
+    def get(self, profile_id):
+        """Return a stored profile, or None."""
+        row = self._connection().execute('SELECT profile FROM profiles WHERE id = ?', (profile_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class Profiler:
+    """
+    On-demand sampling profiler for single requests made by admins.
+
+    A request with an `X-Profile: 1` header or a `profile=1` query parameter, authenticated
+    as an admin, is sampled from start to finish. The profile is stored and its ID returned
+    in the `X-Profile-Id` response header. Other requests pay for a header and argument
+    lookup only. Streamed response bodies are generated after the profile ends.
+
+    Configuration:
+        PROFILE_ENABLED (bool): Whether requests can be profiled.
+        PROFILE_PATH (str): The SQLite file of the stored profiles.
+        PROFILE_MAX_STORED (int): The number of profiles kept.
+        PROFILE_INTERVAL_MS (float): The sampling interval in milliseconds.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the store and hook the request lifecycle."""
+        self.enabled = app.config.get('PROFILE_ENABLED', True)
+        self.interval_ms = app.config.get('PROFILE_INTERVAL_MS', 5.0)
+        self.store = ProfileStore(app.config.get('PROFILE_PATH') or default_profile_path(), app.config.get('PROFILE_MAX_STORED', 50))
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    @staticmethod
+    def _requested():
+        """Return whether the request asks to be profiled by an admin."""
+        if request.headers.get(PROFILE_HEADER, '') in ('', '0') and request.args.get(PROFILE_PARAM, '') in ('', '0'):
+            return False
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            # Invalid tokens are rejected by the view itself, the request is just not profiled
+            return False
+        user_id = get_jwt_identity()
+        return user_id is not None and is_admin(user_id)
+
+    def _start(self):
+        if self._requested():
+            g.profile_sampler = Sampler(threading.get_ident(), self.interval_ms / 1000)
+            g.profile_sampler.start()
+
+    def _finish(self, response):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return response
+        duration = sampler.stop()
+        profile = {
+            'id': uuid.uuid4().hex,
+            'created': time.time(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'interval_ms': self.interval_ms,
+            'samples': sum(sampler.stacks.values()),
+            'stacks': [[list(stack), count] for stack, count in sampler.stacks.most_common()],
+        }
+        self.store.add(profile)
+        response.headers['X-Profile-Id'] = profile['id']
+        return response
+
+    def _teardown(self, error):
+        # Requests ending in an unhandled error skip after_request, stop their sampler anyway
+        sampler = g.pop('profile_sampler', None)
+        if sampler is not None:
+            sampler.stop()
+
+
+def default_profile_path():
+    """Return the default location of the shared profile file."""
+    return os.path.join(tempfile.gettempdir(), 'minornote-profiles.sqlite3')
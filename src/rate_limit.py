@@ -0,0 +1,266 @@
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# Seconds after which the concurrency slot of a request that never released it is reclaimed
+SLOT_TTL = 60
+
+
+def parse_buckets(spec):
+    """
+    Parse per-endpoint token buckets, e.g. 'users.login=0.5/5,posts.all_posts=20/40'.
+
+    Returns:
+        A dict of endpoint: (tokens added per second, bucket capacity).
+
+    Raises:
+        ValueError: If an item is malformed, or its rate or burst is not positive.
+    """
+    buckets = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            endpoint, limit = item.split('=')
+            rate, burst = limit.split('/')
+            rate, burst = float(rate), float(burst)
+        except ValueError:
+            rate = burst = 0
+        if not (rate > 0 and burst > 0):
+            raise ValueError(f'Invalid rate limit bucket {item!r}, expected endpoint=rate/burst with positive numbers')
+        buckets[endpoint.strip()] = (rate, burst)
+    return buckets
+
+
+def parse_caps(spec):
+    """
+    Parse per-endpoint concurrency caps, e.g. 'users.login=8,posts.all_posts=32'.
+
+    Returns:
+        A dict of endpoint: maximum number of requests handled at once.
+
+    Raises:
+        ValueError: If an item is malformed, or its cap is not positive.
+    """
+    caps = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            endpoint, cap = item.split('=')
+            cap = int(cap)
+        except ValueError:
+            cap = 0
+        if cap < 1:
+            raise ValueError(f'Invalid concurrency cap {item!r}, expected endpoint=cap with a positive integer')
+        caps[endpoint.strip()] = cap
+    return caps
+
+
+class RateLimitStore:
+    """
+    Token buckets and concurrency slots, in a SQLite file shared by every worker on the host.
+
+    Each bucket is refilled lazily from the time of its last update, so a request costs a
+    single upsert. Slots are leases that expire after SLOT_TTL seconds, so the slots of a
+    worker killed mid-request are reclaimed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER NOT NULL
+            )
+        """)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS slots (
+                id TEXT PRIMARY KEY, endpoint TEXT NOT NULL, expires REAL NOT NULL
+            )
+        """)
+        connection.execute('CREATE INDEX IF NOT EXISTS slots_endpoint ON slots (endpoint, expires)')
+
+    def _connection(self):
+        """Return the SQLite connection for the current thread, opening one after a fork."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, key, rate, burst):
+        """
+        Take a token from a bucket, refilling it first.
+
+        Returns:
+            An (allowed, tokens) tuple: whether a token was taken, and the tokens left.
+        """
+        # A bucket starts full, and only loses a token when it holds a whole one
+        return self._connection().execute("""
+            INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, 1)
+            ON CONFLICT (key) DO UPDATE SET
+                allowed = min(:burst, tokens + (:now - updated) * :rate) >= 1,
+                tokens = min(:burst, tokens + (:now - updated) * :rate) - (min(:burst, tokens + (:now - updated) * :rate) >= 1),
+                updated = :now
+            RETURNING allowed, tokens
+        """, {'key': key, 'burst': burst, 'now': time.time(), 'rate': rate}).fetchone()
+
+    def acquire(self, endpoint, cap):
+        """
+        Take a concurrency slot of an endpoint.
+
+        Returns:
+            The ID of the slot, or None if `cap` requests already hold one.
+        """
+        connection = self._connection()
+        now = time.time()
+        slot_id = uuid.uuid4().hex
+        # Counting and inserting under the write lock, so workers cannot both take the last slot
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM slots WHERE endpoint = ? AND expires < ?', (endpoint, now))
+            (held,) = connection.execute('SELECT count(*) FROM slots WHERE endpoint = ?', (endpoint,)).fetchone()
+            if held >= cap:
+                return None
+            connection.execute('INSERT INTO slots (id, endpoint, expires) VALUES (?, ?, ?)', (slot_id, endpoint, now + SLOT_TTL))
+            return slot_id
+        finally:
+            connection.execute('COMMIT')
+
+    def release(self, slot_id):
+        """Give back a concurrency slot."""
+        self._connection().execute('DELETE FROM slots WHERE id = ?', (slot_id,))
+
+    def prune(self, before):
+        """Delete the buckets untouched since `before`, which are full again."""
+        self._connection().execute('DELETE FROM buckets WHERE updated < ?', (before,))
+
+
+class RateLimiter:
+    """
+    Per-client rate limiting and per-endpoint admission control, shared by every worker.
+
+    Each client gets a token bucket, keyed by the identity of a valid access token or by the
+    remote address otherwise. Endpoints listed in `RATE_LIMIT_BUCKETS`, such as login, have
+    buckets of their own, other requests share the client's default bucket. A request finding
+    its bucket empty is answered with 429 and a `Retry-After` header giving when a token is
+    back.
+
+    Endpoints listed in `RATE_LIMIT_CONCURRENCY` also admit at most that many requests at once
+    across all workers, and answer the excess with 503 and `Retry-After`, so a burst on one
+    endpoint cannot take every worker.
+
+    A request is first given a concurrency slot, then a token, so a request turned away by
+    the cap does not spend one.
+
+    State lives in a SQLite file on the host, so limits hold across pre-forked workers. If the
+    file cannot be written in time, requests are let through.
+
+    Behind reverse proxies, every anonymous client would share the address of the last proxy.
+    Setting `RATE_LIMIT_TRUSTED_PROXIES` to the number of proxies in front of the application
+    makes the address taken from their `X-Forwarded-For` headers instead, with Werkzeug's
+    `ProxyFix`. Only set it when clients cannot reach the application directly, as they could
+    otherwise pick their own address.
+
+    Configuration:
+        RATE_LIMIT_ENABLED (bool): Whether requests are limited.
+        RATE_LIMIT_PATH (str): The shared SQLite file of the buckets and slots.
+        RATE_LIMIT_RATE (float): Requests per second allowed to each client by the default bucket.
+        RATE_LIMIT_BURST (float): Capacity of the default bucket.
+        RATE_LIMIT_BUCKETS (str): Endpoints with buckets of their own, as 'endpoint=rate/burst,...'.
+        RATE_LIMIT_CONCURRENCY (str): Concurrency caps of endpoints, as 'endpoint=cap,...'.
+        RATE_LIMIT_TRUSTED_PROXIES (int): Number of reverse proxies whose X-Forwarded-For header is trusted.
+    """
+
+    # Seconds between two deletions of the idle buckets by a process
+    prune_interval = 60
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the limits and hook the request lifecycle."""
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        self.default = (app.config.get('RATE_LIMIT_RATE', 10.0), app.config.get('RATE_LIMIT_BURST', 50.0))
+        if not (self.default[0] > 0 and self.default[1] > 0):
+            raise ValueError(f'RATE_LIMIT_RATE and RATE_LIMIT_BURST must be positive, got {self.default[0]} and {self.default[1]}')
+        self.buckets = parse_buckets(app.config.get('RATE_LIMIT_BUCKETS', ''))
+        self.caps = parse_caps(app.config.get('RATE_LIMIT_CONCURRENCY', ''))
+        # A bucket untouched for this long is full again, and can be deleted
+        self.idle = max(burst / rate for rate, burst in (self.default, *self.buckets.values()))
+        self.store = RateLimitStore(app.config.get('RATE_LIMIT_PATH') or default_rate_limit_path())
+        self.pruned = time.monotonic()
+        app.extensions['rate_limiter'] = self
+        proxies = app.config.get('RATE_LIMIT_TRUSTED_PROXIES', 0)
+        if proxies < 0:
+            raise ValueError(f'RATE_LIMIT_TRUSTED_PROXIES must not be negative, got {proxies}')
+        if not self.enabled:
+            return
+        if proxies:
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    @staticmethod
+    def _client():
+        """Return the key of the client: its user ID if it sent a valid token, its address otherwise."""
+        try:
+            verify_jwt_in_request(optional=True)
+            user_id = get_jwt_identity()
+        except Exception:
+            # Invalid tokens are rejected by the view itself, the client is limited by address
+            user_id = None
+        return f'user:{user_id}' if user_id is not None else f'ip:{request.remote_addr}'
+
+    def _admit(self):
+        endpoint = request.endpoint
+        if endpoint is None:
+            return None
+        rate, burst = self.buckets.get(endpoint, self.default)
+        key = self._client() + (f':{endpoint}' if endpoint in self.buckets else '')
+        try:
+            cap = self.caps.get(endpoint)
+            if cap is not None:
+                slot = self.store.acquire(endpoint, cap)
+                if slot is None:
+                    response = jsonify(error='The server is busy, try again shortly')
+                    response.status_code = 503
+                    response.headers['Retry-After'] = '1'
+                    return response
+                # Released on teardown, also when the bucket turns the request away
+                g.rate_limit_slot = slot
+            allowed, tokens = self.store.take(key, rate, burst)
+            if not allowed:
+                response = jsonify(error='Too many requests, slow down')
+                response.status_code = 429
+                response.headers['Retry-After'] = str(math.ceil((1 - tokens) / rate))
+                return response
+            if time.monotonic() - self.pruned >= self.prune_interval:
+                self.pruned = time.monotonic()
+                self.store.prune(time.time() - self.idle)
+        except sqlite3.OperationalError as err:
+            # Failing open: a locked or unavailable store must not take the API down
+            current_app.logger.warning('rate limit store unavailable: %s', err)
+        return None
+
+    def _release(self, error):
+        slot = g.pop('rate_limit_slot', None)
+        if slot is not None:
+            try:
+                self.store.release(slot)
+            except sqlite3.OperationalError:
+                # The slot expires after SLOT_TTL seconds
+                pass
+
+
+def default_rate_limit_path():
+    """Return the default location of the shared rate limit file."""
+    return os.path.join(tempfile.gettempdir(), 'minornote-ratelimit.sqlite3')
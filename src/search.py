@@ -0,0 +1,207 @@
+import re
+from marshmallow import ValidationError
+from sqlalchemy import DDL, Float, Integer, column, event, func, literal_column, table, text, type_coerce
+from models.post import Post
+from models.comment import Comment
+from pagination import KeysetPage
+from init import db
+
+# The indexed models and their searchable text columns
+SEARCHABLE = {
+    Post: ('title', 'content'),
+    Comment: ('content',),
+}
+
+# Text search configuration used on PostgreSQL
+POSTGRES_CONFIG = 'english'
+
+# Words of a search query, anything else is ignored
+WORD = re.compile(r'\w+')
+
+
+def _fts_name(model):
+    """Return the name of the SQLite FTS5 table indexing a model."""
+    return f'{model.__tablename__}_fts'
+
+
+def _vector_sql(model):
+    """
+    Return the SQL of the PostgreSQL tsvector of a model's searchable text.
+
+    The GIN index and the search queries must use exactly this expression for the planner
+    to match them.
+    """
+    document = " || ' ' || ".join(f"coalesce({name}, '')" for name in SEARCHABLE[model])
+    return f"to_tsvector('{POSTGRES_CONFIG}', {document})"
+
+
+def _create_sql(model):
+    """Return the SQL creating a model's search index, keyed by dialect."""
+    name = model.__tablename__
+    columns = ', '.join(SEARCHABLE[model])
+    return {
+        # A GIN index over the tsvector expression, kept up to date by PostgreSQL itself
+        'postgresql': f'CREATE INDEX IF NOT EXISTS ix_{name}_search ON {name} USING gin (({_vector_sql(model)}))',
+        # An FTS5 table keyed by the row ID, kept up to date by add_to_index() and remove_from_index()
+        'sqlite': f"CREATE VIRTUAL TABLE IF NOT EXISTS {_fts_name(model)} USING fts5({columns}, tokenize='porter unicode61')",
+    }
+
+
+# Create the search indexes with their tables, and drop the FTS5 tables with them
+for _model in SEARCHABLE:
+    for _dialect_name, _sql in _create_sql(_model).items():
+        event.listen(_model.__table__, 'after_create', DDL(_sql).execute_if(dialect=_dialect_name))
+    event.listen(_model.__table__, 'before_drop', DDL(f'DROP TABLE IF EXISTS {_fts_name(_model)}').execute_if(dialect='sqlite'))
+
+
+def _dialect():
+    """Return the name of the database dialect in use."""
+    return db.session.get_bind().dialect.name
+
+
+def _fts_table(model):
+    """Return a lightweight table construct for a model's FTS5 table."""
+    return table(_fts_name(model), column('rowid', Integer), *[column(name) for name in SEARCHABLE[model]])
+
+
+def add_to_index(obj):
+    """
+    Add a post or comment to the search index, replacing any previous entry.
+
+    Call after the row is created or updated, within the same transaction. The session is
+    flushed so new rows have an ID. On PostgreSQL the expression index is maintained by the
+    database and nothing needs to be done.
+
+    Args:
+        obj: A Post or Comment instance.
+    """
+    if _dialect() != 'sqlite':
+        return
+    db.session.flush()
+    model = type(obj)
+    fts = _fts_table(model)
+    db.session.execute(fts.delete().where(fts.c.rowid == obj.id))
+    db.session.execute(fts.insert().values(rowid=obj.id, **{name: getattr(obj, name) for name in SEARCHABLE[model]}))
+
+
+def add_rows_to_index(model, rows):
+    """
+    Add many new posts or comments to the search index with one batched INSERT.
+
+    Call after the rows are inserted, within the same transaction.
+
+    Args:
+        model: Post or Comment.
+        rows: Dicts holding the `id` and searchable columns of each new row.
+    """
+    if _dialect() != 'sqlite' or not rows:
+        return
+    fts = _fts_table(model)
+    db.session.execute(fts.insert(), [{'rowid': row['id'], **{name: row.get(name) for name in SEARCHABLE[model]}} for row in rows])
+
+
+def remove_from_index(model, *criteria):
+    """
+    Remove rows from the search index. Call before deleting them.
+
+    Args:
+        model: Post or Comment.
+        *criteria: WHERE criteria on the model selecting the rows being deleted.
+    """
+    if _dialect() != 'sqlite':
+        return
+    fts = _fts_table(model)
+    db.session.execute(fts.delete().where(fts.c.rowid.in_(db.select(model.id).where(*criteria))))
+
+
+def rebuild_index():
+    """
+    Rebuild every search index in bulk, creating any that are missing.
+
+    On SQLite the FTS5 tables are refilled from the indexed tables with one statement each.
+    On PostgreSQL the GIN indexes are rebuilt with REINDEX.
+
+    Returns:
+        The number of indexes rebuilt.
+    """
+    dialect = _dialect()
+    for model in SEARCHABLE:
+        name = model.__tablename__
+        sql = _create_sql(model).get(dialect)
+        if sql:
+            db.session.execute(text(sql))
+        if dialect == 'sqlite':
+            columns = ', '.join(SEARCHABLE[model])
+            db.session.execute(text(f'DELETE FROM {_fts_name(model)}'))
+            db.session.execute(text(f'INSERT INTO {_fts_name(model)} (rowid, {columns}) SELECT id, {columns} FROM {name}'))
+        elif dialect == 'postgresql':
+            db.session.execute(text(f'REINDEX INDEX ix_{name}_search'))
+    return len(SEARCHABLE)
+
+
+def _terms(query):
+    """
+    Split a search query into its words.
+
+    Raises:
+        ValidationError: If the query contains no words.
+    """
+    terms = WORD.findall(query or '')
+    if not terms:
+        raise ValidationError({'q': ['Must contain at least one word.']})
+    return terms
+
+
+def _hits(model, terms):
+    """
+    Build a subquery of the IDs of the rows matching every term, with their relevance score.
+
+    Higher scores are more relevant.
+
+    Returns:
+        A subquery with `id` and `score` columns.
+    """
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        fts = _fts_name(model)
+        # Quote each term so FTS5 query syntax in the input is treated as text
+        match = ' '.join('"' + term + '"' for term in terms)
+        # bm25() is lower for better matches
+        score = type_coerce(-func.bm25(literal_column(fts)), Float)
+        stmt = db.select(_fts_table(model).c.rowid.label('id'), score.label('score')).where(literal_column(fts).op('MATCH')(match))
+    elif dialect == 'postgresql':
+        vector = literal_column(_vector_sql(model))
+        query = func.plainto_tsquery(literal_column(f"'{POSTGRES_CONFIG}'"), ' '.join(terms))
+        score = type_coerce(func.ts_rank(vector, query), Float)
+        stmt = db.select(model.id.label('id'), score.label('score')).where(vector.op('@@')(query))
+    else:
+        raise NotImplementedError(f'Full-text search is not supported on {dialect}')
+    return stmt.subquery()
+
+
+def search(model, query, options=()):
+    """
+    Search posts or comments, most relevant first, one page at a time.
+
+    Matching rows contain every word of the query, in any form the stemmer reduces to the
+    same root. Pages are selected by keyset on (score, id), with the usual `limit`, `after`
+    and `before` query parameters.
+
+    Args:
+        model: Post or Comment.
+        query (str): The search query.
+        options: Loader options applied when loading the matching rows.
+
+    Returns:
+        A tuple of (rows, headers), where headers holds the cursors for the neighbouring pages.
+
+    Raises:
+        ValidationError: If the query or the pagination parameters are invalid.
+    """
+    hits = _hits(model, _terms(query))
+    page = KeysetPage.from_request((hits.c.score, hits.c.id))
+    ranked = page.trim(db.session.execute(page.apply(db.select(hits.c.id, hits.c.score))).all())
+    # Load the page of rows in one query and restore the ranking
+    rows = db.session.scalars(db.select(model).where(model.id.in_([hit.id for hit in ranked])).options(*options))
+    by_id = {row.id: row for row in rows}
+    return [by_id[hit.id] for hit in ranked if hit.id in by_id], page.headers(ranked)
@@ -0,0 +1,199 @@
+import csv
+import io
+import random
+from datetime import date, datetime, timedelta
+from itertools import accumulate, islice
+from sqlalchemy import text
+from models.user import User
+from models.post import Post
+from models.comment import Comment
+from models.tag import Tag, post_tags
+from init import db, bcrypt
+
+# Number of rows inserted per statement, or per COPY on PostgreSQL
+DEFAULT_CHUNK_SIZE = 10000
+
+# Number of days back from today the generated posts are spread over
+SPAN_DAYS = 365
+
+# Words the titles, contents and tag names are made of, most common first
+WORDS = (
+    'the of and to in is it that for on with as was at by this be from or are an not have but '
+    'post python flask data api code user test web app server query index cache database model '
+    'request response error performance latency memory thread worker design release feature bug '
+    'review deploy build version schema table column page search tag comment title content '
+    'library framework network security token session cookie header json route view template '
+    'async queue stream batch chunk file disk cpu load benchmark profile metric trace log alert '
+    'migration backup replica shard lock transaction commit rollback insert update delete select'
+).split()
+# Zipfian word frequencies, the nth most common word being used 1/n as often as the first
+WORD_WEIGHTS = list(accumulate(1 / rank for rank in range(1, len(WORDS) + 1)))
+
+
+def zipf(rng, n):
+    """
+    Draw a rank from 0 to n - 1 with a Zipfian (s = 1) distribution, rank 0 being the most likely.
+
+    The rank is drawn by inverting the continuous approximation of the distribution, so no
+    table of n weights is built, whatever n.
+    """
+    return min(int((n + 1) ** rng.random()) - 1, n - 1)
+
+
+def _words(rng, low, high):
+    """Return between low and high words drawn by frequency."""
+    return ' '.join(rng.choices(WORDS, cum_weights=WORD_WEIGHTS, k=rng.randint(low, high)))
+
+
+def _post_date(post_id, posts, today):
+    """Return the creation date of a post, the posts being spread evenly over SPAN_DAYS in ID order."""
+    return today - timedelta(days=SPAN_DAYS - 1 - (post_id - 1) * SPAN_DAYS // posts)
+
+
+def _tag_name(tag_id):
+    """Return a unique tag name made of a word, and a number once the words run out."""
+    word = WORDS[(tag_id - 1) % len(WORDS)]
+    rounds = (tag_id - 1) // len(WORDS)
+    return f'{word}{rounds}' if rounds else word
+
+
+def _chunks(rows, size):
+    """Split an iterable of rows into lists of at most `size` rows."""
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _copy(table, chunk):
+    """Load rows into a table with COPY ... FROM STDIN on PostgreSQL."""
+    columns = list(chunk[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chunk:
+        writer.writerow(row[column] for column in columns)
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def _load(table, rows, total, chunk_size, progress):
+    """
+    Insert rows into a table in chunks, committing and reporting progress after each one.
+
+    PostgreSQL connections through psycopg2 load with COPY, other databases with one
+    multi-row INSERT per chunk.
+    """
+    copy = db.session.get_bind().dialect.driver == 'psycopg2'
+    done = 0
+    for chunk in _chunks(rows, chunk_size):
+        if copy:
+            _copy(table, chunk)
+        else:
+            db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        done += len(chunk)
+        progress(f'{table.name}: {done}/{total}' if total is not None else f'{table.name}: {done}')
+
+
+def _users(count, password):
+    """Generate the users, the first being an admin. All share one password hash."""
+    for user_id in range(1, count + 1):
+        yield {
+            'id': user_id,
+            'username': f'user{user_id}',
+            'email': f'user{user_id}@example.com',
+            'password': password,
+            'first_name': f'First{user_id}',
+            'last_name': f'Last{user_id}',
+            'is_admin': user_id == 1,
+        }
+
+
+def _posts(rng, count, users, today):
+    """Generate posts in date order, the most active users writing most of them."""
+    for post_id in range(1, count + 1):
+        yield {
+            'id': post_id,
+            'title': f'{_words(rng, 3, 8)} {post_id}',
+            'content': _words(rng, 20, 120),
+            'user_id': zipf(rng, users) + 1,
+            'date_created': _post_date(post_id, count, today),
+        }
+
+
+def _comments(rng, count, posts, users, today):
+    """Generate comments, recent posts and the most active users getting most of them."""
+    for comment_id in range(1, count + 1):
+        post_id = posts - zipf(rng, posts)
+        posted = _post_date(post_id, posts, today)
+        yield {
+            'id': comment_id,
+            'content': _words(rng, 5, 40),
+            'user_id': zipf(rng, users) + 1,
+            'post_id': post_id,
+            'date_created': posted + timedelta(days=rng.randint(0, (today - posted).days)),
+        }
+
+
+def _post_tags(rng, posts, tags, today):
+    """Generate one to five distinct tags per post, popular tags being used far more often."""
+    for post_id in range(1, posts + 1):
+        tagged_at = datetime.combine(_post_date(post_id, posts, today), datetime.min.time())
+        for tag_id in sorted({zipf(rng, tags) + 1 for _ in range(rng.randint(1, 5))}):
+            yield {
+                'post_id': post_id,
+                'tag_id': tag_id,
+                'tagged_at': tagged_at + timedelta(seconds=rng.randint(0, 86399)),
+            }
+
+
+def _reset_sequences(*models):
+    """Move the ID sequences of PostgreSQL tables past the IDs inserted explicitly."""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for model in models:
+        name = model.__tablename__
+        db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE(MAX(id), 1)) FROM {name}"))
+
+
+def seed(users, posts_per_user, comments_per_post, tags, password, seed=0, chunk_size=DEFAULT_CHUNK_SIZE, progress=print):
+    """
+    Fill empty tables with a synthetic dataset of the given size.
+
+    Rows are generated lazily and loaded in chunks, with IDs assigned up front so nothing is
+    read back. Authors, commenters and tags follow Zipfian distributions and recent posts get
+    the most comments. The same seed always generates the same rows, apart from dates being
+    relative to today. The password is hashed once for all users.
+
+    Args:
+        users (int): The number of users.
+        posts_per_user (int): The average number of posts per user.
+        comments_per_post (int): The average number of comments per post.
+        tags (int): The number of distinct tags.
+        password (str): The password of every user.
+        seed (int): The seed of the random generator.
+        chunk_size (int): The number of rows loaded at a time.
+        progress (callable): Called with a progress message after each chunk.
+
+    Returns:
+        A dict of the number of rows inserted, by table name.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    posts = users * posts_per_user
+    comments = posts * comments_per_post
+    password_hash = bcrypt.generate_password_hash(password).decode('utf8')
+
+    counts = {'users': users, 'tags': tags, 'posts': posts if users else 0, 'comments': comments if users else 0}
+    _load(User.__table__, _users(users, password_hash), users, chunk_size, progress)
+    _load(Tag.__table__, ({'id': tag_id, 'name': _tag_name(tag_id)} for tag_id in range(1, tags + 1)), tags, chunk_size, progress)
+    if counts['posts']:
+        _load(Post.__table__, _posts(rng, posts, users, today), posts, chunk_size, progress)
+        _load(Comment.__table__, _comments(rng, comments, posts, users, today), comments, chunk_size, progress)
+    if counts['posts'] and tags:
+        # The number of taggings is only known once they are generated
+        _load(post_tags, _post_tags(rng, posts, tags, today), None, chunk_size, progress)
+    counts['post_tags'] = db.session.scalar(db.select(db.func.count()).select_from(post_tags))
+    _reset_sequences(User, Tag, Post, Comment)
+    db.session.commit()
+    return counts
@@ -0,0 +1,154 @@
+import heapq
+import json
+import random
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Number of slowest statements reported per request
+SLOWEST = 3
+
+# Length at which statements are cut in log lines
+STATEMENT_LENGTH = 300
+
+
+class QueryStats:
+    """
+    The SQL statements executed while handling one request.
+
+    Statements are grouped by their text, which holds placeholders rather than values, so
+    the same query run for each row of a list (an N+1 pattern) shows up as one statement
+    with a high count.
+
+    Attributes:
+        count (int): Number of statements executed.
+        duration (float): Total time spent executing them, in seconds.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+        self.slowest = []
+
+    def record(self, statement, duration):
+        """Add an executed statement and its duration."""
+        self.count += 1
+        self.duration += duration
+        totals = self.statements.get(statement)
+        if totals is None:
+            self.statements[statement] = [1, duration]
+        else:
+            totals[0] += 1
+            totals[1] += duration
+        # Bounded min-heap: the fastest of the slowest statements is replaced first
+        entry = (duration, self.count, statement)
+        if len(self.slowest) < SLOWEST:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def repeated(self, threshold):
+        """
+        Return the statements executed at least `threshold` times.
+
+        Returns:
+            A list of (statement, count, total duration) tuples, most executed first.
+        """
+        repeats = [(statement, count, duration) for statement, (count, duration) in self.statements.items() if count >= threshold]
+        return sorted(repeats, key=lambda repeat: -repeat[1])
+
+
+class SqlTiming:
+    """
+    Per-request SQL instrumentation through SQLAlchemy engine events.
+
+    A sample of requests record every statement they execute. Sampled responses get a
+    `Server-Timing` header with the query count and database time, and a structured log
+    line is written when a request spends long in the database or repeats a statement
+    many times. Unsampled requests only pay for a check in the event hooks.
+
+    Queries run while a streamed response is being generated happen after the response
+    headers are sent, and are not counted.
+
+    Configuration:
+        SQL_TIMING_ENABLED (bool): Whether requests are instrumented at all.
+        SQL_TIMING_SAMPLE_RATE (float): Fraction of requests instrumented, from 0 to 1.
+        SQL_TIMING_LOG_MS (float): Database time in milliseconds from which a request is logged.
+        SQL_TIMING_REPEAT_THRESHOLD (int): Number of executions of a statement from which a request is logged.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        """Hook the engines of the application and its request lifecycle."""
+        self.enabled = app.config.get('SQL_TIMING_ENABLED', True)
+        self.sample_rate = app.config.get('SQL_TIMING_SAMPLE_RATE', 1.0)
+        self.log_ms = app.config.get('SQL_TIMING_LOG_MS', 100.0)
+        self.repeat_threshold = app.config.get('SQL_TIMING_REPEAT_THRESHOLD', 5)
+        app.extensions['sql_timing'] = self
+        if not self.enabled:
+            return
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_execute)
+                event.listen(engine, 'handle_error', self._failed)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    @staticmethod
+    def _stats():
+        """Return the statistics of the current request if it is sampled, or None."""
+        return g.get('sql_stats') if has_request_context() else None
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._stats() is not None:
+            conn.info.setdefault('sql_timing', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        stats = self._stats()
+        starts = conn.info.get('sql_timing')
+        if stats is not None and starts:
+            stats.record(statement, time.perf_counter() - starts.pop())
+
+    def _failed(self, context):
+        # A failed statement has no after_cursor_execute event to consume its start time
+        starts = context.connection.info.get('sql_timing') if context.connection is not None else None
+        if self._stats() is not None and starts:
+            starts.pop()
+
+    def _start(self):
+        if random.random() < self.sample_rate:
+            g.sql_stats = QueryStats()
+            g.sql_started = time.perf_counter()
+
+    def _finish(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        total_ms = (time.perf_counter() - g.pop('sql_started')) * 1000
+        db_ms = stats.duration * 1000
+        queries = f'{stats.count} {"query" if stats.count == 1 else "queries"}'
+        response.headers.add('Server-Timing', f'db;dur={db_ms:.2f};desc="{queries}", app;dur={total_ms:.2f}')
+        repeated = stats.repeated(self.repeat_threshold)
+        if db_ms >= self.log_ms or repeated:
+            current_app.logger.warning('sql %s', json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(total_ms, 2),
+                'db_ms': round(db_ms, 2),
+                'queries': stats.count,
+                'slowest': [
+                    {'ms': round(duration * 1000, 2), 'statement': statement[:STATEMENT_LENGTH]}
+                    for duration, _, statement in sorted(stats.slowest, reverse=True)
+                ],
+                'repeated': [
+                    {'count': count, 'ms': round(duration * 1000, 2), 'statement': statement[:STATEMENT_LENGTH]}
+                    for statement, count, duration in repeated
+                ],
+            }))
+        return response
@@ -0,0 +1,100 @@
+from flask import Response, abort, current_app, jsonify, make_response, request, stream_with_context
+from flask_jwt_extended import get_jwt_identity
+from marshmallow import ValidationError
+from auth import is_admin
+from pagination import KeysetPage
+from serializers import compile_schema
+from init import db
+
+# Number of rows fetched from the database cursor and flushed to the client at a time
+STREAM_BATCH_SIZE = 500
+
+# Supported values of the `stream` query parameter and their content types
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def stream_format():
+    """
+    Return the streaming format requested with the `stream` query parameter.
+
+    A stream has no default limit and holds a database cursor until the last row is sent,
+    so only admins can request one.
+
+    Returns:
+        'json', 'ndjson', or None when the response should not be streamed.
+
+    Raises:
+        ValidationError: If the requested format is not supported.
+        Forbidden: If the user is not an admin.
+    """
+    fmt = request.args.get('stream')
+    if not fmt:
+        return None
+    if fmt not in STREAM_FORMATS:
+        raise ValidationError({'stream': [f'Must be one of: {", ".join(STREAM_FORMATS)}.']})
+    if not is_admin(get_jwt_identity()):
+        abort(make_response(jsonify(error='You must be an admin to stream exports'), 403))
+    return fmt
+
+
+def _generate(stmt, schema, fmt):
+    """
+    Yield the serialized rows of a statement, one batch of rows per chunk.
+
+    Rows are read with yield_per, which uses a server-side cursor where the driver supports
+    it, and each row is dumped and encoded as soon as it is fetched. At most one batch of
+    ORM objects and one chunk of encoded output are held in memory at a time.
+    """
+    dumps = current_app.json.dumps
+    dump = compile_schema(schema)
+    result = db.session.execute(stmt.execution_options(yield_per=STREAM_BATCH_SIZE)).scalars()
+    first = True
+    if fmt == 'json':
+        yield '['
+    for partition in result.partitions():
+        chunk = []
+        for row in partition:
+            item = dumps(dump(row), separators=(',', ':'))
+            if fmt == 'ndjson':
+                chunk.append(item + '\n')
+            else:
+                chunk.append(item if first else ',' + item)
+            first = False
+        yield ''.join(chunk)
+    if fmt == 'json':
+        yield ']'
+
+
+def stream(stmt, schema, key_columns, fmt):
+    """
+    Stream the rows of a select statement as a JSON array or as NDJSON.
+
+    The rows are ordered newest first by the key columns like a paginated response. The
+    `after` cursor and `limit` parameters are honoured, but there is no default limit, so a
+    single request can export the whole result set with flat memory use. Because the
+    response is sent before the last row is known, no cursor headers are returned.
+
+    Args:
+        stmt: A SQLAlchemy select statement over a single model, with loader options applied.
+        schema: The schema used to dump each row.
+        key_columns: The columns that uniquely order the rows.
+        fmt (str): 'json' for a JSON array, 'ndjson' for one JSON document per line.
+
+    Returns:
+        A streamed Flask response.
+
+    Raises:
+        ValidationError: If the pagination parameters are invalid.
+    """
+    page = KeysetPage.from_request(key_columns, default_limit=None, max_limit=None)
+    if page.before is not None:
+        raise ValidationError({'before': ['Not supported when streaming.']})
+    stmt = page.apply(stmt)
+    if page.limit is not None:
+        # Streams have no next page, so drop the look-ahead row added by apply()
+        stmt = stmt.limit(page.limit)
+    generator = stream_with_context(_generate(stmt, schema, fmt))
+    return Response(generator, status=200, mimetype=STREAM_FORMATS[fmt])
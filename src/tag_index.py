@@ -0,0 +1,600 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from flask import current_app, request
+from marshmallow import ValidationError
+from models.post import Post
+from models.tag import Tag, post_tags
+from pagination import KeysetPage
+from init import db
+
+# Containers holding more values than this are stored as bitsets instead of sorted arrays
+ARRAY_MAX = 4096
+
+# Number of post_tags rows read from the database at a time when loading the index
+LOAD_BATCH_SIZE = 10000
+
+# Supported values of the `mode` query parameter
+MODES = ('all', 'any')
+
+# Default and maximum number of tag suggestions returned for a prefix
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 100
+
+# A tag as held by the prefix index, dumped with TagSchema like a Tag
+TagEntry = namedtuple('TagEntry', ('id', 'name', 'post_count'))
+
+
+def _bits_to_array(bits):
+    """Return the positions of the set bits of an int, as a sorted array."""
+    values = array('H')
+    while bits:
+        low = bits & -bits
+        values.append(low.bit_length() - 1)
+        bits ^= low
+    return values
+
+
+def _array_to_bits(values):
+    """Return an int with the bits at the given positions set."""
+    bits = 0
+    for value in values:
+        bits |= 1 << value
+    return bits
+
+
+def _compact(container):
+    """Return a container in its smallest form, or None if it is empty."""
+    if isinstance(container, int):
+        count = container.bit_count()
+        if count == 0:
+            return None
+        return _bits_to_array(container) if count <= ARRAY_MAX else container
+    if not container:
+        return None
+    return array('H', container) if len(container) <= ARRAY_MAX else _array_to_bits(container)
+
+
+class Bitmap:
+    """
+    A compressed bitmap of non-negative integers, in the style of Roaring bitmaps.
+
+    Values are split on their high 16 bits into containers of up to 65536 values. Sparse
+    containers are sorted arrays of the low 16 bits, two bytes per value, and dense ones are
+    bitsets stored as Python ints, 8 KiB at most. Intersections and unions work container by
+    container, with bitwise operations on dense containers, so their cost follows the size
+    of the compressed data rather than the number of values.
+    """
+
+    __slots__ = ('_containers',)
+
+    def __init__(self, containers=None):
+        self._containers = containers or {}
+
+    @classmethod
+    def from_sorted(cls, values):
+        """Build a bitmap from an iterable of unique values in ascending order."""
+        containers = {}
+        for value in values:
+            containers.setdefault(value >> 16, array('H')).append(value & 0xFFFF)
+        return cls({high: _compact(low) for high, low in containers.items()})
+
+    def __len__(self):
+        return sum(c.bit_count() if isinstance(c, int) else len(c) for c in self._containers.values())
+
+    def __contains__(self, value):
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        index = bisect_left(container, low)
+        return index < len(container) and container[index] == low
+
+    def add(self, value):
+        """Add a value to the bitmap."""
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = array('H', [low])
+        elif isinstance(container, int):
+            self._containers[high] = container | 1 << low
+        else:
+            index = bisect_left(container, low)
+            if index == len(container) or container[index] != low:
+                container.insert(index, low)
+                if len(container) > ARRAY_MAX:
+                    self._containers[high] = _array_to_bits(container)
+
+    def discard(self, value):
+        """Remove a value from the bitmap if it is present."""
+        high, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container = _compact(container & ~(1 << low))
+        else:
+            index = bisect_left(container, low)
+            if index < len(container) and container[index] == low:
+                del container[index]
+            container = container or None
+        if container is None:
+            del self._containers[high]
+        else:
+            self._containers[high] = container
+
+    def __and__(self, other):
+        containers = {}
+        for high in self._containers.keys() & other._containers.keys():
+            a, b = self._containers[high], other._containers[high]
+            if isinstance(a, int) and isinstance(b, int):
+                result = _compact(a & b)
+            elif isinstance(a, int) or isinstance(b, int):
+                bits, values = (a, b) if isinstance(a, int) else (b, a)
+                result = array('H', [value for value in values if bits >> value & 1]) or None
+            else:
+                if len(a) > len(b):
+                    a, b = b, a
+                result = array('H', sorted(set(a).intersection(b))) or None
+            if result is not None:
+                containers[high] = result
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = {}
+        for high in self._containers.keys() | other._containers.keys():
+            a, b = self._containers.get(high), other._containers.get(high)
+            if a is None or b is None:
+                result = a if b is None else b
+                containers[high] = result if isinstance(result, int) else array('H', result)
+            elif isinstance(a, int) or isinstance(b, int):
+                bits_a = a if isinstance(a, int) else _array_to_bits(a)
+                bits_b = b if isinstance(b, int) else _array_to_bits(b)
+                containers[high] = bits_a | bits_b
+            else:
+                containers[high] = _compact(sorted(set(a).union(b)))
+        return Bitmap(containers)
+
+    def descending(self, below=None):
+        """Yield the values in descending order, starting below a value if given."""
+        for high in sorted(self._containers, reverse=True):
+            base = high << 16
+            if below is not None:
+                if base >= below:
+                    continue
+                # A cursor far beyond this container must not build a mask as large as itself
+                limit = min(below - base, 0x10000)
+            else:
+                limit = 0x10000
+            container = self._containers[high]
+            if isinstance(container, int):
+                bits = container & ((1 << limit) - 1)
+                while bits:
+                    low = bits.bit_length() - 1
+                    yield base | low
+                    bits ^= 1 << low
+            else:
+                for index in range(bisect_left(container, limit) - 1, -1, -1):
+                    yield base | container[index]
+
+    def ascending(self, above=None):
+        """Yield the values in ascending order, starting above a value if given."""
+        for high in sorted(self._containers):
+            base = high << 16
+            if above is not None:
+                if base + 0xFFFF <= above:
+                    continue
+                start = min(max(above - base + 1, 0), 0x10000)
+            else:
+                start = 0
+            container = self._containers[high]
+            if isinstance(container, int):
+                bits = container >> start << start
+                while bits:
+                    low = bits & -bits
+                    yield base | low.bit_length() - 1
+                    bits ^= low
+            else:
+                for index in range(bisect_right(container, start - 1), len(container)):
+                    yield base | container[index]
+
+    def nbytes(self):
+        """Return the approximate size of the containers in bytes."""
+        return sum((c.bit_length() + 7) // 8 if isinstance(c, int) else c.itemsize * len(c) for c in self._containers.values())
+
+
+class SharedIndex:
+    """
+    Base class of in-memory indexes kept in sync across worker processes.
+
+    The index is built from the database on first use and updated in place by the process
+    making a change. A version counter in the response cache's version store, which is shared
+    by every worker on the host, is bumped on every change. A process that finds the counter
+    moved by another process rebuilds its copy before answering.
+
+    Subclasses set `extension` and `version_name` and implement `build`. Those that can
+    serve slightly out of date results set `max_staleness`, the number of seconds a process
+    keeps answering from its own copy after another process made a change. They read the
+    shared version at most once per `max_staleness` seconds.
+    """
+
+    extension = None
+    version_name = None
+    max_staleness = 0
+
+    def __init__(self, app=None):
+        self._lock = threading.RLock()
+        self._data = None
+        self._version = None
+        self._checked_at = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the index on the application."""
+        app.extensions[self.extension] = self
+
+    def _store(self):
+        """Return the version store shared with the response cache."""
+        return current_app.extensions['response_cache'].versions
+
+    def _current_version(self):
+        return self._store().versions([self.version_name])[self.version_name]
+
+    def build(self):
+        """Return the contents of the index, built from the database."""
+        raise NotImplementedError
+
+    def load(self):
+        """Build the index from the database, replacing its contents."""
+        with self._lock:
+            version = self._current_version()
+            self._data, self._version = self.build(), version
+            self._checked_at = time.monotonic()
+
+    def _current(self):
+        """Return the contents of the index, loading them if they are missing or out of date."""
+        with self._lock:
+            if self._data is None:
+                self.load()
+            elif time.monotonic() - self._checked_at >= self.max_staleness:
+                self._checked_at = time.monotonic()
+                if self._version != self._current_version():
+                    self.load()
+            return self._data
+
+    def _update(self, apply):
+        """
+        Bump the shared version and apply a change to the loaded contents.
+
+        The change is applied in place when no other process made a change since the index
+        was loaded. Otherwise the index is dropped and rebuilt on next use, unless it may be
+        stale, in which case the change is applied and the index is rebuilt when due.
+        """
+        store = self._store()
+        with self._lock:
+            store.bump([self.version_name])
+            version = store.versions([self.version_name])[self.version_name]
+            if self._data is not None and self._version == version - 1:
+                apply(self._data)
+                self._version = version
+            elif self._data is not None and self.max_staleness:
+                apply(self._data)
+            else:
+                self._data = None
+
+    def reset(self):
+        """Drop the index in every process, e.g. after the data was changed outside the API."""
+        self._update(lambda data: None)
+        with self._lock:
+            self._data = None
+
+
+class TagIndex(SharedIndex):
+    """
+    In-memory index from each tag to the bitmap of the IDs of its posts.
+
+    The index is loaded from post_tags on first use and updated incrementally when posts are
+    tagged, untagged or deleted.
+    """
+
+    extension = 'tag_index'
+    version_name = 'index:post_tags'
+
+    def build(self):
+        """Load a bitmap per tag from the post_tags table, reading it in batches."""
+        stmt = db.select(post_tags.c.tag_id, post_tags.c.post_id).order_by(post_tags.c.tag_id, post_tags.c.post_id)
+        bitmaps = {}
+        tag_id, post_ids = None, []
+        for row in db.session.execute(stmt.execution_options(yield_per=LOAD_BATCH_SIZE)):
+            if row.tag_id != tag_id:
+                if post_ids:
+                    bitmaps[tag_id] = Bitmap.from_sorted(post_ids)
+                tag_id, post_ids = row.tag_id, []
+            post_ids.append(row.post_id)
+        if post_ids:
+            bitmaps[tag_id] = Bitmap.from_sorted(post_ids)
+        return bitmaps
+
+    def retag(self, added, removed=()):
+        """
+        Record that posts were tagged and untagged. Call after committing.
+
+        Args:
+            added: The (post ID, tag ID) pairs added to post_tags.
+            removed: The (post ID, tag ID) pairs removed from post_tags.
+        """
+        def apply(bitmaps):
+            for post_id, tag_id in added:
+                bitmaps.setdefault(tag_id, Bitmap()).add(post_id)
+            for post_id, tag_id in removed:
+                if tag_id in bitmaps:
+                    bitmaps[tag_id].discard(post_id)
+        self._update(apply)
+
+    def remove_posts(self, post_ids):
+        """Record that posts were deleted. Call after committing."""
+        def apply(bitmaps):
+            for bitmap in bitmaps.values():
+                for post_id in post_ids:
+                    bitmap.discard(post_id)
+        self._update(apply)
+
+    def remove_tag(self, tag_id):
+        """Record that a tag was deleted. Call after committing."""
+        self._update(lambda bitmaps: bitmaps.pop(tag_id, None))
+
+    def query(self, tag_ids, mode='all'):
+        """
+        Return the bitmap of the posts tagged with all, or any, of the tags.
+
+        Args:
+            tag_ids (list): The IDs of the tags.
+            mode (str): 'all' for the intersection, 'any' for the union.
+
+        Returns:
+            A Bitmap of post IDs.
+        """
+        bitmaps = self._current()
+        with self._lock:
+            if mode == 'all':
+                # Intersect the smallest bitmaps first to keep intermediate results small
+                selected = sorted((bitmaps.get(tag_id, Bitmap()) for tag_id in tag_ids), key=len)
+                # Copy, so the result is not changed by later updates while it is read
+                result = selected[0] | Bitmap()
+                for bitmap in selected[1:]:
+                    if not len(result):
+                        break
+                    result = result & bitmap
+                return result
+            result = Bitmap()
+            for tag_id in tag_ids:
+                if tag_id in bitmaps:
+                    result = result | bitmaps[tag_id]
+            return result
+
+    def stats(self):
+        """Return the number of tags and the approximate size of the loaded index."""
+        with self._lock:
+            bitmaps = self._data or {}
+            return {
+                'loaded': self._data is not None,
+                'tags': len(bitmaps),
+                'bytes': sum(bitmap.nbytes() for bitmap in bitmaps.values()),
+            }
+
+
+class TagPrefixIndex(SharedIndex):
+    """
+    In-memory prefix index over tag names, for autocomplete ranked by usage.
+
+    Tags are held in an array sorted by case-folded name, so the tags starting with a prefix
+    are a contiguous slice found with two binary searches. The most used tags of the slice are
+    picked with a bounded heap. The index is updated in place when tags are created, renamed
+    or deleted, and when posts are deleted.
+
+    The contents are a dict with `keys`, the sorted case-folded names, `entries`, the
+    TagEntry of each key, and `by_id`, the entries by tag ID.
+    """
+
+    extension = 'tag_prefix_index'
+    version_name = 'index:tags'
+
+    def build(self):
+        """Load every tag with its post count, sorted by case-folded name."""
+        rows = db.session.execute(db.select(Tag.id, Tag.name, Tag.post_count))
+        entries = sorted((TagEntry(*row) for row in rows), key=lambda entry: entry.name.casefold())
+        return {
+            'keys': [entry.name.casefold() for entry in entries],
+            'entries': entries,
+            'by_id': {entry.id: entry for entry in entries},
+        }
+
+    @staticmethod
+    def _insert(data, entry):
+        key = entry.name.casefold()
+        index = bisect_right(data['keys'], key)
+        data['keys'].insert(index, key)
+        data['entries'].insert(index, entry)
+        data['by_id'][entry.id] = entry
+
+    @staticmethod
+    def _remove(data, tag_id):
+        entry = data['by_id'].pop(tag_id, None)
+        if entry is None:
+            return None
+        key = entry.name.casefold()
+        index = bisect_left(data['keys'], key)
+        while data['entries'][index].id != tag_id:
+            index += 1
+        del data['keys'][index]
+        del data['entries'][index]
+        return entry
+
+    def add(self, *tags):
+        """Record that tags were created. Call after committing."""
+        def apply(data):
+            for tag in tags:
+                self._insert(data, TagEntry(tag.id, tag.name, getattr(tag, 'post_count', None) or 0))
+        self._update(apply)
+
+    def rename(self, tag_id, name):
+        """Record that a tag was renamed. Call after committing."""
+        def apply(data):
+            entry = self._remove(data, tag_id)
+            if entry is not None:
+                self._insert(data, entry._replace(name=name))
+        self._update(apply)
+
+    def remove(self, tag_id):
+        """Record that a tag was deleted. Call after committing."""
+        self._update(lambda data: self._remove(data, tag_id))
+
+    def adjust_usage(self, deltas):
+        """
+        Record that posts were tagged or untagged. Call after committing.
+
+        Args:
+            deltas (dict): The number of posts tagged, or untagged when negative, by tag ID.
+        """
+        def apply(data):
+            for tag_id, delta in deltas.items():
+                entry = data['by_id'].get(tag_id)
+                if entry is not None and delta:
+                    # Entries are immutable, replace the entry in the sorted array and the ID map
+                    updated = data['by_id'][tag_id] = entry._replace(post_count=entry.post_count + delta)
+                    index = bisect_left(data['keys'], entry.name.casefold())
+                    while data['entries'][index].id != tag_id:
+                        index += 1
+                    data['entries'][index] = updated
+        self._update(apply)
+
+    def suggest(self, prefix, limit=DEFAULT_SUGGESTIONS):
+        """
+        Return the most used tags whose name starts with a prefix, ignoring case.
+
+        Args:
+            prefix (str): The start of the tag name.
+            limit (int): The maximum number of tags returned.
+
+        Returns:
+            A list of TagEntry, by descending post count then name.
+        """
+        data = self._current()
+        with self._lock:
+            keys, entries = data['keys'], data['entries']
+            prefix = prefix.casefold()
+            start = bisect_left(keys, prefix)
+            # Every key starting with the prefix sorts before the prefix followed by the highest code point
+            end = bisect_left(keys, prefix + '\U0010ffff', start)
+            return heapq.nsmallest(limit, (entries[index] for index in range(start, end)), key=lambda entry: (-entry.post_count, entry.name.casefold(), entry.id))
+
+
+def tag_index():
+    """Return the tag index of the current application."""
+    return current_app.extensions['tag_index']
+
+
+def limit_arg(default, maximum):
+    """
+    Return the `limit` query parameter.
+
+    Args:
+        default (int): The limit used when none is given.
+        maximum (int): The largest limit accepted.
+
+    Raises:
+        ValidationError: If the limit is not an integer between 1 and the maximum.
+    """
+    if not request.args.get('limit'):
+        return default
+    try:
+        limit = int(request.args['limit'])
+    except ValueError:
+        raise ValidationError({'limit': ['Not a valid integer.']})
+    if limit < 1 or limit > maximum:
+        raise ValidationError({'limit': [f'Must be between 1 and {maximum}.']})
+    return limit
+
+
+def tag_prefix_index():
+    """Return the tag prefix index of the current application."""
+    return current_app.extensions['tag_prefix_index']
+
+
+def prefix_filter():
+    """
+    Return the prefix and limit requested with the `prefix` and `limit` query parameters.
+
+    Returns:
+        A tuple of (prefix, limit), or None when no prefix was requested.
+
+    Raises:
+        ValidationError: If the limit is invalid.
+    """
+    if 'prefix' not in request.args:
+        return None
+    return request.args['prefix'], limit_arg(DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS)
+
+
+def tag_filter():
+    """
+    Return the tag names and mode requested with the `tags` and `mode` query parameters.
+
+    Returns:
+        A tuple of (names, mode), or None when no tags were requested.
+
+    Raises:
+        ValidationError: If the mode is not supported.
+    """
+    names = [name.strip() for name in request.args.get('tags', '').split(',') if name.strip()]
+    if not names:
+        return None
+    mode = request.args.get('mode', 'all')
+    if mode not in MODES:
+        raise ValidationError({'mode': [f'Must be one of: {", ".join(MODES)}.']})
+    return names, mode
+
+
+def paginate_tagged(names, mode, options=()):
+    """
+    Return a page of the posts tagged with all, or any, of the named tags, newest first.
+
+    The set operations run on the in-memory bitmaps and only the posts of the requested page
+    are loaded from the database. Posts are ordered by ID, which follows creation order, and
+    paginated with the usual `limit`, `after` and `before` query parameters.
+
+    Args:
+        names (list): The names of the tags.
+        mode (str): 'all' or 'any'.
+        options: Loader options applied when loading the posts.
+
+    Returns:
+        A tuple of (posts, headers), where headers holds the cursors for the neighbouring pages.
+
+    Raises:
+        ValidationError: If the pagination parameters are invalid.
+    """
+    page = KeysetPage.from_request((Post.id,))
+    tag_ids = db.session.scalars(db.select(Tag.id).where(Tag.name.in_(names))).all()
+    if not tag_ids or (mode == 'all' and len(tag_ids) < len(set(names))):
+        # An unknown tag matches no posts
+        return [], {}
+    bitmap = tag_index().query(tag_ids, mode)
+
+    if page.before is not None:
+        ids = bitmap.ascending(above=page.before[0])
+    else:
+        ids = bitmap.descending(below=page.after[0] if page.after is not None else None)
+    # Take one extra ID so trim() can tell whether another page exists
+    selected = [post_id for post_id, _ in zip(ids, range(page.limit + 1))]
+
+    posts = db.session.scalars(db.select(Post).where(Post.id.in_(selected)).options(*options))
+    by_id = {post.id: post for post in posts}
+    posts = page.trim([by_id[post_id] for post_id in selected if post_id in by_id])
+    return posts, page.headers(posts)
@@ -0,0 +1,108 @@
+from collections import Counter, namedtuple
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from models.post import Post
+from models.tag import Tag, post_tags
+from counters import adjust_tags
+from etags import touch_posts
+from cache import invalidate
+from tag_index import tag_index, tag_prefix_index
+from trending import trending_tags
+from init import db
+
+# Maximum number of posts retagged in a single bulk request
+MAX_RETAG_POSTS = 10000
+
+# The outcome of a retag, with the (post ID, tag ID) pairs added and removed, and the
+# (tag ID, tagging time) of each removed pair
+Retagged = namedtuple('Retagged', ('post_ids', 'tags', 'created', 'added', 'removed', 'untagged'))
+
+# Dialects with an INSERT ... ON CONFLICT DO NOTHING construct
+_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def tag_names(names):
+    """Return tag names without surrounding whitespace, blanks or duplicates, in the order given."""
+    return list(dict.fromkeys(name.strip() for name in names if name.strip()))
+
+
+def _create_missing(names):
+    """
+    Create the tags that do not exist yet with a single INSERT ... ON CONFLICT DO NOTHING.
+
+    Returns:
+        A list of (id, name) rows of the tags created.
+    """
+    dialect = db.session.get_bind().dialect.name
+    insert = _INSERTS.get(dialect)
+    if insert is None:
+        raise NotImplementedError(f'Creating tags in bulk is not supported on {dialect}')
+    stmt = insert(Tag).values([{'name': name} for name in names])
+    stmt = stmt.on_conflict_do_nothing(index_elements=['name']).returning(Tag.id, Tag.name)
+    return db.session.execute(stmt).all()
+
+
+def retag(changes):
+    """
+    Set the tags of many posts, creating the tags that do not exist.
+
+    Only the difference between the current and requested tags is written, whatever the
+    number of posts: one INSERT creates missing tags, one SELECT reads their IDs, one SELECT
+    reads the current tags of the posts and when they were added, then one bulk INSERT and
+    one bulk DELETE update post_tags. The tag counters and post versions are updated with one
+    UPDATE each. Nothing is committed.
+
+    Args:
+        changes (dict): The complete list of tag names of each post, by post ID.
+
+    Returns:
+        A Retagged tuple.
+    """
+    names = sorted({name for tag_names in changes.values() for name in tag_names})
+    created = _create_missing(names) if names else []
+    tags = dict(db.session.execute(db.select(Tag.name, Tag.id).where(Tag.name.in_(names))).all()) if names else {}
+
+    desired = {(post_id, tags[name]) for post_id, tag_names in changes.items() for name in tag_names}
+    stmt = db.select(post_tags.c.post_id, post_tags.c.tag_id, post_tags.c.tagged_at).where(post_tags.c.post_id.in_(list(changes)))
+    current = {(row.post_id, row.tag_id): row.tagged_at for row in db.session.execute(stmt)}
+    added, removed = sorted(desired - current.keys()), sorted(current.keys() - desired)
+
+    if added:
+        db.session.execute(post_tags.insert(), [{'post_id': post_id, 'tag_id': tag_id} for post_id, tag_id in added])
+    if removed:
+        db.session.execute(post_tags.delete().where(tuple_(post_tags.c.post_id, post_tags.c.tag_id).in_(removed)))
+    if added or removed:
+        deltas = Counter(tag_id for _, tag_id in added)
+        deltas.subtract(tag_id for _, tag_id in removed)
+        adjust_tags(deltas)
+        touch_posts(Post.id.in_({post_id for post_id, _ in added + removed}))
+    return Retagged(list(changes), tags, created, added, removed, [(tag_id, current[post_id, tag_id]) for post_id, tag_id in removed])
+
+
+def retagged(result):
+    """
+    Update the caches and in-memory indexes after a retag was committed.
+
+    Args:
+        result (Retagged): The value returned by `retag`.
+    """
+    if result.created:
+        tag_prefix_index().add(*result.created)
+    if not (result.added or result.removed):
+        if result.created:
+            invalidate('tags')
+        return
+    changed_posts = {post_id for post_id, _ in result.added + result.removed}
+    changed_tags = {tag_id for _, tag_id in result.added + result.removed}
+    # Posts render their tags, tag lists render post counts and tag pages list their posts
+    invalidate('tags', *[f'posts:{post_id}' for post_id in changed_posts], *[f'tags:{tag_id}:posts' for tag_id in changed_tags])
+    tag_index().retag(result.added, result.removed)
+    deltas = Counter(tag_id for _, tag_id in result.added)
+    deltas.subtract(tag_id for _, tag_id in result.removed)
+    tag_prefix_index().adjust_usage(deltas)
+    if result.added:
+        trending_tags().record([tag_id for _, tag_id in result.added])
+    trending_tags().unrecord(result.untagged)
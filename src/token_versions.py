@@ -0,0 +1,149 @@
+from array import array
+from flask import current_app
+from models.user import User
+from tag_index import SharedIndex, LOAD_BATCH_SIZE
+from init import db, jwt
+
+# Claims added to access tokens at login
+ROLE_CLAIM = 'role'
+VERSION_CLAIM = 'ver'
+
+# Values of the role claim
+ROLE_ADMIN = 'admin'
+ROLE_USER = 'user'
+
+# Entry of a user who does not exist
+MISSING = -1
+
+# Largest ID per user for which the entries are loaded in an array indexed by ID, at 8 bytes
+# per ID up to the largest. Sparser IDs are loaded in a dict, at about 100 bytes per user.
+MAX_IDS_PER_USER = 8
+
+
+def pack(version, admin):
+    """Return the entry of a user with a token version and admin status."""
+    return version << 1 | bool(admin)
+
+
+def token_claims(user):
+    """
+    Return the claims of an access token issued to a user.
+
+    Args:
+        user (User): The user logging in.
+
+    Returns:
+        The role and token version of the user, as additional claims.
+    """
+    return {ROLE_CLAIM: ROLE_ADMIN if user.is_admin else ROLE_USER, VERSION_CLAIM: user.token_version}
+
+
+class VersionTable:
+    """
+    The token version and admin status of every user, packed as `version << 1 | is_admin`.
+
+    Attributes:
+        packed (array): The entry of each user ID up to the largest loaded, MISSING for IDs
+            without a user. Empty when the IDs are too sparse for an array.
+        recent (dict): The entries of the users outside the array: all of them when it is
+            empty, otherwise those beyond the largest loaded ID, looked up one at a time.
+    """
+
+    __slots__ = ('packed', 'recent')
+
+    def __init__(self, packed):
+        self.packed = packed
+        self.recent = {}
+
+    def set(self, user_id, entry):
+        if 0 <= user_id < len(self.packed):
+            self.packed[user_id] = entry
+        else:
+            self.recent[user_id] = entry
+
+
+class TokenVersions(SharedIndex):
+    """
+    In-memory table of the token version and role of every user, checked against the claims
+    of each access token instead of querying the users table.
+
+    A token is accepted when its user exists and its role and version claims match the user's
+    current ones. Bumping a user's token version revokes the tokens issued before, and a role
+    change revokes the tokens carrying the former role, so `admin_only` and the ownership
+    checks can trust the role claim.
+
+    The table is loaded in bulk and updated in place by the process making a change. Other
+    processes reload it within `TOKEN_VERSION_MAX_STALENESS` seconds, which bounds how long a
+    deleted user, a former admin or a revoked token keeps being accepted there. Changes made
+    directly in the database are picked up once the table is reset. Users registered after
+    the table was loaded are looked up on their first request, and the tokens of missing users
+    on each of theirs.
+
+    Configuration:
+        TOKEN_VERSION_MAX_STALENESS (float): Seconds a process may accept tokens from its own copy after another process changed a user.
+    """
+
+    extension = 'token_versions'
+    version_name = 'index:token_versions'
+
+    def init_app(self, app):
+        """Register the table and check every access token against it."""
+        self.max_staleness = app.config.get('TOKEN_VERSION_MAX_STALENESS', 30.0)
+        super().init_app(app)
+        jwt.token_in_blocklist_loader(self._revoked)
+
+    def build(self):
+        """
+        Load the entry of every user, reading them in batches.
+
+        The entries are held in an array indexed by user ID, 8 bytes per ID up to the largest
+        (80 MB per process at 10 million IDs), unless the IDs are more than
+        `MAX_IDS_PER_USER` times as many as the users, as after deleting most of them. Those
+        are held in a dict keyed by ID, costing about 100 bytes per user instead.
+        """
+        last, count = db.session.execute(db.select(db.func.max(User.id), db.func.count(User.id))).one()
+        last = last or 0
+        dense = last <= count * MAX_IDS_PER_USER
+        table = VersionTable(array('q', [MISSING]) * (last + 1) if dense else array('q'))
+        # Users created while loading are beyond the table, and looked up when first seen
+        stmt = db.select(User.id, User.token_version, User.is_admin).where(User.id <= last)
+        for row in db.session.execute(stmt.execution_options(yield_per=LOAD_BATCH_SIZE)):
+            table.set(row.id, pack(row.token_version, row.is_admin))
+        return table
+
+    def entry(self, user_id):
+        """Return the packed token version and admin status of a user, or MISSING."""
+        table = self._current()
+        if 0 <= user_id < len(table.packed):
+            entry = table.packed[user_id]
+        else:
+            entry = table.recent.get(user_id, MISSING)
+        if entry == MISSING:
+            # The user may have been created since the table was loaded, possibly with the ID of a deleted user
+            row = db.session.execute(db.select(User.token_version, User.is_admin).where(User.id == user_id)).first()
+            if row is not None:
+                entry = pack(*row)
+                table.set(user_id, entry)
+        return entry
+
+    def _revoked(self, jwt_header, jwt_payload):
+        user_id = jwt_payload[current_app.config['JWT_IDENTITY_CLAIM']]
+        if not isinstance(user_id, int):
+            return True
+        # Tokens issued before the claims existed carry neither, and are valid for non-admins only
+        claimed = pack(jwt_payload.get(VERSION_CLAIM, 0), jwt_payload.get(ROLE_CLAIM) == ROLE_ADMIN)
+        return self.entry(user_id) != claimed
+
+    def changed(self, user):
+        """Record a change of a user's token version or role. Call after committing."""
+        entry = pack(user.token_version, user.is_admin)
+        self._update(lambda table: table.set(user.id, entry))
+
+    def deleted(self, user_id):
+        """Record that a user was deleted, revoking their tokens. Call after committing."""
+        self._update(lambda table: table.set(user_id, MISSING))
+
+
+def token_versions():
+    """Return the token version table of the current application."""
+    return current_app.extensions['token_versions']
@@ -0,0 +1,228 @@
+import heapq
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+from flask import current_app, request
+from marshmallow import ValidationError
+from models.tag import post_tags
+from tag_index import SharedIndex, limit_arg
+from init import db
+
+# Trending windows, as (bucket width in seconds, number of buckets)
+WINDOWS = {
+    '1h': (60, 60),
+    '24h': (3600, 24),
+    '7d': (3600, 168),
+}
+DEFAULT_WINDOW = '24h'
+
+# Default and maximum number of trending tags returned
+DEFAULT_TRENDING = 10
+MAX_TRENDING = 100
+
+# Number of post_tags rows read from the database at a time when rebuilding the counters
+LOAD_BATCH_SIZE = 10000
+
+
+def _utcnow():
+    """Return the current time as a naive UTC datetime, like post_tags.tagged_at."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _timestamp(when):
+    """Return the POSIX timestamp of a naive UTC datetime."""
+    return when.replace(tzinfo=timezone.utc).timestamp()
+
+
+class SlidingWindow:
+    """
+    Per-key event counts over a sliding time window, kept in a ring buffer of time buckets.
+
+    Each slot of the ring holds the counts of one bucket. When time moves past a bucket, its
+    slot is subtracted from the running totals and reused, so the totals always cover the
+    last `size` buckets and only keys with events in the window are held in them.
+
+    Attributes:
+        width (int): The width of a bucket in seconds.
+        size (int): The number of buckets in the window.
+    """
+
+    def __init__(self, width, size):
+        self.width = width
+        self.size = size
+        self.slots = [Counter() for _ in range(size)]
+        self.totals = Counter()
+        self.current = None
+
+    def advance(self, bucket):
+        """Move the window forward to end at a bucket, expiring the buckets that fall out of it."""
+        if self.current is None:
+            self.current = bucket
+            return
+        if bucket <= self.current:
+            return
+        if bucket - self.current >= self.size:
+            # The whole window has expired
+            for slot in self.slots:
+                slot.clear()
+            self.totals.clear()
+        else:
+            for expired in range(self.current + 1, bucket + 1):
+                slot = self.slots[expired % self.size]
+                for key, count in slot.items():
+                    remaining = self.totals[key] - count
+                    if remaining:
+                        self.totals[key] = remaining
+                    else:
+                        del self.totals[key]
+                slot.clear()
+        self.current = bucket
+
+    def add(self, key, timestamp, count=1):
+        """Count events for a key at a POSIX timestamp. Events older than the window are ignored."""
+        bucket = int(timestamp // self.width)
+        self.advance(bucket)
+        if bucket <= self.current - self.size:
+            return
+        self.slots[bucket % self.size][key] += count
+        self.totals[key] += count
+
+    def remove(self, key, timestamp, count=1):
+        """Uncount events counted for a key at a POSIX timestamp. Events older than the window are ignored."""
+        bucket = int(timestamp // self.width)
+        self.advance(bucket)
+        if bucket <= self.current - self.size or bucket > self.current:
+            return
+        slot = self.slots[bucket % self.size]
+        # Only events that were counted can be uncounted
+        count = min(count, slot[key])
+        if not count:
+            return
+        for counter in (slot, self.totals):
+            remaining = counter[key] - count
+            if remaining:
+                counter[key] = remaining
+            else:
+                del counter[key]
+
+    def forget(self, key):
+        """Drop every event of a key."""
+        for slot in self.slots:
+            slot.pop(key, None)
+        self.totals.pop(key, None)
+
+    def top(self, k, timestamp):
+        """
+        Return the k keys with the most events in the window ending at a POSIX timestamp.
+
+        Only the keys with events in the window are considered, with a heap bounded to k.
+
+        Returns:
+            A list of (key, count) tuples, most events first.
+        """
+        self.advance(int(timestamp // self.width))
+        return heapq.nlargest(k, self.totals.items(), key=itemgetter(1))
+
+
+class TrendingTags(SharedIndex):
+    """
+    Counts of the posts tagged with each tag over the trending windows.
+
+    The counters are rebuilt from the tagging times in post_tags and updated as posts are
+    tagged, and as taggings are removed with their post or tag, at the time they were made. A
+    process serves its own counters for up to `max_staleness` seconds after another
+    process records taggings, then rebuilds them, so the windows never need a GROUP BY per
+    request.
+    """
+
+    extension = 'trending_tags'
+    version_name = 'index:trending'
+    max_staleness = 60
+
+    def build(self):
+        """Rebuild the windows from the taggings of the longest window."""
+        windows = {name: SlidingWindow(width, size) for name, (width, size) in WINDOWS.items()}
+        now = _timestamp(_utcnow())
+        for window in windows.values():
+            window.advance(int(now // window.width))
+        span = max(width * size for width, size in WINDOWS.values())
+        since = _utcnow() - timedelta(seconds=span)
+        stmt = db.select(post_tags.c.tag_id, post_tags.c.tagged_at).where(post_tags.c.tagged_at >= since)
+        for row in db.session.execute(stmt.execution_options(yield_per=LOAD_BATCH_SIZE)):
+            timestamp = _timestamp(row.tagged_at)
+            for window in windows.values():
+                window.add(row.tag_id, timestamp)
+        return windows
+
+    def record(self, tag_ids, when=None):
+        """
+        Record that a post was tagged with each of the tags. Call after committing.
+
+        Args:
+            tag_ids: The IDs of the tags.
+            when (datetime): The naive UTC tagging time, now by default.
+        """
+        timestamp = _timestamp(when or _utcnow())
+
+        def apply(windows):
+            for window in windows.values():
+                for tag_id in tag_ids:
+                    window.add(tag_id, timestamp)
+        self._update(apply)
+
+    def unrecord(self, taggings):
+        """
+        Uncount taggings removed from posts, or deleted with them. Call after committing.
+
+        Args:
+            taggings: The (tag ID, naive UTC tagging time) pairs removed.
+        """
+        taggings = [(tag_id, _timestamp(when)) for tag_id, when in taggings]
+        if not taggings:
+            return
+
+        def apply(windows):
+            for window in windows.values():
+                for tag_id, timestamp in taggings:
+                    window.remove(tag_id, timestamp)
+        self._update(apply)
+
+    def forget(self, tag_id):
+        """Record that a tag was deleted, with all its taggings. Call after committing."""
+        def apply(windows):
+            for window in windows.values():
+                window.forget(tag_id)
+        self._update(apply)
+
+    def top(self, window, k):
+        """
+        Return the tags with the most posts tagged within a window.
+
+        Args:
+            window (str): '1h', '24h' or '7d'.
+            k (int): The maximum number of tags returned.
+
+        Returns:
+            A list of (tag ID, count) tuples, most posts first.
+        """
+        windows = self._current()
+        with self._lock:
+            return windows[window].top(k, _timestamp(_utcnow()))
+
+
+def trending_tags():
+    """Return the trending tag counters of the current application."""
+    return current_app.extensions['trending_tags']
+
+
+def trending_args():
+    """
+    Return the window and limit requested with the `window` and `limit` query parameters.
+
+    Raises:
+        ValidationError: If the window or limit is invalid.
+    """
+    window = request.args.get('window', DEFAULT_WINDOW)
+    if window not in WINDOWS:
+        raise ValidationError({'window': [f'Must be one of: {", ".join(WINDOWS)}.']})
+    return window, limit_arg(DEFAULT_TRENDING, MAX_TRENDING)